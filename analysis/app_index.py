@@ -0,0 +1,242 @@
+import argparse
+import functools
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# Query index for the app data (bila_app_stats.csv written by compute_zetas_par.R, or its PQL version
+# bila_app_stats_pql.csv written by incremental_scores.py).
+# The full table is converted once into a folder of .npy arrays (loaded memory-mapped) holding
+#   zeta.npy        languages x words matrix of L^lang scores (NaN where missing)
+#   by_word.npy     for each word, the languages sorted by decreasing zeta
+#   by_lang.npy     for each language, the words sorted by decreasing zeta
+#   area_*.npy, family_*.npy   for each area and family, the top words by mean zeta over its languages
+# with the sorted words, languages, areas and families as text files and the language metadata as a CSV.
+# Queries read only the rows they need and the most recent results are kept in an LRU cache, so the app
+# can serve the full vocabulary instead of bila_app_stats_6000.csv or bila_app_stats_2000.csv.
+
+# Examples (run from the analysis folder):
+# `python app_index.py build`
+# `python app_index.py word snow`
+# `python app_index.py lang stan1293`
+# `python app_index.py near 64.8 -147.7 --radius 1000`
+# `python app_index.py area Eurasia`
+
+app_stats_file = '../output/results/bila_app_stats.csv'
+index_dir = '../output/results/app_index/'
+
+# number of words stored for each area and family
+group_k = 200
+
+# number of query results kept in the LRU cache
+cachesize = 4096
+
+earth_radius = 6371.0
+
+lang_columns = ['glottocode', 'langname', 'area', 'langfamily', 'longitude', 'latitude']
+
+def read_labels(path):
+    with open(path) as f:
+        return f.read().split('\n')[:-1]
+
+def write_labels(path, labels):
+    with open(path, 'w') as f:
+        for label in labels:
+            f.write(label + '\n')
+
+# positions sorted by decreasing score along the last axis, with missing scores last
+def rank(scores):
+    return np.argsort(np.where(np.isnan(scores), np.inf, -scores), axis=-1, kind='stable')
+
+# the k positions with the highest scores, in decreasing order (missing scores last)
+def top_positions(scores, k):
+    keys = np.where(np.isnan(scores), np.inf, -scores)
+    if k < len(keys):
+        candidates = np.argpartition(keys, k)[:k]
+    else:
+        candidates = np.arange(len(keys))
+    return candidates[np.lexsort((candidates, keys[candidates]))]
+
+# (label, score) pairs for the labels with a score
+def scored(labels, scores):
+    present = ~np.isnan(scores)
+    return tuple(zip(labels[present], scores[present].tolist()))
+
+# mean over the rows of a languages x words block, ignoring missing scores
+def mean_scores(block):
+    block = np.asarray(block, dtype=float)
+    counts = (~np.isnan(block)).sum(axis=0)
+    return np.where(counts > 0, np.nansum(block, axis=0) / np.maximum(counts, 1), np.nan)
+
+# distances in km from (latitude, longitude) to arrays of latitudes and longitudes
+def haversine(latitude, longitude, latitudes, longitudes):
+    lat1, lon1, lat2, lon2 = map(np.radians, (latitude, longitude, latitudes, longitudes))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius * np.arcsin(np.sqrt(a))
+
+class AppIndex:
+
+    def __init__(self, zeta, by_word, by_lang, words, langs, langinfo, groups):
+        self.zeta = zeta
+        self.by_word = by_word
+        self.by_lang = by_lang
+        self.words = pd.Index(words, name='word')
+        self.langs = pd.Index(langs, name='glottocode')
+        self.langinfo = langinfo
+        # groups maps 'area' and 'family' to (labels, top word positions, top scores)
+        self.groups = groups
+        self.latitudes = langinfo['latitude'].to_numpy(dtype=float)
+        self.longitudes = langinfo['longitude'].to_numpy(dtype=float)
+        # queries are cached per index
+        self.top_languages = functools.lru_cache(maxsize=cachesize)(self._top_languages)
+        self.top_words = functools.lru_cache(maxsize=cachesize)(self._top_words)
+        self.top_group_words = functools.lru_cache(maxsize=cachesize)(self._top_group_words)
+        self.words_near = functools.lru_cache(maxsize=cachesize)(self._words_near)
+
+    @classmethod
+    def build(cls, path=app_stats_file):
+        app = pd.read_csv(path, keep_default_na=False, na_values=['NA'],
+                          dtype={'glottocode': str, 'word': str, 'langname': str, 'area': str, 'langfamily': str})
+        wordcodes, words = pd.factorize(app['word'], sort=True)
+        langcodes, langs = pd.factorize(app['glottocode'], sort=True)
+        # one row per language, so that the scores of a few languages are read from contiguous rows
+        zeta = np.full((len(langs), len(words)), np.nan, dtype=np.float32)
+        zeta[langcodes, wordcodes] = app['zeta'].to_numpy(dtype=np.float32)
+
+        langinfo = app[lang_columns].drop_duplicates('glottocode').set_index('glottocode').reindex(langs).rename_axis('glottocode').reset_index()
+        groups = {}
+        for group, column in [('area', 'area'), ('family', 'langfamily')]:
+            codes, labels = pd.factorize(langinfo[column].fillna('NA'), sort=True)
+            top = np.zeros((len(labels), min(group_k, len(words))), dtype=np.int32)
+            scores = np.zeros(top.shape, dtype=np.float32)
+            for i in range(len(labels)):
+                means = mean_scores(zeta[codes == i])
+                top[i] = rank(means)[:top.shape[1]]
+                scores[i] = means[top[i]]
+            groups[group] = (list(labels), top, scores)
+
+        index_dtype = np.int16 if max(len(words), len(langs)) < np.iinfo(np.int16).max else np.int32
+        by_word = rank(zeta.T).astype(index_dtype)
+        by_lang = rank(zeta).astype(np.int32)
+        return cls(zeta, by_word, by_lang, list(words), list(langs), langinfo, groups)
+
+    @classmethod
+    def load(cls, path=index_dir):
+        arrays = {name: np.load(path + name + '.npy', mmap_mode='r') for name in ['zeta', 'by_word', 'by_lang']}
+        groups = {}
+        for group in ['area', 'family']:
+            groups[group] = (read_labels(path + group + '.txt'),
+                             np.load(path + group + '_top.npy', mmap_mode='r'),
+                             np.load(path + group + '_scores.npy', mmap_mode='r'))
+        langinfo = pd.read_csv(path + 'langs.csv', keep_default_na=False, na_values=['NA'], dtype={'glottocode': str})
+        return cls(arrays['zeta'], arrays['by_word'], arrays['by_lang'], read_labels(path + 'words.txt'),
+                   list(langinfo['glottocode']), langinfo, groups)
+
+    def save(self, path=index_dir):
+        os.makedirs(path, exist_ok=True)
+        np.save(path + 'zeta.npy', self.zeta)
+        np.save(path + 'by_word.npy', self.by_word)
+        np.save(path + 'by_lang.npy', self.by_lang)
+        for group, (labels, top, scores) in self.groups.items():
+            write_labels(path + group + '.txt', labels)
+            np.save(path + group + '_top.npy', top)
+            np.save(path + group + '_scores.npy', scores)
+        write_labels(path + 'words.txt', self.words)
+        self.langinfo[lang_columns].to_csv(path + 'langs.csv', index=False, na_rep='NA')
+
+    def word_position(self, word):
+        position = self.words.get_indexer([word])[0]
+        if position < 0:
+            raise KeyError("word not in the app data: " + word)
+        return position
+
+    def lang_position(self, glottocode):
+        position = self.langs.get_indexer([glottocode])[0]
+        if position < 0:
+            raise KeyError("language not in the app data: " + glottocode)
+        return position
+
+    # results are tuples of (label, zeta) pairs so that cached results cannot be modified
+    # (missing scores are sorted last and left out, so there may be fewer than k results)
+
+    # languages with the highest zeta for a word
+    def _top_languages(self, word, k=10):
+        w = self.word_position(word)
+        positions = np.asarray(self.by_word[w, :k])
+        return scored(self.langs[positions], np.asarray(self.zeta[positions, w]))
+
+    # words with the highest zeta for a language
+    def _top_words(self, glottocode, k=10):
+        l = self.lang_position(glottocode)
+        positions = np.asarray(self.by_lang[l, :k])
+        return scored(self.words[positions], np.asarray(self.zeta[l, positions]))
+
+    # words with the highest mean zeta over the languages of an area or family (at most group_k words)
+    def _top_group_words(self, group, label, k=10):
+        labels, top, scores = self.groups[group]
+        if label not in labels:
+            raise KeyError("%s not in the app data: %s" % (group, label))
+        i = labels.index(label)
+        return scored(self.words[np.asarray(top[i, :k])], np.asarray(scores[i, :k]))
+
+    def top_area_words(self, area, k=10):
+        return self.top_group_words('area', area, k)
+
+    def top_family_words(self, family, k=10):
+        return self.top_group_words('family', family, k)
+
+    # positions of the languages within radius km of a point, nearest first, and their distances
+    def near_positions(self, latitude, longitude, radius=500.0):
+        distances = haversine(latitude, longitude, self.latitudes, self.longitudes)
+        near = np.flatnonzero(distances <= radius)
+        near = near[np.argsort(distances[near], kind='stable')]
+        return near, distances[near]
+
+    def languages_near(self, latitude, longitude, radius=500.0):
+        near, distances = self.near_positions(latitude, longitude, radius)
+        return list(self.langs[near]), distances
+
+    # words with the highest mean zeta over the languages within radius km of a point
+    def _words_near(self, latitude, longitude, radius=500.0, k=10):
+        near, _ = self.near_positions(latitude, longitude, radius)
+        if len(near) == 0:
+            return ()
+        means = mean_scores(self.zeta[np.sort(near)])
+        positions = top_positions(means, k)
+        return scored(self.words[positions], means[positions])
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the index of the app data.")
+    parser.add_argument("command", choices=['build', 'word', 'lang', 'area', 'family', 'near'], help="build the index, or the kind of query")
+    parser.add_argument("query", nargs='*', help="word, glottocode, area, family, or latitude and longitude")
+    parser.add_argument("--input", type=str, default=app_stats_file, help="app data to index (build)")
+    parser.add_argument("--index", type=str, default=index_dir, help="folder for the index")
+    parser.add_argument("--radius", type=float, default=500.0, help="radius in km (near)")
+    parser.add_argument("-k", type=int, default=10, help="number of results")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        index = AppIndex.build(args.input)
+        index.save(args.index)
+        print("indexed %d words x %d languages in %.1fs" % (len(index.words), len(index.langs), time.time() - start))
+        return
+
+    index = AppIndex.load(args.index)
+    start = time.time()
+    if args.command == 'word':
+        results = index.top_languages(args.query[0], args.k)
+    elif args.command == 'lang':
+        results = index.top_words(args.query[0], args.k)
+    elif args.command == 'near':
+        results = index.words_near(float(args.query[0]), float(args.query[1]), args.radius, args.k)
+    else:
+        results = index.top_group_words(args.command, ' '.join(args.query), args.k)
+    elapsed = time.time() - start
+    for label, zeta in results:
+        print("%s\t%.3f" % (label, zeta))
+    print("(%.3f ms)" % (elapsed * 1000))
+
+if __name__ == "__main__":
+    main()
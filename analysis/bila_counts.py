@@ -0,0 +1,184 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+# Sparse storage for the BILA dictionary x word counts.
+# A dataset such as bila_long_nounverbadj_full.csv is converted once into a folder under
+# ../data/biladataset/sparse/ holding the CSR arrays of the count matrix as .npy files (loaded
+# memory-mapped) and the sorted dictionary ids and words as text files. Dictionary metadata from
+# bila_dictionaries.csv (or bila_dictionaries_full.csv) is joined on load.
+
+# To build the sparse version of a dataset (run from the analysis folder):
+# `python bila_counts.py build nounverbadj_full`
+# To write it back out in the long and wide CSV formats:
+# `python bila_counts.py export nounverbadj_full --long out_long.csv --wide out_wide.csv`
+
+bila_dir = '../data/biladataset/'
+sparse_dir = bila_dir + 'sparse/'
+
+# metadata columns joined to each dictionary
+meta_columns = ['glottocode', 'glottolog_langname', 'area', 'langfamily', 'population', 'subsistence', 'longitude', 'latitude']
+
+def long_file(name):
+    return bila_dir + 'bila_long_' + name + '.csv'
+
+def dictionaries_file(name):
+    if name.endswith('full'):
+        return bila_dir + 'bila_dictionaries_full.csv'
+    return bila_dir + 'bila_dictionaries.csv'
+
+def read_labels(path):
+    with open(path) as f:
+        return f.read().split('\n')[:-1]
+
+def write_labels(path, labels):
+    with open(path, 'w') as f:
+        for label in labels:
+            f.write(label + '\n')
+
+def read_dictionaries(path, ids):
+    meta = pd.read_csv(path, usecols=['id'] + meta_columns, keep_default_na=False, na_values=['NA', ''])
+    meta = meta.drop_duplicates('id').set_index('id')
+    return meta.reindex(ids)
+
+class BilaCounts:
+
+    # matrix is a CSR matrix of counts with one row per id and one column per word
+    def __init__(self, matrix, ids, words, dictionaries=None):
+        self.matrix = matrix
+        self.ids = pd.Index(ids, name='id')
+        self.words = pd.Index(words, name='word')
+        self.dictionaries = dictionaries
+
+    @classmethod
+    def from_long(cls, counts, dictionaries=None):
+        rows, ids = pd.factorize(counts['id'], sort=True)
+        cols, words = pd.factorize(counts['word'], sort=True)
+        matrix = scipy.sparse.coo_matrix((counts['count'].to_numpy(dtype=np.int64), (rows, cols)),
+                                         shape=(len(ids), len(words))).tocsr()
+        return cls(matrix, list(ids), list(words), dictionaries)
+
+    @classmethod
+    def build(cls, name):
+        counts = pd.read_csv(long_file(name), usecols=['id', 'word', 'count'], dtype={'id': str, 'word': str},
+                             keep_default_na=False)
+        return cls.from_long(counts)
+
+    @classmethod
+    def load(cls, name, metadata=True):
+        path = sparse_dir + name + '/'
+        arrays = [np.load(path + part + '.npy', mmap_mode='r') for part in ['data', 'indices', 'indptr']]
+        ids = read_labels(path + 'ids.txt')
+        words = read_labels(path + 'words.txt')
+        matrix = scipy.sparse.csr_matrix(tuple(arrays), shape=(len(ids), len(words)), copy=False)
+        dictionaries = read_dictionaries(dictionaries_file(name), ids) if metadata else None
+        return cls(matrix, ids, words, dictionaries)
+
+    def save(self, name):
+        path = sparse_dir + name + '/'
+        os.makedirs(path, exist_ok=True)
+        matrix = self.matrix.tocsr()
+        matrix.sort_indices()
+        # a common index type lets scipy use the memory-mapped arrays without converting them
+        index_dtype = np.int32 if matrix.nnz < np.iinfo(np.int32).max else np.int64
+        np.save(path + 'data.npy', matrix.data.astype(np.int64))
+        np.save(path + 'indices.npy', matrix.indices.astype(index_dtype))
+        np.save(path + 'indptr.npy', matrix.indptr.astype(index_dtype))
+        write_labels(path + 'ids.txt', self.ids)
+        write_labels(path + 'words.txt', self.words)
+
+    def id_positions(self, ids):
+        positions = self.ids.get_indexer(ids)
+        if (positions < 0).any():
+            missing = [i for i, position in zip(ids, positions) if position < 0]
+            raise KeyError("ids not in the data set: " + ', '.join(missing[:10]))
+        return positions
+
+    def word_positions(self, words):
+        positions = self.words.get_indexer(words)
+        if (positions < 0).any():
+            missing = [word for word, position in zip(words, positions) if position < 0]
+            raise KeyError("words not in the data set: " + ', '.join(missing[:10]))
+        return positions
+
+    # the words recording dictionary totals (all_token_count_data etc)
+    def data_words(self):
+        return [word for word in self.words if word.endswith('_data')]
+
+    # subset of the counts for a list of ids and/or words (both in the given order)
+    def select(self, ids=None, words=None):
+        matrix = self.matrix
+        new_ids, new_words = self.ids, self.words
+        if ids is not None:
+            positions = self.id_positions(ids)
+            matrix = matrix[positions]
+            new_ids = self.ids[positions]
+        if words is not None:
+            positions = self.word_positions(words)
+            matrix = matrix[:, positions]
+            new_words = self.words[positions]
+        dictionaries = self.dictionaries.loc[new_ids] if self.dictionaries is not None else None
+        return BilaCounts(matrix.tocsr(), new_ids, new_words, dictionaries)
+
+    def ids_where(self, column, values):
+        return list(self.dictionaries.index[self.dictionaries[column].isin(values)])
+
+    def by_glottocode(self, glottocodes, words=None):
+        return self.select(ids=self.ids_where('glottocode', glottocodes), words=words)
+
+    def by_family(self, families, words=None):
+        return self.select(ids=self.ids_where('langfamily', families), words=words)
+
+    # dense data frame of counts (ids by words) for a list of words
+    def counts(self, words):
+        positions = self.word_positions(words)
+        return pd.DataFrame(self.matrix[:, positions].toarray(), index=self.ids, columns=self.words[positions])
+
+    # dictionary totals (all_token_count_data etc) with one row per dictionary
+    def totals(self):
+        return self.counts(self.data_words())
+
+    def to_long(self, path=None):
+        coo = self.matrix.tocoo()
+        order = np.lexsort((coo.col, coo.row))
+        long = pd.DataFrame({'id': np.asarray(self.ids)[coo.row[order]],
+                             'word': np.asarray(self.words)[coo.col[order]],
+                             'count': coo.data[order]})
+        if path is not None:
+            long.to_csv(path, index=False)
+        return long
+
+    # wide format (id followed by one column per word) written in blocks of rows
+    def to_wide(self, path, blocksize=100):
+        with open(path, 'w') as f:
+            for start in range(0, len(self.ids), blocksize):
+                block = self.matrix[start:start + blocksize].toarray()
+                wide = pd.DataFrame(block, columns=self.words)
+                wide.insert(0, 'id', self.ids[start:start + blocksize])
+                wide.to_csv(f, index=False, header=(start == 0))
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, inspect or export sparse BILA counts.")
+    parser.add_argument("command", choices=['build', 'info', 'export'], help="build from the long CSV, show a summary, or export to CSV")
+    parser.add_argument("name", type=str, help="data set, e.g. nounverbadj_full, noun or noun_lemmatized")
+    parser.add_argument("--long", type=str, help="path for the long-form CSV (export)")
+    parser.add_argument("--wide", type=str, help="path for the wide-form CSV (export)")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        BilaCounts.build(args.name).save(args.name)
+    start = time.time()
+    counts = BilaCounts.load(args.name)
+    print("%d dictionaries x %d words, %d nonzero counts (loaded in %.3fs)" %
+          (len(counts.ids), len(counts.words), counts.matrix.nnz, time.time() - start))
+    if args.command == 'export':
+        if args.long:
+            counts.to_long(args.long)
+        if args.wide:
+            counts.to_wide(args.wide)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import gzip
+import hashlib
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.io import netcdf_file
+from scipy.spatial import cKDTree
+
+# Monthly climate at the locations of the BILA languages, as in read_cru_ts4.07.R (temperature and
+# precipitation from CRU TS 4.07) and read_cru2.R (wind speed from CRU CL 2.0), without converting the grids
+# to points.
+# CRU TS files (netCDF classic) are memory-mapped, and CRU CL 2.0 text files are converted once to .npy
+# arrays next to them. Each language is matched to the nearest grid cell with data (as st_nearest_feature
+# does for the points of a raster, so that languages on small islands get the nearest land cell), using a
+# k-d tree of the cells on the unit sphere. The matches are cached for each grid in
+# ../../data/forpreprocessing/cru_index/ and only new coordinates are looked up on later runs.
+# The values of the matched cells are read a chunk of time steps at a time and added up by calendar month,
+# so that the monthly means over all years (monthavg) never need the whole time series in memory; as in the
+# R scripts, the output has the maximum, minimum and mean of the monthly means for each language.
+
+# Examples (run from the analysis/environment folder):
+# `python cru_climate.py ts` writes ../../data/foranalyses/environment_tmp_pre.csv
+# `python cru_climate.py cl --vars wnd --input ~/cru_cl_2.0/grid_10min_wnd.dat.gz` writes ../../data/foranalyses/environment_wnd.csv
+
+dictionaries_file = '../../data/biladataset/bila_dictionaries_full.csv'
+cru_ts_dir = '../../rawdata/downloaded/cru_4.07/'
+cru_cl_dir = '../../rawdata/downloaded/cru_cl_2.0/'
+index_dir = '../../data/forpreprocessing/cru_index/'
+output_dir = '../../data/foranalyses/'
+
+decades = ['1961.1970', '1971.1980', '1981.1990']
+
+# time steps read at a time
+chunksize = 120
+
+# mean radius of the earth in m (as used by s2 in sf)
+earth_radius = 6371010.0
+
+def cru_ts_file(varname, decade):
+    return cru_ts_dir + 'cru_ts4.07.' + decade + '.' + varname + '.dat.nc'
+
+def cru_cl_file(varname):
+    return cru_cl_dir + 'grid_10min_' + varname + '.dat.gz'
+
+def output_file(varnames):
+    return output_dir + 'environment_' + '_'.join(varnames) + '.csv'
+
+# distinct languages and coordinates of the dictionaries
+def read_locations(path=dictionaries_file):
+    dicts = pd.read_csv(path, usecols=['glottocode', 'longitude', 'latitude'], keep_default_na=False, na_values=['NA', ''])
+    return dicts.drop_duplicates().reset_index(drop=True)
+
+# points on the unit sphere
+def unit_vectors(latitudes, longitudes):
+    lat, lon = np.radians(latitudes), np.radians(longitudes)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+# a CRU TS variable (time x lat x lon) read from a memory-mapped netCDF classic file
+class NetcdfGrid:
+
+    def __init__(self, path, varname):
+        try:
+            self.file = netcdf_file(path, 'r', mmap=True, maskandscale=False)
+        except TypeError:
+            raise ValueError("%s is not a netCDF classic file (convert it with `nccopy -k classic`)" % path)
+        variable = self.file.variables[varname]
+        self.values = variable.data
+        self.scale = float(getattr(variable, 'scale_factor', 1.0))
+        self.offset = float(getattr(variable, 'add_offset', 0.0))
+        self.fill = getattr(variable, '_FillValue', getattr(variable, 'missing_value', None))
+        lat = self.file.variables['lat'].data.astype(float)
+        lon = self.file.variables['lon'].data.astype(float)
+        # cells with data in the first time step, in row-major order
+        self.rows, self.cols = np.nonzero(self.valid(self.values[0]))
+        self.latitudes, self.longitudes = lat[self.rows], lon[self.cols]
+
+    def valid(self, values):
+        missing = np.abs(values) > 1e30
+        if self.fill is not None:
+            missing |= values == self.fill
+        return ~missing
+
+    # calendar month (0-11) of each time step, from the time axis (days since a date)
+    def months(self):
+        time_var = self.file.variables['time']
+        units = time_var.units.decode() if isinstance(time_var.units, bytes) else time_var.units
+        origin = np.datetime64(pd.Timestamp(units.split('since')[1].strip()).date())
+        dates = origin + time_var.data.astype(np.int64).astype('timedelta64[D]')
+        return dates.astype('datetime64[M]').astype(np.int64) % 12
+
+    # values of some cells (positions in the cells with data) for time steps start:stop
+    def read(self, cells, start, stop):
+        block = self.values[start:stop][:, self.rows[cells], self.cols[cells]].astype(float)
+        block[~self.valid(block)] = np.nan
+        return block * self.scale + self.offset
+
+    def close(self):
+        # scipy only unmaps the file when no arrays refer to it
+        self.values = None
+        self.file.variables.clear()
+        self.file.close()
+
+# a CRU CL 2.0 climatology (lat, lon and 12 monthly values per line, land cells only), converted once to .npy
+class ClimatologyGrid:
+
+    def __init__(self, path):
+        cache = path.replace('.gz', '').replace('.dat', '') + '.npy'
+        if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(path):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt') as f:
+                table = np.loadtxt(f, usecols=range(14))
+            np.save(cache, table)
+        table = np.load(cache, mmap_mode='r')
+        self.latitudes = np.asarray(table[:, 0], dtype=float)
+        self.longitudes = np.asarray(table[:, 1], dtype=float)
+        # time steps are the 12 months
+        self.values = table[:, 2:]
+
+    def months(self):
+        return np.arange(12)
+
+    def read(self, cells, start, stop):
+        return np.asarray(self.values[cells, start:stop], dtype=float).T
+
+    def close(self):
+        self.values = None
+
+# fingerprint of the cells with data of a grid
+def grid_key(grid):
+    digest = hashlib.sha1()
+    digest.update(np.ascontiguousarray(grid.latitudes).tobytes())
+    digest.update(np.ascontiguousarray(grid.longitudes).tobytes())
+    return digest.hexdigest()
+
+# nearest cell with data (position in the cells of the grid) and its distance in m for each location
+def match_cells(grid, latitudes, longitudes):
+    tree = cKDTree(unit_vectors(grid.latitudes, grid.longitudes))
+    chord, cells = tree.query(unit_vectors(latitudes, longitudes))
+    return cells, 2 * earth_radius * np.arcsin(np.minimum(chord / 2, 1))
+
+# the cell index of a grid for a set of locations, from the cache where possible
+# (the cache holds the cells of all grids with the same name, identified by grid_key)
+def cell_index(grid, name, locations, path=index_dir):
+    cache = path + name + '.csv'
+    key = grid_key(grid)
+    coords = locations[['longitude', 'latitude']].dropna().drop_duplicates()
+    columns = ['key', 'longitude', 'latitude', 'cell', 'cru_distance']
+    cached = pd.read_csv(cache, dtype={'key': str}, float_precision='round_trip') if os.path.exists(cache) else pd.DataFrame(columns=columns)
+    index = cached[cached['key'] == key]
+    known = coords.merge(index[['longitude', 'latitude']], how='left', indicator=True)['_merge'].to_numpy() == 'both'
+    new = coords[~known]
+    if len(new):
+        cells, distances = match_cells(grid, new['latitude'].to_numpy(dtype=float), new['longitude'].to_numpy(dtype=float))
+        added = new.assign(key=key, cell=cells, cru_distance=distances)[columns]
+        # (concatenating with an empty frame would lose the column types)
+        index = pd.concat([index, added], ignore_index=True) if len(index) else added
+        cached = pd.concat([cached, added], ignore_index=True) if len(cached) else added
+        os.makedirs(path, exist_ok=True)
+        cached.to_csv(cache, index=False)
+    return locations.merge(index[['longitude', 'latitude', 'cell', 'cru_distance']], on=['longitude', 'latitude'], how='left'), len(new)
+
+# sums and numbers of values by calendar month (12 x cells) for some cells of a grid
+def monthly_sums(grid, cells, size=chunksize):
+    months = grid.months()
+    sums = np.zeros((12, len(cells)))
+    counts = np.zeros((12, len(cells)))
+    for start in range(0, len(months), size):
+        block = grid.read(cells, start, start + size)
+        present = ~np.isnan(block)
+        np.add.at(sums, months[start:start + size], np.where(present, block, 0))
+        np.add.at(counts, months[start:start + size], present)
+    return sums, counts
+
+# maxmonth, minmonth and avgmonth of the monthly means over all grids (e.g. the decades of CRU TS) for each cell
+def month_summary(grids, cells):
+    sums = np.zeros((12, len(cells)))
+    counts = np.zeros((12, len(cells)))
+    for grid in grids:
+        grid_sums, grid_counts = monthly_sums(grid, cells)
+        sums += grid_sums
+        counts += grid_counts
+    with np.errstate(invalid='ignore'):
+        monthavg = sums / counts
+    return monthavg.max(axis=0), monthavg.min(axis=0), monthavg.mean(axis=0)
+
+# avgmonth, minmonth and maxmonth of each variable for each location
+# open_grids(varname) returns the grids of a variable, which must all have the same cells
+def climate(locations, varnames, open_grids, name):
+    result = locations.copy()
+    nnew = 0
+    for varname in varnames:
+        grids = open_grids(varname)
+        # the grids are closed even after an error, before their memory-mapped arrays are garbage collected
+        try:
+            index, added = cell_index(grids[0], name, locations)
+            nnew += added
+            key = grid_key(grids[0])
+            for grid in grids[1:]:
+                if grid_key(grid) != key:
+                    raise ValueError("grids of %s do not have the same cells" % varname)
+            located = index['cell'].notna().to_numpy()
+            cells, positions = np.unique(index.loc[located, 'cell'].astype(np.int64), return_inverse=True)
+            maxmonth, minmonth, avgmonth = month_summary(grids, cells)
+        finally:
+            for grid in grids:
+                grid.close()
+        for column, values in [('avgmonth', avgmonth), ('minmonth', minmonth), ('maxmonth', maxmonth)]:
+            result[column + '_' + varname] = np.nan
+            result.loc[located, column + '_' + varname] = values[positions]
+    return result, nnew
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly climate at the locations of the BILA languages from CRU grids.")
+    parser.add_argument("source", choices=['ts', 'cl'], help="CRU TS 4.07 (netCDF, one file per decade) or CRU CL 2.0 (text)")
+    parser.add_argument("--vars", nargs='+', help="variables (default tmp pre for ts, wnd for cl)")
+    parser.add_argument("--decades", nargs='+', default=decades, help="decades of CRU TS files (ts)")
+    parser.add_argument("--input", type=str, help="CRU CL 2.0 file (cl, default %s)" % cru_cl_file('<var>'))
+    parser.add_argument("--dictionaries", type=str, default=dictionaries_file, help="dictionaries with glottocode, longitude and latitude")
+    parser.add_argument("--output", type=str, help="output file (default environment_<vars>.csv in %s)" % output_dir)
+    args = parser.parse_args()
+
+    start = time.time()
+    locations = read_locations(args.dictionaries)
+    if args.source == 'ts':
+        varnames = args.vars or ['tmp', 'pre']
+        open_grids = lambda varname: [NetcdfGrid(cru_ts_file(varname, decade), varname) for decade in args.decades]
+        name = 'cru_ts4.07'
+    else:
+        varnames = args.vars or ['wnd']
+        open_grids = lambda varname: [ClimatologyGrid(args.input or cru_cl_file(varname))]
+        name = 'cru_cl_2.0'
+    result, nnew = climate(locations, varnames, open_grids, name)
+    result.to_csv(args.output or output_file(varnames), index=False)
+    print("%d locations (%d new to the cell index), %s in %.1fs" % (len(result), nnew, ', '.join(varnames), time.time() - start))
+
+if __name__ == "__main__":
+    main()
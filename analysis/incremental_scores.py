@@ -0,0 +1,240 @@
+import argparse
+import hashlib
+import os
+import time
+import numpy as np
+import pandas as pd
+import zeta_scores
+
+# Incremental update of the L^lang scores and the app data after dictionaries are added, removed or recounted.
+# The state of the last run (in ../output/results/incremental/) records a fingerprint of the counts of
+# each word in d_wide.csv, the language and total of each dictionary, and the variances of the random
+# effects fitted for each word. When d_wide.csv changes:
+#   - words whose counts changed (or that are new) are fitted again in full with zeta_scores.py
+#   - for all other words, only the languages of the dictionaries that were added, removed or whose
+#     totals changed are fitted again, holding the variances of the word fixed at their last values
+#     (given the variances each language is fitted independently of the others)
+#   - rows for words and languages that have disappeared are dropped
+# and hierarchical_lr_lang_pql.csv and bila_app_stats_pql*.csv are rewritten with the updated rows.
+# The set-level model (~ (1 | dict)) pools all dictionaries, so when any dictionary is added, removed or
+# recounted, the set-level estimates (estimate_set, se_set) of the unchanged words are fitted again too, and
+# delta and zeta are recomputed for all their languages.
+# Updated rows are PQL estimates (see zeta_scores.py), so they are written next to the glmmTMB results of
+# compute_zetas_par.R (hierarchical_lr_lang.csv and bila_app_stats*.csv, which the analyses read) rather than
+# over them. The first run fits all words; later runs patch the results file written by the last run, whose
+# path is recorded in results.txt with the state. Use --full after large changes to the data.
+
+# Examples (run from the analysis folder, after preliminary_steps.Rmd has written a new d_wide.csv):
+# `python incremental_scores.py` fits all words the first time and updates the results after that
+
+results_dir = '../output/results/'
+results_file = zeta_scores.output_file(False)
+state_dir = results_dir + 'incremental/'
+dictionaries_file = '../data/biladataset/bila_dictionaries.csv'
+
+# columns of hierarchical_lr_lang.csv
+columns = ['word', 'estimate_set', 'se_set', 'convergence_set', 'estimate', 'se', 'lang', 'convergence', 'delta', 'zeta']
+
+# top words (by total count) in the smaller versions of the app data
+app_sizes = [6000, 2000]
+
+def app_file(size=None):
+    if size is None:
+        return results_dir + 'bila_app_stats_pql.csv'
+    return results_dir + 'bila_app_stats_pql_%d.csv' % size
+
+def state_files():
+    return state_dir + 'words.csv', state_dir + 'dictionaries.csv'
+
+# the results file described by the state
+def read_results_path():
+    path = state_dir + 'results.txt'
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip()
+
+def write_results_path(results):
+    os.makedirs(state_dir, exist_ok=True)
+    with open(state_dir + 'results.txt', 'w') as f:
+        f.write(os.path.abspath(results) + '\n')
+
+# fingerprint of the counts of each word: a hash of the dictionaries in which it occurs (count above the
+# smoothed zero) and its counts there, so that a dictionary in which a word does not occur leaves it unchanged
+def fingerprints(counts, dicts):
+    order = np.argsort(np.array(dicts, dtype=object))
+    sorted_dicts = np.array(dicts, dtype=object)[order]
+    counts = counts[:, order]
+    prints = []
+    for row in counts:
+        present = row > 1
+        h = hashlib.sha1('\n'.join(sorted_dicts[present]).encode('utf-8'))
+        h.update(row[present].astype(np.int64).tobytes())
+        prints.append(h.hexdigest())
+    return prints
+
+def read_state():
+    wordfile, dictfile = state_files()
+    if not (os.path.exists(wordfile) and os.path.exists(dictfile)):
+        return None, None
+    words = pd.read_csv(wordfile, keep_default_na=False, na_values=['NA'], dtype={'word': str, 'fingerprint': str}).set_index('word')
+    dicts = pd.read_csv(dictfile, keep_default_na=False, na_values=['NA'], dtype={'dict': str, 'lang': str}).set_index('dict')
+    return words, dicts
+
+def write_state(words, prints, tau2, dicts, langs, totals):
+    os.makedirs(state_dir, exist_ok=True)
+    wordfile, dictfile = state_files()
+    pd.DataFrame({'word': words, 'fingerprint': prints,
+                  'tau2_dict': tau2}).to_csv(wordfile, index=False, na_rep='NA')
+    pd.DataFrame({'dict': dicts, 'lang': langs, 'total': totals}).to_csv(dictfile, index=False, na_rep='NA')
+
+def read_results(path=results_file):
+    return pd.read_csv(path, keep_default_na=False, na_values=['NA'], dtype={'word': str, 'lang': str})
+
+# as in compute_zetas_par.R: one row per language with the most common glottolog name
+def my_mode(x):
+    values = list(x)
+    unique = list(dict.fromkeys(values))
+    return max(unique, key=lambda value: (values.count(value), -unique.index(value)))
+
+def lang_data(path=dictionaries_file):
+    d = pd.read_csv(path, keep_default_na=False, na_values=['NA', ''])
+    d = d.drop(columns='langname').rename(columns={'glottolog_langname': 'langname'})
+    d = d[['langname', 'glottocode', 'area', 'langfamily', 'longitude', 'latitude']].drop_duplicates()
+    keys = ['glottocode', 'area', 'langfamily', 'longitude', 'latitude']
+    return d.groupby(keys, dropna=False)['langname'].agg(my_mode).reset_index()
+
+def write_app_stats(allw, words, counts, langinfo):
+    app = allw[['lang', 'word', 'zeta']].rename(columns={'lang': 'glottocode'})
+    app = app.merge(langinfo, on='glottocode', how='left')
+    # arrange(desc(zeta)) keeps ties in their original order and puts missing values last
+    app = app.iloc[np.argsort(-app['zeta'].to_numpy(), kind='stable')].reset_index(drop=True)
+    app.to_csv(app_file(), index=False, na_rep='NA')
+
+    word_counts = pd.Series(counts.sum(axis=1), index=pd.Index(words, name='word')).groupby(level=0).sum()
+    word_counts = word_counts.iloc[np.argsort(-word_counts.to_numpy(), kind='stable')]
+    for size in app_sizes:
+        top = word_counts.index[:size]
+        app[app['word'].isin(top)].to_csv(app_file(size), index=False, na_rep='NA')
+
+# order rows as a full run would: words in the order of d_wide.csv, languages sorted
+def sort_results(allw, words):
+    position = pd.Series(np.arange(len(words)), index=words)
+    order = np.lexsort((allw['lang'].to_numpy().astype(str), position.loc[allw['word']].to_numpy()))
+    return allw.iloc[order].reset_index(drop=True)
+
+# set-level estimates (estimate_set, se_set, convergence_set) of the given words (rows of counts)
+def refit_sets(counts, totals, words):
+    nodict = np.zeros(len(totals), dtype=int)
+    results = []
+    for start in range(0, len(words), zeta_scores.batchsize):
+        y = counts[start:start + zeta_scores.batchsize]
+        beta_set, se_set, _, conv_set, _ = zeta_scores.fit_pql(y, totals, nodict)
+        results.append(pd.DataFrame({'estimate_set': beta_set[:, 0], 'se_set': se_set[:, 0],
+                                     'convergence_set': zeta_scores.convergence_labels(conv_set)},
+                                    index=pd.Index(words[start:start + zeta_scores.batchsize], name='word')))
+    return pd.concat(results)
+
+# fit the languages in affected_langs for the given words (rows of counts) with fixed variances
+def refit_languages(counts, totals, langs, tau2, affected_langs, words):
+    selected = np.isin(langs, list(affected_langs))
+    results = []
+    for start in range(0, len(words), zeta_scores.batchsize):
+        y = counts[start:start + zeta_scores.batchsize][:, selected]
+        batch = np.array(words[start:start + zeta_scores.batchsize], dtype=object)
+        fixed = np.column_stack([tau2[start:start + zeta_scores.batchsize], np.zeros(len(batch))])
+        beta, se, levels, conv, _ = zeta_scores.fit_pql(y, totals[selected], langs[selected], tau2=fixed)
+        nlevels = len(levels)
+        results.append(pd.DataFrame({'word': np.repeat(batch, nlevels),
+                                     'estimate': beta.ravel(),
+                                     'se': se.ravel(),
+                                     'lang': np.tile(np.array(levels, dtype=object), len(batch)),
+                                     'convergence': np.repeat(zeta_scores.convergence_labels(conv), nlevels)}))
+    return pd.concat(results, ignore_index=True)
+
+# rows of the unchanged words after a change in the dictionaries: the set-level model is fitted again, the
+# languages in refit_langs are fitted again with fixed variances, and the estimates of the other languages
+# are kept
+def refit_unchanged(counts, totals, langs, tau2, refit_langs, words, kept):
+    sets = refit_sets(counts, totals, words)
+    langcols = ['word', 'estimate', 'se', 'lang', 'convergence']
+    parts = [kept[langcols]]
+    if refit_langs:
+        parts.append(refit_languages(counts, totals, langs, tau2, refit_langs, words))
+    rows = pd.concat(parts, ignore_index=True).join(sets, on='word')
+    return zeta_scores.add_zetas(rows[columns[:-2]])
+
+def full_run(words, dicts, counts, totals, langs):
+    allw, variances = zeta_scores.fit_words(words, counts, totals, langs, langs)
+    return allw, variances[:, 0]
+
+def update(args):
+    start = time.time()
+    words, dicts, counts, totals, langs, families = zeta_scores.read_d_wide(args.input)
+    prints = fingerprints(counts, dicts)
+    print("read %d words x %d dictionaries in %.1fs" % (len(words), len(dicts), time.time() - start))
+
+    start = time.time()
+    state_words, state_dicts = read_state()
+    # only the results written by the last run are patched
+    described = read_results_path() == os.path.abspath(args.results)
+    if state_words is not None and not args.full and os.path.exists(args.results) and not described:
+        print("the state does not describe %s: fitting all words" % args.results)
+    if state_words is None or args.full or not os.path.exists(args.results) or not described:
+        allw, tau2 = full_run(words, dicts, counts, totals, langs)
+        print("fitted %d words in %.1fs" % (len(words), time.time() - start))
+    else:
+        previous = read_results(args.results)
+        old_prints = state_words['fingerprint'].reindex(words)
+        changed = np.asarray(old_prints.isna() | (old_prints.to_numpy() != np.array(prints)))
+
+        # dictionaries that were added or removed, or whose language or total changed
+        now = pd.DataFrame({'lang': langs, 'total': totals}, index=pd.Index(dicts, name='dict'))
+        before = state_dicts.reindex(now.index)
+        modified = before['lang'].isna() | (before['lang'] != now['lang']) | ~np.isclose(before['total'], now['total'])
+        removed = state_dicts.index.difference(now.index)
+        affected_langs = set(now.loc[modified, 'lang']) | set(before.loc[modified, 'lang'].dropna()) | set(state_dicts.loc[removed, 'lang'])
+        current_langs = set(langs)
+        print("%d changed words, %d changed dictionaries, %d affected languages" %
+              (changed.sum(), modified.sum() + len(removed), len(affected_langs)))
+
+        tau2 = state_words['tau2_dict'].reindex(words).to_numpy(copy=True)
+        keep = previous['word'].isin(words) & previous['lang'].isin(current_langs)
+        keep &= ~previous['word'].isin(np.array(words, dtype=object)[changed]) & ~previous['lang'].isin(affected_langs)
+        parts = []
+
+        if changed.any():
+            changed_words = list(np.array(words, dtype=object)[changed])
+            allw_changed, tau2_changed = full_run(changed_words, dicts, counts[changed], totals, langs)
+            tau2[changed] = tau2_changed
+            parts.append(allw_changed[columns])
+
+        if (modified.any() or len(removed)) and (~changed).any():
+            unchanged_words = list(np.array(words, dtype=object)[~changed])
+            parts.append(refit_unchanged(counts[~changed], totals, langs, tau2[~changed], affected_langs & current_langs,
+                                         unchanged_words, previous[keep]))
+            nkept = 0
+        else:
+            parts.append(previous.loc[keep, columns])
+            nkept = keep.sum()
+        allw = sort_results(pd.concat(parts, ignore_index=True), words)
+        print("updated %d of %d rows in %.1fs" % (allw.shape[0] - nkept, allw.shape[0], time.time() - start))
+
+    allw.to_csv(args.results, index=False, na_rep='NA')
+    if not args.no_app:
+        write_app_stats(allw, words, counts, lang_data(args.dictionaries))
+    write_state(words, prints, tau2, dicts, langs, totals)
+    write_results_path(args.results)
+
+def main():
+    parser = argparse.ArgumentParser(description="Update L^lang scores and the app data for changes in d_wide.csv.")
+    parser.add_argument("--input", type=str, default=zeta_scores.d_wide_file, help="data for the hierarchical model (d_wide.csv)")
+    parser.add_argument("--results", type=str, default=results_file, help="L^lang scores to update")
+    parser.add_argument("--dictionaries", type=str, default=dictionaries_file, help="dictionary metadata for the app data")
+    parser.add_argument("--full", action='store_true', help="fit all words again")
+    parser.add_argument("--no-app", action='store_true', help="do not rewrite bila_app_stats_pql*.csv")
+    args = parser.parse_args()
+    update(args)
+
+if __name__ == "__main__":
+    main()
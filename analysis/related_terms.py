@@ -0,0 +1,215 @@
+import argparse
+import functools
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.utils.extmath import randomized_svd
+from bila_counts import BilaCounts, read_labels, write_labels
+
+# Related terms for the app, from word embeddings of the sparse BILA counts (see bila_counts.py).
+# By default the counts are those of relatedtermsforapp.Rmd, which reads d_long_nounverbadj.csv: the standard
+# version of the noun/verb/adj counts (nounverbadj) without the stop words of preliminary_steps.Rmd
+# (../data/foranalyses/stopwords.txt). Other data sets (e.g. nounverbadj_full) give different neighbours.
+# As in relatedtermsforapp.Rmd (wordspace), the word x dictionary counts are scored with sparse simple-ll
+# (only positive associations are kept), log-transformed and normalized to unit length, and projected to
+# 250 dimensions with a truncated SVD, here a randomized one. The embeddings (and the same scaled to unit
+# length) are stored as float32 matrices in ../output/results/related_index/ and loaded memory-mapped.
+# Neighbours are the words with the smallest angle (highest cosine similarity), excluding the word itself,
+# as for wordspace's nearest.neighbours(). The neighbours of every word are found by a blocked exact search (a matrix product
+# for a block of words at a time) and stored with the index; other queries are answered online.
+
+# Examples (run from the analysis folder, after `python bila_counts.py build nounverbadj`):
+# `python related_terms.py build`
+# `python related_terms.py word snow`
+# `python related_terms.py export` writes ../output/results/bila_app_nn.csv for every word
+# `python related_terms.py export --words ../output/results/bila_app_stats_2000.csv --output ../output/results/bila_app_nn_2000.csv`
+
+index_dir = '../output/results/related_index/'
+nn_file = '../output/results/bila_app_nn.csv'
+stopwords_file = '../data/foranalyses/stopwords.txt'
+
+# data set used by relatedtermsforapp.Rmd (d_long_nounverbadj.csv)
+default_counts = 'nounverbadj'
+
+# dimensions of the embeddings
+dimensions = 250
+
+# neighbours stored for each word
+stored_k = 50
+
+# words searched at a time
+blocksize = 512
+
+# number of query results kept in the LRU cache
+cachesize = 4096
+
+# word x dictionary scores: sparse simple-ll (zero where observed <= expected), log(1 + x), unit rows
+def score_counts(matrix):
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=float)
+    rowsums = np.asarray(matrix.sum(axis=1)).ravel()
+    colsums = np.asarray(matrix.sum(axis=0)).ravel()
+    coo = matrix.tocoo()
+    observed = coo.data
+    expected = rowsums[coo.row] * colsums[coo.col] / matrix.sum()
+    ll = np.where(observed > expected, 2 * (observed * np.log(observed / expected) - (observed - expected)), 0)
+    scores = scipy.sparse.csr_matrix((np.log1p(ll), (coo.row, coo.col)), shape=matrix.shape)
+    scores.eliminate_zeros()
+    norms = np.sqrt(np.asarray(scores.multiply(scores).sum(axis=1)).ravel())
+    return scipy.sparse.diags(np.where(norms > 0, 1 / np.maximum(norms, 1e-300), 0)) @ scores
+
+# projection of the rows onto the first n singular vectors (U * S, as dsm.projection(method="svd"))
+def embed(scores, n=dimensions, seed=0):
+    n = min(n, min(scores.shape) - 1)
+    u, s, _ = randomized_svd(scores, n, random_state=seed)
+    return (u * s).astype(np.float32)
+
+def unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.where(norms > 0, vectors / np.maximum(norms, 1e-30), 0).astype(np.float32)
+
+# the k most similar rows of units for each row of queries (positions and cosines), excluding the
+# positions given in exclude (one per query, -1 for none), in decreasing order of similarity
+def nearest(queries, units, k, exclude=None, size=blocksize):
+    k = min(k, len(units) - 1)
+    positions = np.zeros((len(queries), k), dtype=np.int32)
+    cosines = np.zeros((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), size):
+        sims = np.asarray(queries[start:start + size]) @ np.asarray(units).T
+        rows = np.arange(len(sims))
+        if exclude is not None:
+            own = exclude[start:start + size]
+            sims[rows[own >= 0], own[own >= 0]] = -np.inf
+        candidates = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        values = sims[rows[:, None], candidates]
+        order = np.lexsort((candidates, -values))
+        positions[start:start + size] = np.take_along_axis(candidates, order, axis=1)
+        cosines[start:start + size] = np.take_along_axis(values, order, axis=1)
+    return positions, cosines
+
+class RelatedTerms:
+
+    # vectors are the embeddings (words x dimensions) and units the same scaled to unit length, neighbours and
+    # cosines the stored neighbours of each word
+    def __init__(self, vectors, words, units=None, neighbours=None, cosines=None):
+        self.vectors = vectors
+        self.words = pd.Index(words, name='word')
+        self.units = unit_rows(vectors) if units is None else units
+        self.neighbours = neighbours
+        self.cosines = cosines
+        self.related = functools.lru_cache(maxsize=cachesize)(self._related)
+
+    # words in exclude (e.g. stop words) are left out, like the dictionary totals
+    @classmethod
+    def build(cls, counts, n=dimensions, k=stored_k, seed=0, exclude=()):
+        exclude = set(exclude)
+        words = [word for word in counts.words if not word.endswith('_data') and word not in exclude]
+        matrix = counts.select(words=words).matrix.T.tocsr()
+        # words that do not occur in the selected dictionaries have no embedding
+        present = np.diff(matrix.indptr) > 0
+        vectors = embed(score_counts(matrix[present]), n, seed)
+        index = cls(vectors, list(np.array(words, dtype=object)[present]))
+        if k:
+            index.neighbours, index.cosines = nearest(index.units, index.units, k, np.arange(len(vectors)))
+        return index
+
+    @classmethod
+    def load(cls, path=index_dir):
+        arrays = {}
+        for name in ['vectors', 'units', 'neighbours', 'cosines']:
+            arrays[name] = np.load(path + name + '.npy', mmap_mode='r') if os.path.exists(path + name + '.npy') else None
+        return cls(arrays['vectors'], read_labels(path + 'words.txt'), arrays['units'], arrays['neighbours'], arrays['cosines'])
+
+    def save(self, path=index_dir):
+        os.makedirs(path, exist_ok=True)
+        np.save(path + 'vectors.npy', np.asarray(self.vectors, dtype=np.float32))
+        np.save(path + 'units.npy', np.asarray(self.units, dtype=np.float32))
+        if self.neighbours is not None:
+            np.save(path + 'neighbours.npy', self.neighbours)
+            np.save(path + 'cosines.npy', self.cosines)
+        write_labels(path + 'words.txt', self.words)
+
+    def word_positions(self, words):
+        positions = self.words.get_indexer(words)
+        if (positions < 0).any():
+            missing = [word for word, position in zip(words, positions) if position < 0]
+            raise KeyError("words not in the index: " + ', '.join(missing[:10]))
+        return positions
+
+    # the k words most related to each of a list of words (positions and cosines), from the stored
+    # neighbours when there are enough of them
+    def neighbour_positions(self, words, k=10):
+        positions = self.word_positions(words)
+        if self.neighbours is not None and k <= self.neighbours.shape[1]:
+            return np.asarray(self.neighbours[positions, :k]), np.asarray(self.cosines[positions, :k])
+        return nearest(self.units[positions], self.units, k, positions)
+
+    # results are tuples of (word, cosine) pairs so that cached results cannot be modified
+    def _related(self, word, k=10):
+        positions, cosines = self.neighbour_positions([word], k)
+        return tuple(zip(self.words[positions[0]], cosines[0].tolist()))
+
+    # words most related to a vector, e.g. the sum of the embeddings of several words
+    def related_to_vector(self, vector, k=10):
+        query = unit_rows(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+        positions, cosines = nearest(query, self.units, k)
+        return list(zip(self.words[positions[0]], cosines[0].tolist()))
+
+    # neighbours of a list of words in the format of bila_app_nn_2000.csv (word, neighbour, i), with empty
+    # neighbours for words that are not in the index
+    def neighbour_table(self, words, k=10):
+        words = list(words)
+        known = self.words.get_indexer(words) >= 0
+        neighbours = np.full((len(words), k), '', dtype=object)
+        if known.any():
+            positions, _ = self.neighbour_positions(np.array(words, dtype=object)[known], k)
+            neighbours[known, :positions.shape[1]] = np.asarray(self.words)[positions]
+        return pd.DataFrame({'word': np.repeat(words, k), 'neighbour': neighbours.ravel(), 'i': np.tile(np.arange(1, k + 1), len(words))})
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the related terms index.")
+    parser.add_argument("command", choices=['build', 'word', 'export'], help="build the index, query a word, or write the neighbours of all words")
+    parser.add_argument("query", nargs='*', help="data set to build from (default %s) or words to query" % default_counts)
+    parser.add_argument("--ids", type=str, help="CSV file whose id (or dict) column lists the dictionaries used (build)")
+    parser.add_argument("--stopwords", type=str, default=stopwords_file, help="words left out of the embeddings (build, 'none' for none)")
+    parser.add_argument("--dimensions", type=int, default=dimensions, help="dimensions of the embeddings (build)")
+    parser.add_argument("--store", type=int, default=stored_k, help="neighbours stored for each word (build)")
+    parser.add_argument("--index", type=str, default=index_dir, help="folder for the index")
+    parser.add_argument("--words", type=str, help="CSV file whose word column lists the words to export (default all words)")
+    parser.add_argument("--output", type=str, default=nn_file, help="output file (export)")
+    parser.add_argument("-k", type=int, default=10, help="number of neighbours")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        counts = BilaCounts.load(args.query[0] if args.query else default_counts, metadata=False)
+        if args.ids:
+            ids = pd.read_csv(args.ids, dtype=str, keep_default_na=False)
+            try:
+                counts = counts.select(ids=ids['id' if 'id' in ids else 'dict'].unique())
+            except KeyError as e:
+                parser.error("%s: %s" % (args.ids, e.args[0]))
+        stopwords = []
+        if args.stopwords != 'none':
+            if not os.path.exists(args.stopwords):
+                parser.error("%s not found: run preliminary_steps.Rmd, or use --stopwords none" % args.stopwords)
+            stopwords = read_labels(args.stopwords)
+        index = RelatedTerms.build(counts, args.dimensions, args.store, exclude=stopwords)
+        index.save(args.index)
+        print("embedded %d words from %d dictionaries in %.1fs" % (len(index.words), len(counts.ids), time.time() - start))
+        return
+
+    index = RelatedTerms.load(args.index)
+    start = time.time()
+    if args.command == 'export':
+        words = pd.read_csv(args.words, dtype={'word': str}, keep_default_na=False)['word'].unique() if args.words else index.words
+        index.neighbour_table(words, args.k).to_csv(args.output, index=False)
+        print("wrote the neighbours of %d words (%.1fs)" % (len(words), time.time() - start))
+        return
+    for word in args.query:
+        print(word + ': ' + ', '.join('%s (%.3f)' % pair for pair in index.related(word, args.k)))
+    print("(%.3f ms)" % ((time.time() - start) * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import argparse
+import multiprocessing
+import time
+import numpy as np
+import pandas as pd
+
+# Permutation tests and bootstrap confidence intervals for the ranks of L^lang scores, as batched NumPy
+# operations instead of one sample() call per resample in R.
+# Resamples are drawn in chunks of rows (each a permutation or a bootstrap sample), so that memory stays
+# bounded by `chunk_elements` whatever the number of resamples, and each chunk has its own seed (spawned
+# from --seed) so that the results are the same with any number of --jobs.
+#   - the "other vs nature" test of analyze_claims.Rmd permutes the chapter labels of the concepts: the
+#     difference of the group means is computed from the first rows of a permuted index matrix
+#   - for each claim (and for each word with `words`), the ranks of the languages are compared with those of
+#     random sets of languages of the same size: ranks are the integers 1..N of the N languages scored for
+#     the concept, so the first k columns of one matrix of permutations of 1..N give the null distribution
+#     of the sum of k ranks for every k, shared by all claims and words with the same N (when k is small
+#     only the first k columns are drawn)
+#   - bootstrap intervals of the mean rank of the languages of each claim (or word) come from a histogram
+#     of the resampled sums of ranks, which are integers, so the percentiles are exact without keeping
+#     every resample
+# Ranks are computed as in analyze_claims.Rmd: frank(zeta, ties.method = "random") / N within each concept.
+
+# Examples (run from the analysis folder):
+# `python resampling.py claims`
+# `python resampling.py claims --robust --nperm 1000000 --jobs 8`
+# `python resampling.py words --langs nort2671,stan1293 --input ../output/results/hierarchical_lr_lang.csv`
+
+results_dir = '../output/results/'
+ids_parameters_file = '../rawdata/downloaded/ids_parameters.csv'
+ids_chapters_file = '../rawdata/downloaded/ids_chapters.csv'
+
+# values held in memory by a chunk of resamples (rows x columns of its index matrix)
+chunk_elements = 1 << 23
+
+# concepts assigned to IDS chapters by hand in analyze_claims.Rmd
+chapter_overrides = {1: ["rock", "soil", "lava", "stars", "wind"],
+                     3: ["reindeer", "terrestrialmammals", "insects", "kangaroo", "crustaceans", "mollusc", "emus", "chrysalis", "locust", "eels"],
+                     8: ["tree", "pandanus", "breadfruit", "taro", "corn", "shrub", "banana", "gardening", "fruit"]}
+chapter_names = {"Animals": "Animals", "Agriculture and vegetation": "Plants", "The physical world": "Physical world"}
+
+def claims_files(robust=False):
+    suffix = '_robust' if robust else ''
+    return (results_dir + 'claims_lr_lang' + suffix + '.csv', results_dir + 'claims_lr_lang_full' + suffix + '.csv',
+            results_dir + 'claims_resampling' + suffix + '.csv')
+
+# random permutations of range(n), one per row
+def permutation_matrix(rng, size, n):
+    return rng.permuted(np.tile(np.arange(n, dtype=np.int32), (size, 1)), axis=1)
+
+# the first k columns of random permutations of range(n): when k is small compared with n, rows of k values
+# drawn with replacement are drawn again until their values are distinct, which avoids permuting all n values
+def first_columns(rng, size, n, k):
+    if k * k > n:
+        return permutation_matrix(rng, size, n)[:, :k]
+    rows = rng.integers(0, n, size=(size, k), dtype=np.int32)
+    redraw = np.arange(size)
+    while len(redraw):
+        values = np.sort(rows[redraw], axis=1)
+        redraw = redraw[(values[:, 1:] == values[:, :-1]).any(axis=1)]
+        rows[redraw] = rng.integers(0, n, size=(len(redraw), k), dtype=np.int32)
+    return rows
+
+# numbers of rows of the chunks for nresamples resamples with `width` values each
+def chunk_sizes(nresamples, width):
+    rows = max(1, chunk_elements // max(width, 1))
+    return [min(rows, nresamples - start) for start in range(0, nresamples, rows)]
+
+def _call(task):
+    return task[0](*task[1:])
+
+# results of func(seed, size, *args) for each chunk, in order, computed in a pool of jobs processes if jobs > 1
+# (the results are yielded as they come, so that callers can add them up without keeping them all)
+def run_chunks(func, sizes, args, seed=0, jobs=1):
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(func, child, size) + tuple(args) for child, size in zip(seeds, sizes)]
+    if jobs > 1 and len(tasks) > 1:
+        with multiprocessing.get_context('fork').Pool(min(jobs, len(tasks))) as pool:
+            yield from pool.imap(_call, tasks)
+    else:
+        for task in tasks:
+            yield _call(task)
+
+# percentiles as R's quantile() (type 7) from the counts of the integer values 0, 1, ... (one row per group)
+def histogram_quantiles(counts, probs):
+    cumulative = np.cumsum(counts, axis=1)
+    n = cumulative[:, -1]
+    result = np.zeros((len(counts), len(probs)))
+    for i, p in enumerate(probs):
+        h = (n - 1) * p
+        lo = np.floor(h).astype(np.int64)
+        for g in range(len(counts)):
+            # the lo-th and (lo + 1)-th smallest values
+            below, above = np.searchsorted(cumulative[g], [lo[g], min(lo[g] + 1, n[g] - 1)], side='right')
+            result[g, i] = below + (h[g] - lo[g]) * (above - below)
+    return result
+
+# differences of the group means (first minus second) with the labels permuted
+def _permuted_differences(seed, size, values, nfirst):
+    rng = np.random.default_rng(seed)
+    first = values[permutation_matrix(rng, size, len(values))[:, :nfirst]].sum(axis=1)
+    return first / nfirst - (values.sum() - first) / (len(values) - nfirst)
+
+# two-sample permutation test of the difference of means, as in analyze_claims.Rmd
+# returns the attested difference, the 95th percentile of the permuted differences and the share above the attested one
+def permutation_test(values, first, nperm=10000, seed=0, jobs=1):
+    values = np.asarray(values, dtype=float)
+    first = np.asarray(first, dtype=bool)
+    nfirst = int(first.sum())
+    attested = values[first].mean() - values[~first].mean()
+    differences = np.concatenate(list(run_chunks(_permuted_differences, chunk_sizes(nperm, len(values)), (values, nfirst), seed, jobs)))
+    return {'attested': attested, 'thresh_95': np.quantile(differences, 0.95),
+            'p_val': np.mean(differences > attested), 'nperm': nperm}
+
+# numbers of resamples in which the sum of k random ranks out of 1..n is at least the observed sum, for each (k, sum)
+def _rank_exceedances(seed, size, n, ks, observed):
+    rng = np.random.default_rng(seed)
+    sums = np.cumsum(first_columns(rng, size, n, ks.max()) + 1, axis=1, dtype=np.int64)
+    counts = np.zeros(len(ks), dtype=np.int64)
+    for k in np.unique(ks):
+        null = np.sort(sums[:, k - 1])
+        rows = ks == k
+        counts[rows] = size - np.searchsorted(null, observed[rows], side='left')
+    return counts
+
+# one-sided p values of sums of ranks (k ranks out of 1..n for each group) against random sets of k ranks
+def rank_pvalues(n, ks, observed, nperm=10000, seed=0, jobs=1):
+    n, ks, observed = np.asarray(n), np.asarray(ks), np.asarray(observed)
+    pvals = np.full(len(ks), np.nan)
+    for i, value in enumerate(np.unique(n)):
+        rows = np.flatnonzero((n == value) & (ks > 0))
+        if len(rows) == 0:
+            continue
+        chunks = run_chunks(_rank_exceedances, chunk_sizes(nperm, value), (value, ks[rows], observed[rows]), [seed, i], jobs)
+        pvals[rows] = sum(chunks) / nperm
+    return pvals
+
+# histograms (groups x nbins) of the sums of bootstrap samples of the rows of values (groups x k)
+def _bootstrap_histogram(seed, size, values, nbins):
+    rng = np.random.default_rng(seed)
+    ngroups, k = values.shape
+    sums = values[:, rng.integers(0, k, size=(size, k))].sum(axis=2)
+    offsets = np.arange(ngroups)[:, None] * nbins
+    return np.bincount((sums + offsets).ravel(), minlength=ngroups * nbins).reshape(ngroups, nbins)
+
+# percentile bootstrap intervals of the mean of each group of nonnegative integers (a list of arrays)
+def bootstrap_intervals(groups, nboot=10000, level=0.95, seed=0, jobs=1):
+    probs = [(1 - level) / 2, (1 + level) / 2]
+    sizes = np.array([len(group) for group in groups])
+    intervals = np.full((len(groups), 2), np.nan)
+    # groups of the same size are resampled together, as many at a time as have histograms of chunk_elements bins
+    for i, k in enumerate(np.unique(sizes[sizes > 0])):
+        same = np.flatnonzero(sizes == k)
+        nbins = int(max(groups[row].max() for row in same)) * k + 1
+        batch = max(1, chunk_elements // nbins)
+        for j, start in enumerate(range(0, len(same), batch)):
+            rows = same[start:start + batch]
+            values = np.array([groups[row] for row in rows], dtype=np.int64)
+            counts = sum(run_chunks(_bootstrap_histogram, chunk_sizes(nboot, len(rows) * k), (values, nbins), [seed, i, j], jobs))
+            intervals[rows] = histogram_quantiles(counts, probs) / k
+    return intervals
+
+# integer ranks of the zetas within each item (1 for the lowest, ties in random order) and the number of ranked rows
+def rank_zetas(table, item, seed=0):
+    rng = np.random.default_rng(seed)
+    zeta = table['zeta'].to_numpy(dtype=float)
+    codes = pd.factorize(table[item])[0]
+    order = np.lexsort((rng.random(len(table)), zeta, codes))
+    ranked = ~np.isnan(zeta[order])
+    counts = pd.Series(codes[order][ranked]).value_counts().reindex(np.arange(codes.max() + 1), fill_value=0).to_numpy()
+    ranks = np.full(len(table), np.nan)
+    # NaN zetas sort last within each item
+    ranks[order[ranked]] = np.arange(ranked.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    return ranks, counts[codes]
+
+# claims with the ranks of their languages, one row per claim as in the default table of analyze_claims.Rmd
+def claim_ranks(claims, full, seed=0):
+    full = full.copy()
+    full['irank'], full['n'] = rank_zetas(full, 'combo_name', seed)
+    allscores = claims.merge(full[['glottocode', 'combo_name', 'irank', 'n']], on=['glottocode', 'combo_name'], how='left')
+    allscores['concept'] = allscores['combo_name'].str.replace('combo$', '', regex=True)
+    expanded = allscores[['sign', 'concept', 'scholarly', 'groupname', 'level', 'langname', 'glottocode', 'zeta', 'irank', 'n']].drop_duplicates()
+    keys = ['sign', 'concept', 'scholarly', 'groupname', 'level']
+    rows = []
+    # claims whose languages have no scores are kept with no ranks (NA in the default table)
+    for key, group in expanded.groupby(keys, sort=False, dropna=False):
+        ranked = group[group['irank'].notna()]
+        rows.append(key + (ranked['irank'].astype(np.int64).to_numpy(), int(ranked['n'].iloc[0]) if len(ranked) else 0))
+    return pd.DataFrame(rows, columns=keys + ['ranks', 'n'])
+
+# mean rank, p value and bootstrap interval for each group of ranks
+def rank_statistics(ranked, nperm=10000, nboot=10000, seed=0, jobs=1):
+    ranks = list(ranked['ranks'])
+    ks = np.array([len(r) for r in ranks])
+    n = ranked['n'].to_numpy()
+    observed = np.array([r.sum() for r in ranks])
+    stats = ranked.drop(columns=['ranks', 'n']).copy()
+    stats['nlangs'] = ks
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['rank'] = observed / (ks * n)
+    stats['p_val'] = rank_pvalues(n, ks, observed, nperm, seed, jobs)
+    if nboot:
+        intervals = bootstrap_intervals(ranks, nboot, seed=seed, jobs=jobs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats['lower'] = intervals[:, 0] / n
+            stats['upper'] = intervals[:, 1] / n
+    return stats
+
+# mean rank of each positive scholarly concept with its IDS chapter, as default_p_ids in analyze_claims.Rmd
+def chapter_ranks(stats, claims, parameters_path=ids_parameters_file, chapters_path=ids_chapters_file):
+    default = stats[['sign', 'concept', 'scholarly', 'groupname', 'level', 'rank']]
+    # single languages are named by their langname
+    langnames = claims[['groupname', 'langname']].dropna()
+    single = default[default['level'] == 'single'].merge(langnames, on='groupname')
+    single = single.drop(columns='groupname').rename(columns={'langname': 'groupname'}).drop_duplicates()
+    default = pd.concat([single, default[default['level'] == 'group']], ignore_index=True)
+
+    default_p = default[(default['sign'] == 'positive') & (default['scholarly'] == 1)].copy()
+    default_p['concept'] = default_p['concept'].replace({'timeofday': 'time of day', 'bodyparts': 'body parts'})
+    features = pd.read_csv(parameters_path, dtype=str)
+    features['chapter'] = features['ID'].str.split('-').str[0].astype(float)
+    features['concept'] = (features['Name'].str.replace(r'\s*\(.*\)', '', n=1, regex=True)
+                           .str.replace(r'\s*[=|,].*', '', n=1, regex=True))
+    ids = default_p.merge(features[['concept', 'chapter']], on='concept', how='left')
+    for chapter, concepts in chapter_overrides.items():
+        ids.loc[ids['concept'].isin(concepts), 'chapter'] = chapter
+    chapters = pd.read_csv(chapters_path)
+    ids['chapter_name'] = ids['chapter'].map(chapters.set_index('ID')['Description']).map(chapter_names).fillna('Other')
+    return ids.groupby(['chapter_name', 'concept'], as_index=False)['rank'].mean()
+
+def read_claims(claims_path, full_path):
+    claims = pd.read_csv(claims_path, keep_default_na=False, na_values=['NA', ''])
+    full = pd.read_csv(full_path, keep_default_na=False, na_values=['NA', ''])
+    return claims, full
+
+def run_claims(args):
+    claims_path, full_path, output_path = claims_files(args.robust)
+    claims, full = read_claims(args.claims or claims_path, args.full or full_path)
+    start = time.time()
+    stats = rank_statistics(claim_ranks(claims, full, args.seed), args.nperm, args.nboot, args.seed, args.jobs)
+    stats.sort_values(['sign', 'rank'], ascending=False).to_csv(args.output or output_path, index=False)
+    print("%d claims, %d permutations and %d bootstrap samples each (%.1fs)" % (len(stats), args.nperm, args.nboot, time.time() - start))
+
+    start = time.time()
+    # concepts none of whose languages have scores have no rank
+    chapters = chapter_ranks(stats, claims).dropna(subset=['rank'])
+    test = permutation_test(chapters['rank'], chapters['chapter_name'] != 'Other', args.nperm, args.seed, args.jobs)
+    print("nature vs other: attested = %.3f, 95th percentile = %.3f, p val = %.3f (%d concepts, %.1fs)" %
+          (test['attested'], test['thresh_95'], test['p_val'], len(chapters), time.time() - start))
+
+# ranks of the given languages for each word of a zeta table (hierarchical_lr_lang.csv)
+def word_ranks(table, langs, words=None, seed=0):
+    if words is not None:
+        table = table[table['word'].isin(words)]
+    table = table.reset_index(drop=True)
+    table['irank'], table['n'] = rank_zetas(table, 'word', seed)
+    selected = table[table['lang'].isin(langs) & table['irank'].notna()]
+    rows = [(word, group['irank'].astype(np.int64).to_numpy(), int(group['n'].iloc[0])) for word, group in selected.groupby('word', sort=False)]
+    return pd.DataFrame(rows, columns=['word', 'ranks', 'n'])
+
+def run_words(args):
+    table = pd.read_csv(args.input, usecols=['word', 'lang', 'zeta'], keep_default_na=False, na_values=['NA', ''])
+    langs = args.langs.split(',')
+    words = args.words.split(',') if args.words else None
+    start = time.time()
+    stats = rank_statistics(word_ranks(table, langs, words, args.seed), args.nperm, args.nboot, args.seed, args.jobs)
+    stats.sort_values('rank', ascending=False).to_csv(args.output or results_dir + 'words_resampling.csv', index=False)
+    print("%d words, %d permutations and %d bootstrap samples each (%.1fs)" % (len(stats), args.nperm, args.nboot, time.time() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Permutation tests and bootstrap intervals for the ranks of L^lang scores.")
+    parser.add_argument("command", choices=['claims', 'words'], help="test the claims (claims_lr_lang*.csv) or the words of a zeta table")
+    parser.add_argument("--robust", action='store_true', help="use the results for the robustness set (claims)")
+    parser.add_argument("--claims", type=str, help="claims with their languages (default claims_lr_lang.csv)")
+    parser.add_argument("--full", type=str, help="scores for all languages (default claims_lr_lang_full.csv)")
+    parser.add_argument("--input", type=str, default=results_dir + 'hierarchical_lr_lang.csv', help="zeta table (words)")
+    parser.add_argument("--langs", type=str, help="comma-separated glottocodes of the languages (words)")
+    parser.add_argument("--words", type=str, help="comma-separated words (words, default all)")
+    parser.add_argument("--output", type=str, help="output file")
+    parser.add_argument("--nperm", type=int, default=100000, help="number of permutations")
+    parser.add_argument("--nboot", type=int, default=10000, help="number of bootstrap samples (0 for none)")
+    parser.add_argument("--seed", type=int, default=123, help="random seed")
+    parser.add_argument("--jobs", type=int, default=1, help="number of processes")
+    args = parser.parse_args()
+
+    if args.command == 'claims':
+        run_claims(args)
+    else:
+        if not args.langs:
+            parser.error("words needs --langs")
+        run_words(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from scipy.special import expit, logit
+from bila_counts import BilaCounts
+
+# Batched estimates of L^lang and L^fam scores (zeta) for all words at once.
+# This is a fast approximation to the glmmTMB models in bind_weights_par.R. For each word the models
+#   set:  cbind(count, total - count) ~ (1 | dict)
+#   lang: cbind(count, total - count) ~ 0 + lang + (1 | dict)
+# (and for the family variant, ~ (1 | dict) + (1 | lang) and ~ 0 + family + (1 | dict) + (1 | lang))
+# are fitted by penalized quasi-likelihood (PQL): at each iteration the binomial likelihood is replaced by
+# its working normal approximation, the variance of each random effect is updated towards its maximum
+# likelihood estimate (starting from a DerSimonian-Laird moment estimate), and the linear predictor is
+# updated with the BLUPs. Because every word is fitted in the same way, all words in a batch are
+# updated together with NumPy operations.
+# As in bind_weights_par.R, delta = estimate - estimate_set and zeta = delta / sqrt(se^2 + se_set^2).
+# The counts are read either from d_wide.csv (a dense words x dictionaries array) or, with --counts, from the
+# sparse BILA counts (see bila_counts.py): the words are then selected and smoothed as in preliminary_steps.Rmd,
+# and only the rows of the batch being fitted are made dense.
+
+# Examples (run from the analysis folder):
+# `python zeta_scores.py`
+# `python zeta_scores.py --family`
+# `python zeta_scores.py --counts noun_lemmatized` (after `python bila_counts.py build noun_lemmatized`)
+# `python zeta_scores.py --check ../output/results/hierarchical_lr_lang.csv`
+
+d_wide_file = '../data/foranalyses/d_wide.csv'
+stopwords_file = '../data/foranalyses/stopwords.txt'
+
+# words are scored if they occur in dictionaries of more than this number of languages (as in preliminary_steps.Rmd)
+minlangs = 30
+
+# number of words fitted together
+batchsize = 500
+
+maxiter = 50
+tol = 1e-6
+
+def output_file(family):
+    if family:
+        return '../output/results/hierarchical_lr_fam_pql.csv'
+    return '../output/results/hierarchical_lr_lang_pql.csv'
+
+# dense words x dictionaries arrays of (smoothed) counts and totals from d_wide.csv
+# returns the words, the dictionaries, the counts, the totals, and the language and family of each dictionary
+def read_d_wide(path=d_wide_file):
+    d = pd.read_csv(path, keep_default_na=False, na_values=['NA'],
+                    dtype={'dict': str, 'lang': str, 'langname': str, 'family': str, 'word': str})
+    wordcodes, words = pd.factorize(d['word'])
+    dictcodes, dicts = pd.factorize(d['dict'])
+    counts = np.zeros((len(words), len(dicts)))
+    counts[wordcodes, dictcodes] = d['count'].to_numpy()
+    dictinfo = d.drop_duplicates('dict').set_index('dict').loc[dicts]
+    totals = dictinfo['total'].to_numpy(dtype=float)
+    return list(words), list(dicts), counts, totals, dictinfo['lang'].to_numpy(), dictinfo['family'].to_numpy()
+
+# the same arrays built from sparse BILA counts (see bila_counts.py) for a list of words: the counts are a
+# sparse words x dictionaries matrix, smoothed by count_rows as in preliminary_steps.Rmd (add one to every
+# count), with totals over the selected words
+def from_counts(bila, words):
+    counts = bila.select(words=words).matrix.T.tocsr().astype(float)
+    totals = np.asarray(counts.sum(axis=0)).ravel() + len(words)
+    return list(words), list(bila.ids), counts, totals, bila.dictionaries['glottocode'].to_numpy(), bila.dictionaries['langfamily'].to_numpy()
+
+# words that occur in dictionaries of more than minlangs languages, other than the dictionary totals and the
+# stop words (subset_lr in preliminary_steps.Rmd)
+def frequent_words(bila, stopwords=(), minlangs=minlangs):
+    langs, _, _ = indicator(bila.dictionaries['glottocode'].to_numpy())
+    present = (bila.matrix > 0).astype(np.int64)
+    nlangs = np.asarray(((langs.T @ present) > 0).sum(axis=0)).ravel()
+    stopwords = set(stopwords)
+    return [word for word, n in zip(bila.words, nlangs) if n > minlangs and not word.endswith('_data') and word not in stopwords]
+
+def read_stopwords(path=stopwords_file):
+    with open(path) as f:
+        return f.read().split()
+
+# rows start:stop of the counts as a dense array (sparse counts from from_counts are smoothed here)
+def count_rows(counts, start, stop):
+    if scipy.sparse.issparse(counts):
+        return counts[start:stop].toarray() + 1
+    return counts[start:stop]
+
+# sparse indicator matrix (items x groups) for an array of group labels
+def indicator(labels):
+    codes, levels = pd.factorize(labels, sort=True)
+    matrix = scipy.sparse.csr_matrix((np.ones(len(codes)), (np.arange(len(codes)), codes)), shape=(len(codes), len(levels)))
+    return matrix, codes, list(levels)
+
+# sums of the columns of values (words x items) within each group
+def group_sums(values, ind):
+    return np.asarray(ind.T @ values.T).T
+
+# DerSimonian-Laird estimate of the between-item variance for observations z with known variances v,
+# allowing a separate mean for each group; returns the variance and the fixed-effect group means
+def dersimonian_laird(z, v, ind, codes):
+    w = 1 / v
+    sw = group_sums(w, ind)
+    means = group_sums(w * z, ind) / sw
+    q = (w * (z - means[:, codes]) ** 2).sum(axis=1)
+    df = z.shape[1] - ind.shape[1]
+    denom = w.sum(axis=1) - (group_sums(w ** 2, ind) / sw).sum(axis=1)
+    tau2 = np.where(denom > 0, (q - df) / np.where(denom > 0, denom, 1), 0)
+    return np.maximum(tau2, 0), means
+
+# one fixed-point step towards the maximum likelihood estimate of the between-item variance
+# (glmmTMB fits by maximum likelihood), starting from tau2
+def ml_step(z, v, tau2, ind, codes):
+    w = 1 / (tau2[:, None] + v)
+    means = group_sums(w * z, ind) / group_sums(w, ind)
+    tau2 = (w ** 2 * ((z - means[:, codes]) ** 2 - v)).sum(axis=1) / (w ** 2).sum(axis=1)
+    return np.maximum(tau2, 0)
+
+def variance_step(z, v, tau2, ind, codes, iteration):
+    if iteration == 0:
+        return dersimonian_laird(z, v, ind, codes)[0]
+    return ml_step(z, v, tau2, ind, codes)
+
+# PQL fit for a batch of words. y is words x dicts, n the totals for each dict, groups the fixed-effect
+# group of each dict and clusters (optional) a random-effect cluster nested within groups.
+# If tau2 (words x 2: dict variance, cluster variance) is given the variances are held fixed.
+# Returns the group estimates and standard errors (words x groups), the group labels, a convergence flag
+# per word and the variances.
+def fit_pql(y, n, groups, clusters=None, tau2=None):
+    gind, gcodes, glevels = indicator(groups)
+    if clusters is not None:
+        cind, ccodes, clevels = indicator(clusters)
+        # group of each cluster
+        cluster_groups = pd.Series(gcodes).groupby(ccodes).first().to_numpy()
+        cgind = scipy.sparse.csr_matrix((np.ones(len(clevels)), (np.arange(len(clevels)), cluster_groups)), shape=(len(clevels), len(glevels)))
+
+    fixed = tau2 is not None
+    if not fixed:
+        tau2 = np.zeros((y.shape[0], 2))
+    eta = logit(y / n)
+    beta = np.zeros((y.shape[0], len(glevels)))
+    converged = np.zeros(y.shape[0], dtype=bool)
+    for iteration in range(maxiter):
+        p = expit(eta)
+        s2 = 1 / (n * p * (1 - p))
+        z = eta + (y - n * p) * s2
+
+        if clusters is None:
+            tau_u = tau2[:, 0] if fixed else variance_step(z, s2, tau2[:, 0], gind, gcodes, iteration)
+            tau_v = np.zeros_like(tau_u)
+            w = 1 / (tau_u[:, None] + s2)
+            new_beta = group_sums(w * z, gind) / group_sums(w, gind)
+            se = np.sqrt(1 / group_sums(w, gind))
+            mean = new_beta[:, gcodes]
+        else:
+            # dictionaries within clusters, then cluster means within groups
+            tau_u = tau2[:, 0] if fixed else variance_step(z, s2, tau2[:, 0], cind, ccodes, iteration)
+            w = 1 / (tau_u[:, None] + s2)
+            cmeans = group_sums(w * z, cind) / group_sums(w, cind)
+            cvars = 1 / group_sums(w, cind)
+            tau_v = tau2[:, 1] if fixed else variance_step(cmeans, cvars, tau2[:, 1], cgind, cluster_groups, iteration)
+            wc = 1 / (tau_v[:, None] + cvars)
+            new_beta = group_sums(wc * cmeans, cgind) / group_sums(wc, cgind)
+            se = np.sqrt(1 / group_sums(wc, cgind))
+            vhat = tau_v[:, None] / (tau_v[:, None] + cvars) * (cmeans - new_beta[:, cluster_groups])
+            mean = new_beta[:, gcodes] + vhat[:, ccodes]
+
+        uhat = tau_u[:, None] / (tau_u[:, None] + s2) * (z - mean)
+        eta = mean + uhat
+
+        new_tau2 = np.column_stack([tau_u, tau_v])
+        change = np.maximum(np.abs(new_beta - beta).max(axis=1), np.abs(new_tau2 - tau2).max(axis=1))
+        beta, tau2 = new_beta, new_tau2
+        converged = change < tol
+        if iteration > 0 and converged.all():
+            break
+
+    return beta, se, glevels, converged, tau2
+
+def convergence_labels(converged):
+    return np.where(converged, 'converged', 'not converged')
+
+def groupname(family):
+    return 'family' if family else 'lang'
+
+# delta and zeta as in bind_weights_par.R
+def add_zetas(allw):
+    allw['delta'] = allw['estimate'] - allw['estimate_set']
+    allw['zeta'] = allw['delta'] / np.sqrt(allw['se'] ** 2 + allw['se_set'] ** 2)
+    return allw
+
+# L^lang (or L^fam) scores for all words, fitted in batches of words
+# Also returns the variances of the random effects in the lang (or family) model (words x 2)
+def fit_words(words, counts, totals, langs, families, family=False):
+    results = []
+    variances = []
+    nodict = np.zeros(len(langs), dtype=int)
+    for start in range(0, len(words), batchsize):
+        y = count_rows(counts, start, start + batchsize)
+        batch = np.array(words[start:start + batchsize], dtype=object)
+        if family:
+            beta_set, se_set, _, conv_set, _ = fit_pql(y, totals, nodict, clusters=langs)
+            beta, se, levels, conv, tau2 = fit_pql(y, totals, families, clusters=langs)
+        else:
+            beta_set, se_set, _, conv_set, _ = fit_pql(y, totals, nodict)
+            beta, se, levels, conv, tau2 = fit_pql(y, totals, langs)
+
+        nlevels = len(levels)
+        result = pd.DataFrame({'word': np.repeat(batch, nlevels),
+                               'estimate_set': np.repeat(beta_set[:, 0], nlevels),
+                               'se_set': np.repeat(se_set[:, 0], nlevels),
+                               'convergence_set': np.repeat(convergence_labels(conv_set), nlevels),
+                               'estimate': beta.ravel(),
+                               'se': se.ravel(),
+                               groupname(family): np.tile(np.array(levels, dtype=object), len(batch)),
+                               'convergence': np.repeat(convergence_labels(conv), nlevels)})
+        results.append(result)
+        variances.append(tau2)
+    allw = add_zetas(pd.concat(results, ignore_index=True))
+    return allw, np.concatenate(variances)
+
+def compute_zetas(words, counts, totals, langs, families, family=False):
+    return fit_words(words, counts, totals, langs, families, family)[0]
+
+# compare with results from bind_weights_par.R for a random sample of words
+def check(allw, path, nwords=200, seed=0, family=False):
+    reference = pd.read_csv(path, keep_default_na=False, na_values=['NA'])
+    words = reference['word'].drop_duplicates()
+    words = words.sample(min(nwords, len(words)), random_state=seed)
+    merged = reference[reference['word'].isin(words)].merge(allw, on=['word', groupname(family)], suffixes=('_glmm', '_pql'))
+    print("compared %d scores for %d words" % (merged.shape[0], merged['word'].nunique()))
+    for column in ['estimate', 'se', 'estimate_set', 'se_set', 'zeta']:
+        a, b = merged[column + '_glmm'], merged[column + '_pql']
+        print("%-13s correlation %.4f  mean absolute difference %.4f" % (column, a.corr(b), (a - b).abs().mean()))
+    return merged
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute L^lang or L^fam scores for all words.")
+    parser.add_argument("--input", type=str, default=d_wide_file, help="data for the hierarchical model (d_wide.csv)")
+    parser.add_argument("--counts", type=str, help="sparse BILA counts to use instead of --input (e.g. noun_lemmatized)")
+    parser.add_argument("--words", type=str, help="file with the words to score, one per line (--counts, default the words "
+                        "in dictionaries of more than %d languages other than the stop words in %s)" % (minlangs, stopwords_file))
+    parser.add_argument("--output", type=str, help="output file")
+    parser.add_argument("--family", action='store_true', help="compute L^fam rather than L^lang scores")
+    parser.add_argument("--check", type=str, help="results from bind_weights_par.R to compare with a sample of words")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.counts:
+        bila = BilaCounts.load(args.counts)
+        if args.words:
+            with open(args.words) as f:
+                words = f.read().split()
+        else:
+            words = frequent_words(bila, read_stopwords() if os.path.exists(stopwords_file) else ())
+        words, dicts, counts, totals, langs, families = from_counts(bila, words)
+    else:
+        words, dicts, counts, totals, langs, families = read_d_wide(args.input)
+    print("read %d words x %d dictionaries in %.1fs" % (len(words), len(dicts), time.time() - start))
+
+    start = time.time()
+    allw = compute_zetas(words, counts, totals, langs, families, args.family)
+    nfailed = allw.loc[(allw['convergence'] != 'converged') | (allw['convergence_set'] != 'converged'), 'word'].nunique()
+    print("fitted %d words in %.1fs (%d not converged)" % (len(words), time.time() - start, nfailed))
+
+    allw.to_csv(args.output or output_file(args.family), index=False)
+    if args.check:
+        check(allw, args.check, family=args.family)
+
+if __name__ == "__main__":
+    main()
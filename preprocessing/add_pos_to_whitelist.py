@@ -1,24 +1,15 @@
-import pickle
+import numpy as np
 import pandas as pd
-import re
+import lexicon
 
-pos = pickle.load(open("../data/forpreprocessing/wordpos.p", "rb"))
-
-def checkpos(string, restring):
-    return pos[string] != 0 and bool(re.match(restring, pos[string])) 
-
-def assignpos(string):
-    if checkpos(string, '^n'):
-        return("noun")
-    elif checkpos(string, '^n|^v|^j'):
-        return("nounverbadj")
-    else:
-        return("missing")
+# POS classes from the COCA columns of the lexicon (see lexicon.py), which readcoca.py writes
+lex = lexicon.load_lexicon()
 
 df = pd.read_csv("../data/forpreprocessing/whitelist.txt", names = ['lowercase'])
-df['pos'] = df['lowercase'].apply(assignpos)
+# missing entries (e.g. read as NaN) have no POS tag
+entries = lexicon.lookup(lex, df['lowercase'].where(df['lowercase'].notna(), ''))
+posmask = entries['posmask'].to_numpy()
+df['pos'] = np.select([(posmask & lexicon.posmasks['noun']) != 0, (posmask & lexicon.posmasks['nounverbadj']) != 0],
+                      ["noun", "nounverbadj"], "missing")
 #df = df[df['pos'] != 'missing']
 df.to_csv('../data/forpreprocessing/whitelist_pos.csv', index=False)
-
-
-
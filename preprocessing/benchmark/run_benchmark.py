@@ -0,0 +1,236 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import synthetic
+
+# Time the preprocessing scripts on synthetic inputs (see synthetic.py) and keep the results in a history.
+# The stages are run in order in a workspace, each as its own process started from the workspace's
+# preprocessing folder, as described in ../README.md:
+#   ht_phase1   read_ht_file.py --phase 1 on the Extracted Features volumes
+#   make_vocab  make_vocab.py on the Phase 1 files
+#   ht_phase2   read_ht_file.py --phase 2
+#   nonhathi    read_nonht_file.py on the pdf, docx and csv files
+#   collate     collate_dics.py --matrix
+# With `--jobs`, the two read_ht_file.py stages and the non-Hathi stage are run with run_counts.py instead.
+# With `--metrics`, the stages also record their timings for each input in the workspace (see ../metrics.py),
+# and the report of `metrics.py report` is written to metrics.txt in the workspace.
+# For each stage the wall time, the input files per second, the peak resident memory of the largest process
+# and a checksum of the outputs are recorded. The checksum is computed over the sorted lines of each
+# output file, so it only changes when the content of the outputs does.
+# Each run is appended to history.json (in this folder by default) with the commit of the repository, and
+# compared with the last run with the same sizes.
+
+# Examples (run from the preprocessing/benchmark folder):
+# `python run_benchmark.py --size small`
+# `python run_benchmark.py --size medium --jobs 8 --label "run_counts, 8 workers"`
+# `python run_benchmark.py --workdir /tmp/bila_benchmark --stages ht_phase1 ht_phase2`
+
+preprocessing_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+history_file = 'history.json'
+
+stages = ['ht_phase1', 'make_vocab', 'ht_phase2', 'nonhathi', 'collate']
+
+pos = 'nounverbadj'
+
+def script(name):
+    return os.path.join(preprocessing_dir, name)
+
+# command line, outputs (glob patterns relative to the workspace) and number of inputs of a stage
+def stage_command(stage, root, hathi_files, nonhathi_files, jobs):
+    python = sys.executable
+    if stage in ('ht_phase1', 'ht_phase2'):
+        phase = stage[-1]
+        if jobs:
+            command = [python, script('run_counts.py'), '--source', 'hathi', '--phase', phase, '--pos', pos, '--jobs', str(jobs)] + hathi_files
+        else:
+            command = [python, script('read_ht_file.py'), '--phase', phase, '--pos', pos] + hathi_files
+        return command, ['data/forpreprocessing/%s_counts_phase%s/*.csv' % (pos, phase)], len(hathi_files)
+    if stage == 'make_vocab':
+        phase1 = sorted(glob.glob(root + '/data/forpreprocessing/%s_counts_phase1/*.csv' % pos))
+        return ([python, script('make_vocab.py'), '--pos', pos] + phase1,
+                ['data/forpreprocessing/%s_vocab_stats.csv' % pos], len(phase1))
+    if stage == 'nonhathi':
+        if jobs:
+            command = [python, script('run_counts.py'), '--source', 'nonhathi', '--pos', pos, '--jobs', str(jobs)] + nonhathi_files
+        else:
+            command = [python, script('read_nonht_file.py'), '--pos', pos] + nonhathi_files
+        return command, ['data/forpreprocessing/%s_counts_phase2_nonhathi/*.csv' % pos], len(nonhathi_files)
+    if stage == 'collate':
+        ncounts = len(glob.glob(root + '/data/forpreprocessing/%s_counts_phase2*/*.csv' % pos))
+        return ([python, script('collate_dics.py'), '--pos', pos, '--matrix'],
+                ['data/forpreprocessing/dictionary_counts_%s.csv' % pos, 'data/forpreprocessing/dictionary_matrix_%s*' % pos], ncounts)
+    raise ValueError("unknown stage: " + stage)
+
+# checksum of the files matching the patterns: names and sorted lines of text files, bytes of other files
+def outputs_checksum(root, patterns):
+    h = hashlib.sha1()
+    paths = sorted(set(path for pattern in patterns for path in glob.glob(os.path.join(root, pattern))))
+    for path in paths:
+        h.update(os.path.relpath(path, root).encode('utf-8') + b'\n')
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith(('.csv', '.txt')):
+            data = b'\n'.join(sorted(data.splitlines()))
+        h.update(hashlib.sha1(data).digest())
+    return h.hexdigest(), len(paths)
+
+# run a command and return its exit status, wall time and peak resident memory in MB
+def run_measured(command, cwd, log):
+    env = dict(os.environ, PYTHONHASHSEED='0')
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env)
+    # the usage of a child includes that of its own children (e.g. the workers of run_counts.py);
+    # ru_maxrss is the peak of the largest of these processes, in kB on Linux and in bytes on macOS
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    scale = 1 << 20 if sys.platform == 'darwin' else 1 << 10
+    return process.returncode, seconds, usage.ru_maxrss / scale
+
+# number of inputs of a counting stage that failed, from the manifest of the workspace (see manifest.py)
+def failed_inputs(root, files):
+    path = root + '/data/forpreprocessing/manifest.sqlite'
+    if not files or not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path)
+    failed = set(input for (input,) in conn.execute("SELECT input FROM inputs WHERE status = 'error'"))
+    conn.close()
+    return sum(1 for file_path in files if file_path in failed)
+
+def run_stage(stage, root, hathi_files, nonhathi_files, jobs, log, use_metrics=False):
+    command, outputs, ninputs = stage_command(stage, root, hathi_files, nonhathi_files, jobs)
+    if use_metrics:
+        command.insert(2, '--metrics')
+    print('---- %s' % stage, file=log, flush=True)
+    returncode, seconds, peak_rss = run_measured(command, root + '/preprocessing', log)
+    checksum, noutputs = outputs_checksum(root, outputs)
+    # the counting scripts record failed inputs and carry on
+    nfailed = failed_inputs(root, {'ht_phase1': hathi_files, 'ht_phase2': hathi_files, 'nonhathi': nonhathi_files}.get(stage))
+    if returncode != 0:
+        status = 'error %d' % returncode
+    elif nfailed:
+        status = '%d inputs failed' % nfailed
+    else:
+        status = 'ok'
+    return {'stage': stage, 'status': status,
+            'seconds': round(seconds, 3), 'inputs': ninputs, 'files_per_s': round(ninputs / seconds, 3) if seconds > 0 else None,
+            'peak_rss_mb': round(peak_rss, 1), 'outputs': noutputs, 'checksum': checksum}
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=preprocessing_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=preprocessing_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+def read_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+def write_history(path, history):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(history, f, indent=1)
+        f.write('\n')
+    os.replace(path + '.tmp', path)
+
+def print_run(run, previous):
+    print('%-11s %9s %9s %8s %10s  %s' % ('stage', 'seconds', 'files/s', 'vs last', 'peak MB', 'status'))
+    before = {stage['stage']: stage for stage in previous['stages']} if previous else {}
+    for stage in run['stages']:
+        old = before.get(stage['stage'])
+        ratio = ''
+        notes = [stage['status']]
+        if old is not None and old['status'] == 'ok' and stage['status'] == 'ok':
+            ratio = '%.2fx' % (old['seconds'] / stage['seconds'])
+            if old['checksum'] != stage['checksum']:
+                notes.append('outputs changed')
+        print('%-11s %9.2f %9s %8s %10.1f  %s' % (stage['stage'], stage['seconds'], stage['files_per_s'], ratio,
+                                                   stage['peak_rss_mb'], ', '.join(notes)))
+    print('%-11s %9.2f' % ('total', run['seconds']))
+    if previous:
+        print('compared with %s (%s)' % (previous['date'], previous['commit']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing scripts on synthetic inputs.")
+    parser.add_argument("--size", choices=list(synthetic.sizes), default='small', help="number of files and pages (see synthetic.py)")
+    parser.add_argument("--volumes", type=int, help="number of Extracted Features volumes")
+    parser.add_argument("--pages", type=int, help="mean number of pages per volume")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic inputs")
+    parser.add_argument("--stages", nargs='+', choices=stages, default=stages, help="stages to record (earlier stages are run but not recorded)")
+    parser.add_argument("--jobs", type=int, help="run the counting stages with run_counts.py and this many workers")
+    parser.add_argument("--metrics", action='store_true', help="record the timings of each input in each stage and report them")
+    parser.add_argument("--workdir", type=str, help="workspace (default: a temporary folder); inputs already there are reused")
+    parser.add_argument("--keep", action='store_true', help="keep the workspace")
+    parser.add_argument("--history", type=str, default=history_file, help="JSON file with the results of all runs")
+    parser.add_argument("--label", type=str, default='', help="note stored with the run")
+    args = parser.parse_args()
+
+    config = dict(synthetic.sizes[args.size])
+    for key in ('volumes', 'pages'):
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    root = (args.workdir or tempfile.mkdtemp(prefix='bila_benchmark_')).rstrip('/')
+    settings_file = root + '/synthetic.json'
+    settings = dict(config, seed=args.seed)
+
+    start = time.perf_counter()
+    reuse = False
+    if os.path.exists(settings_file):
+        with open(settings_file) as f:
+            reuse = json.load(f) == settings
+    if reuse:
+        hathi_files = sorted(glob.glob(root + '/rawdata/downloaded/hathi_raw/*.json.bz2'))
+        nonhathi_files = sorted(glob.glob(root + '/rawdata/downloaded/nonhathi_raw/*'))
+    else:
+        hathi_files, nonhathi_files = synthetic.generate(root, seed=args.seed, **config)
+        with open(settings_file, 'w') as f:
+            json.dump(settings, f)
+    print('%d volumes and %d non-Hathi files in %s (%.1fs)' % (len(hathi_files), len(nonhathi_files), root, time.perf_counter() - start))
+    # outputs of earlier runs are removed so that every stage does all its work (the manifest would skip it)
+    for path in glob.glob(root + '/data/forpreprocessing/*') + glob.glob(root + '/preprocessing/*'):
+        if not path.endswith(('whitelist_pos.csv', 'lexicon')):
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+    run = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'label': args.label,
+           'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+           'synthetic': settings, 'jobs': args.jobs, 'stages': []}
+    with open(root + '/benchmark.log', 'w') as log:
+        # the stages before the last one selected are all run, as each needs the outputs of the previous ones
+        last = max(stages.index(stage) for stage in args.stages)
+        for stage in stages[:last + 1]:
+            result = run_stage(stage, root, hathi_files, nonhathi_files, args.jobs, log, args.metrics)
+            if stage in args.stages:
+                run['stages'].append(result)
+            print('%s: %s in %.2fs' % (stage, result['status'], result['seconds']), flush=True)
+    run['seconds'] = round(sum(stage['seconds'] for stage in run['stages']), 3)
+    if args.metrics:
+        with open(root + '/metrics.txt', 'w') as f:
+            subprocess.run([sys.executable, script('metrics.py'), 'report'], cwd=root + '/preprocessing', stdout=f, stderr=subprocess.STDOUT)
+        print('per-input metrics in %s/metrics.txt' % root)
+
+    history = read_history(args.history)
+    previous = [old for old in history if old['synthetic'] == settings and old.get('jobs') == args.jobs]
+    history.append(run)
+    write_history(args.history, history)
+    print_run(run, previous[-1] if previous else None)
+    if any(stage['status'] != 'ok' for stage in run['stages']):
+        print('see %s/benchmark.log for the output of the stages' % root)
+    if not args.keep and not args.workdir:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    main()
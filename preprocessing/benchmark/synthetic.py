@@ -0,0 +1,250 @@
+import argparse
+import bz2
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from docx import Document
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lexicon
+
+# Synthetic inputs for benchmarking the preprocessing scripts without the HathiTrust rsync.
+# A workspace mirrors the layout of the repository, so that the scripts can be run from its preprocessing
+# folder with their usual relative paths:
+#   rawdata/downloaded/hathi_raw/*.json.bz2        Extracted Features (schema 3.0) volumes
+#   rawdata/downloaded/nonhathi_raw/*.pdf, *.docx, *.csv   non-Hathi dictionaries
+#   rawdata/downloaded/uk_us_spelling.csv, data/forpreprocessing/whitelist_pos.csv
+#   data/forpreprocessing/lexicon/                 lexicon of the synthetic English forms (see lexicon.py)
+# Token frequencies follow those of bilingual dictionaries: about half of the tokens are English and half
+# are forms of the other language, each drawn from a Zipf-Mandelbrot distribution over ranks (frequent
+# forms are short), with some capitalized forms, forms with trailing punctuation, numbers and punctuation.
+# The number of pages of a dictionary is lognormal around the mean given. The same seed gives the same files.
+
+# Examples (run from the preprocessing/benchmark folder):
+# `python synthetic.py /tmp/bila_benchmark --size small`
+# `python synthetic.py /tmp/bila_benchmark --volumes 50 --pages 300`
+
+# numbers of files and pages for each size
+sizes = {
+    'tiny': {'volumes': 4, 'pages': 40, 'tokens_per_page': 300, 'nonhathi': 1, 'pdf_pages': 5},
+    'small': {'volumes': 20, 'pages': 150, 'tokens_per_page': 400, 'nonhathi': 3, 'pdf_pages': 20},
+    'medium': {'volumes': 100, 'pages': 400, 'tokens_per_page': 400, 'nonhathi': 10, 'pdf_pages': 60},
+    'large': {'volumes': 400, 'pages': 800, 'tokens_per_page': 450, 'nonhathi': 25, 'pdf_pages': 150},
+}
+
+# forms in the English vocabulary and in the vocabulary of the other language of each dictionary
+english_forms = 20000
+foreign_forms = 8000
+
+# share of English tokens, and of tokens that are numbers or punctuation
+english_share = 0.5
+other_share = 0.05
+
+# Zipf-Mandelbrot exponent and offset
+zipf_a = 1.1
+zipf_q = 2.7
+
+onsets = ['', 'b', 'c', 'd', 'f', 'g', 'h', 'l', 'm', 'n', 'p', 'r', 's', 't', 'w', 'bl', 'br', 'ch', 'cl', 'cr', 'dr',
+          'fl', 'fr', 'gr', 'pl', 'pr', 'sh', 'sl', 'sp', 'st', 'str', 'th', 'tr']
+vowels = ['a', 'e', 'i', 'o', 'u', 'ea', 'ee', 'oo', 'ou', 'ai']
+codas = ['', '', 'd', 'k', 'l', 'm', 'n', 'nd', 'ng', 'nt', 'r', 's', 'st', 't', 'ck', 'sh']
+foreign_onsets = ['', 'k', 'm', 'n', 'ng', 'p', 't', 'w', 'y', 'h', 'l', 'r', 'kw', 'mb', 'nd']
+foreign_vowels = ['a', 'e', 'i', 'o', 'u', 'aa', 'ii', 'uu']
+others = ['.', ',', ';', ':', '-', '(', ')', '1', '2', '3', '10', '1.', '2.', 'a.', 'n.', 'v.']
+
+# tags are only kept for the counts (read_ht_file.py ignores them)
+tags = ['NN', 'NNS', 'VB', 'JJ', 'RB', 'IN', 'NNP']
+
+# distinct pseudo-words made of 1 to 3 syllables, shortest first
+def pseudo_words(n, rng, onsets=onsets, vowels=vowels, codas=codas):
+    onsets, vowels, codas = (np.array(parts, dtype=object) for parts in (onsets, vowels, codas))
+    words = {}
+    while len(words) < n:
+        syllables = [onsets[rng.integers(len(onsets), size=n)] + vowels[rng.integers(len(vowels), size=n)] +
+                     codas[rng.integers(len(codas), size=n)] for _ in range(3)]
+        nsyll = rng.choice([1, 2, 3], size=n, p=[0.3, 0.45, 0.25])
+        candidates = np.where(nsyll == 1, syllables[0], np.where(nsyll == 2, syllables[0] + syllables[1],
+                                                                 syllables[0] + syllables[1] + syllables[2]))
+        for word in candidates.tolist():
+            if len(word) > 1:
+                words.setdefault(word, None)
+    words = sorted(list(words)[:n], key=len)
+    return np.array(words, dtype=object)
+
+def zipf_weights(n, a=zipf_a, q=zipf_q):
+    weights = 1.0 / (np.arange(1, n + 1) + q) ** a
+    return weights / weights.sum()
+
+def english_vocabulary(seed, n=english_forms):
+    return pseudo_words(n, np.random.default_rng([seed, 0]))
+
+# tokens of a text drawn from English, the other language and numbers and punctuation
+class TokenSampler:
+
+    def __init__(self, english, seed, index):
+        self.rng = np.random.default_rng([seed, 1, index])
+        self.english = english
+        self.foreign = pseudo_words(foreign_forms, self.rng, foreign_onsets, foreign_vowels, ['', '', 'n', 'ng', 'k'])
+        self.english_p = zipf_weights(len(english))
+        self.foreign_p = zipf_weights(len(self.foreign))
+
+    def tokens(self, n):
+        rng = self.rng
+        source = rng.choice(3, size=n, p=[english_share, 1 - english_share - other_share, other_share])
+        tokens = np.empty(n, dtype=object)
+        eng = source == 0
+        tokens[eng] = self.english[rng.choice(len(self.english), size=eng.sum(), p=self.english_p)]
+        frn = source == 1
+        tokens[frn] = self.foreign[rng.choice(len(self.foreign), size=frn.sum(), p=self.foreign_p)]
+        oth = source == 2
+        tokens[oth] = np.array(others, dtype=object)[rng.choice(len(others), size=oth.sum())]
+        variant = rng.random(n)
+        words = source < 2
+        capital = words & (variant < 0.1)
+        tokens[capital] = [token.capitalize() for token in tokens[capital]]
+        punct = words & (variant > 0.85)
+        tokens[punct] = tokens[punct] + np.array(['.', ',', ';'], dtype=object)[rng.choice(3, size=punct.sum())]
+        return tokens
+
+def page_count(rng, mean):
+    return max(2, int(round(rng.lognormal(np.log(mean) - 0.125, 0.5))))
+
+def ef_page(seq, tokens, rng):
+    forms, counts = np.unique(tokens, return_counts=True)
+    token_pos = {}
+    for form, count in zip(forms.tolist(), counts.tolist()):
+        token_pos[form] = {tags[rng.integers(len(tags))]: count}
+    nlines = max(1, len(tokens) // 8)
+    body = {'tokenCount': len(tokens), 'lineCount': nlines, 'emptyLineCount': 0, 'sentenceCount': nlines,
+            'capAlphaSeq': 0, 'beginCharCount': {}, 'endCharCount': {}, 'tokenPosCount': token_pos}
+    return {'seq': '%08d' % seq, 'version': 'synthetic', 'tokenCount': len(tokens), 'lineCount': nlines,
+            'emptyLineCount': 0, 'sentenceCount': nlines, 'calculatedLanguage': 'en',
+            'header': None, 'footer': None, 'body': body}
+
+def write_ef_volume(path, volume_id, sampler, npages, tokens_per_page):
+    rng = sampler.rng
+    pages = [ef_page(seq, sampler.tokens(rng.poisson(tokens_per_page)), rng) for seq in range(1, npages + 1)]
+    obj = {'htid': volume_id,
+           'metadata': {'schemaVersion': 'https://schemas.hathitrust.org/EF_Schema_MetadataSubSchema_v_3.0',
+                        'title': 'A synthetic dictionary ' + volume_id, 'pubDate': 1900, 'language': 'eng'},
+           'features': {'schemaVersion': '3.0', 'pageCount': npages, 'pages': pages}}
+    with bz2.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(obj, f)
+
+# lines of a dictionary: a headword of the other language followed by English glosses
+def entry_lines(sampler, ntokens, width=12):
+    tokens = sampler.tokens(ntokens)
+    return [' '.join(tokens[start:start + width]) for start in range(0, len(tokens), width)]
+
+def pdf_string(line):
+    return '(' + line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+# minimal PDF with one page of text lines (Helvetica) for each list of lines
+def write_pdf(path, pages):
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               ('<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join('%d 0 R' % (4 + 2 * i) for i in range(len(pages))), len(pages))).encode(),
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    for i, lines in enumerate(pages):
+        stream = ('BT /F1 10 Tf 40 760 Td 12 TL\n' + ''.join(pdf_string(line) + " '\n" for line in lines) + 'ET').encode('latin-1')
+        objects.append(('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> '
+                        '/Contents %d 0 R >>' % (5 + 2 * i)).encode())
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + obj + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    with open(path, 'wb') as f:
+        f.write(out)
+
+def write_nonhathi(path, sampler, npages, kind):
+    lines = entry_lines(sampler, npages * 60 * 12)
+    if kind == 'pdf':
+        write_pdf(path, [lines[start:start + 60] for start in range(0, len(lines), 60)])
+    elif kind == 'docx':
+        doc = Document()
+        for line in lines:
+            doc.add_paragraph(line)
+        doc.save(path)
+    else:
+        headwords = [line.split(' ', 1)[0] for line in lines]
+        pd.DataFrame({'ID': range(1, len(lines) + 1), 'Headword': headwords, 'Description': lines}).to_csv(path, index=False)
+
+# lexicon of the English forms: POS classes and COCA counts by rank (counts fall below read_ht_file.py's
+# mincounts for the least frequent forms), and most forms in the list of English words
+def write_lexicon(root, english, seed):
+    rng = np.random.default_rng([seed, 2])
+    coca_tags = np.array(['nn1', 'nn2', 'vvi', 'vvd', 'jj', 'rr', 'ii', 'at'], dtype=object)
+    tag_p = [0.3, 0.15, 0.15, 0.05, 0.15, 0.1, 0.05, 0.05]
+    pos = dict(zip(english, rng.choice(coca_tags, size=len(english), p=tag_p)))
+    counts = {word: int(5e6 / (rank + 10)) for rank, word in enumerate(english)}
+    engwords = set(english[rng.random(len(english)) < 0.8])
+    lexicon.save_lexicon(lexicon.build_lexicon(pos, counts, engwords), root + '/data/forpreprocessing/lexicon/',
+                         {'coca': 'synthetic (seed %d)' % seed})
+
+def write_wordlists(root, english, seed):
+    rng = np.random.default_rng([seed, 3])
+    us = english[rng.choice(len(english), size=200, replace=False)]
+    pd.DataFrame({'UK': [word + 'e' for word in us], 'US': us}).to_csv(root + '/rawdata/downloaded/uk_us_spelling.csv', index=False)
+    white = english[rng.choice(len(english), size=100, replace=False)]
+    pd.DataFrame({'lowercase': white, 'pos': rng.choice(['noun', 'nounverbadj'], size=len(white))}).to_csv(
+        root + '/data/forpreprocessing/whitelist_pos.csv', index=False)
+
+# write a workspace under root; returns the paths of the Hathi and non-Hathi inputs
+def generate(root, volumes, pages, tokens_per_page, nonhathi, pdf_pages, seed=1, progress=False):
+    hathi_dir = root + '/rawdata/downloaded/hathi_raw/'
+    nonhathi_dir = root + '/rawdata/downloaded/nonhathi_raw/'
+    for path in [hathi_dir, nonhathi_dir, root + '/data/forpreprocessing/', root + '/preprocessing/']:
+        os.makedirs(path, exist_ok=True)
+    english = english_vocabulary(seed)
+    write_lexicon(root, english, seed)
+    write_wordlists(root, english, seed)
+
+    hathi_files = []
+    for i in range(volumes):
+        sampler = TokenSampler(english, seed, i)
+        path = hathi_dir + 'syn.%05d.json.bz2' % i
+        write_ef_volume(path, 'syn.%05d' % i, sampler, page_count(sampler.rng, pages), tokens_per_page)
+        hathi_files.append(path)
+        if progress:
+            print('\r%d/%d volumes' % (i + 1, volumes), end='', file=sys.stderr, flush=True)
+    if progress:
+        print(file=sys.stderr)
+
+    nonhathi_files = []
+    for kind in ['pdf', 'docx', 'csv']:
+        for i in range(nonhathi):
+            sampler = TokenSampler(english, seed, volumes + len(nonhathi_files))
+            path = nonhathi_dir + 'syn_%s_%03d.%s' % (kind, i, kind)
+            write_nonhathi(path, sampler, page_count(sampler.rng, pdf_pages), kind)
+            nonhathi_files.append(path)
+    return hathi_files, nonhathi_files
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic dictionary inputs for benchmarking.")
+    parser.add_argument("root", help="folder for the workspace")
+    parser.add_argument("--size", choices=list(sizes), default='small', help="number of files and pages")
+    parser.add_argument("--volumes", type=int, help="number of Extracted Features volumes")
+    parser.add_argument("--pages", type=int, help="mean number of pages per volume")
+    parser.add_argument("--tokens-per-page", type=int, help="mean number of tokens per page")
+    parser.add_argument("--nonhathi", type=int, help="number of pdf, docx and csv files of each kind")
+    parser.add_argument("--pdf-pages", type=int, help="mean number of pages per non-Hathi dictionary")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    config = dict(sizes[args.size])
+    for key in config:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    hathi_files, nonhathi_files = generate(args.root.rstrip('/'), seed=args.seed, progress=True, **config)
+    print("%d volumes and %d non-Hathi files in %s" % (len(hathi_files), len(nonhathi_files), args.root))
+
+if __name__ == "__main__":
+    main()
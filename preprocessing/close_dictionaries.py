@@ -0,0 +1,207 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Find pairs of dictionaries with similar counts for the Swadesh words, which standardize_bila.R treats as
+# duplicates (distance <= cl_thresh and the same glottocode), and write ../data/forpreprocessing/close_dictionaries.csv.
+# Each dictionary kept by standardize_bila.R (5000 or more tokens and engprop >= 30) is represented as in that
+# script by its counts of the Swadesh words normalized to sum to 1000. Instead of a full distance matrix,
+# the pairs within `radius` of each other are found by a blocked search (squared distances from the norms
+# and a matrix product for a block of dictionaries at a time, then exact distances for the candidates), so
+# memory grows with the number of dictionaries rather than its square. A k-d tree is of little use with
+# one dimension per Swadesh word.
+# The vectors and pairs of the last run are kept in ../data/forpreprocessing/close_dictionaries/, and
+# only dictionaries that are new or whose vectors changed are searched against the others on later runs.
+# As before, close_dictionaries.csv holds the closest `max_pairs` ordered pairs: if there are fewer pairs than
+# that within `radius`, the radius is increased until there are enough (or all pairs have been found).
+
+# Examples (run from the preprocessing folder, after wiktionary_filter.R):
+# `python close_dictionaries.py`
+# `python close_dictionaries.py --full`
+
+dict_file = '../data/biladataset/bila_dictionaries_full.csv'
+counts_file = '../data/biladataset/bila_long_nounverbadj_full.csv'
+swadesh_file = '../rawdata/downloaded/Swadesh-1955-215.tsv'
+output_file = '../data/forpreprocessing/close_dictionaries.csv'
+state_dir = '../data/forpreprocessing/close_dictionaries/'
+
+# thresholds used by standardize_bila.R
+min_tokens = 5000
+min_engprop = 30
+cl_thresh = 33
+
+# pairs within this distance are kept (the closest 5000 pairs were all within 43), increased when needed
+radius = 45.0
+# factor by which the radius is increased
+radius_growth = 1.5
+max_pairs = 5000
+
+# dictionaries compared at a time
+blocksize = 256
+
+info_columns = ['langname', 'title', 'imprint', 'year', 'glottocode']
+
+def swadesh_words(path=swadesh_file):
+    english = pd.read_csv(path, sep='\t')['ENGLISH'].str.strip()
+    words = english.str.replace('*', '', n=1, regex=False).str.split(' ').str[0]
+    return list(dict.fromkeys(words))
+
+# normalized Swadesh counts of the dictionaries kept by standardize_bila.R, rows sorted by id
+def swadesh_vectors(counts_path=counts_file, swadesh_path=swadesh_file):
+    swadesh = swadesh_words(swadesh_path)
+    data_words = ['all_token_count_data', 'all_english_count_data', 'all_wiktionary_filtered_data']
+    counts = pd.read_csv(counts_path, dtype={'id': str, 'word': str}, keep_default_na=False, na_values=['NA'])
+    counts = counts[counts['word'].isin(swadesh + data_words)]
+    # absent combinations are zero (as in bila_matrix_nounverbadj_full.csv), filtered forms are NA
+    wide = counts.pivot_table(index='id', columns='word', values='count', aggfunc='sum', fill_value=0, dropna=False)
+    wide = wide.reindex(sorted(counts['id'].unique()))
+    for word in data_words:
+        if word not in wide:
+            wide[word] = 0
+    engprop = 100 * (wide['all_english_count_data'] - wide['all_wiktionary_filtered_data']) / wide['all_token_count_data']
+    wide = wide[(wide['all_token_count_data'] >= min_tokens) & (engprop >= min_engprop)]
+    columns = [word for word in swadesh if word in wide]
+    x = wide[columns].fillna(0).to_numpy(dtype=float)
+    total = x.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = np.nan_to_num(x * 1000 / total)
+    return list(wide.index), columns, x
+
+# distances between the rows of x and y, summed one column at a time as R's dist() does, so that a
+# distance does not depend on the other pairs searched with it
+def distance(x, y):
+    total = np.zeros(len(x))
+    for column in range(x.shape[1]):
+        total += (x[:, column] - y[:, column]) ** 2
+    return np.sqrt(total)
+
+# pairs (i, j, distance) of a row i of queries and a row j of points within radius of each other
+def radius_pairs(queries, points, radius=radius, size=blocksize):
+    qi, pj, distances = [], [], []
+    point_norms = (points ** 2).sum(axis=1)
+    for start in range(0, len(queries), size):
+        block = queries[start:start + size]
+        squared = (block ** 2).sum(axis=1)[:, None] + point_norms[None, :] - 2 * block @ points.T
+        # allow for rounding in the expansion, the exact distances are computed below
+        slack = 1e-9 * (squared.max(initial=0) + 1)
+        i, j = np.nonzero(squared <= radius ** 2 + slack)
+        exact = distance(block[i], points[j])
+        keep = exact <= radius
+        qi.append(i[keep] + start)
+        pj.append(j[keep])
+        distances.append(exact[keep])
+    if not qi:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return np.concatenate(qi), np.concatenate(pj), np.concatenate(distances)
+
+def read_state(path=state_dir):
+    if not os.path.exists(path + 'vectors.npy'):
+        return None
+    with open(path + 'ids.txt') as f:
+        ids = f.read().split('\n')[:-1]
+    with open(path + 'columns.txt') as f:
+        columns = f.read().split('\n')[:-1]
+    with open(path + 'radius.txt') as f:
+        searched = float(f.read())
+    # distances are read back exactly, so that kept pairs sort as they would after a full search
+    pairs = pd.read_csv(path + 'pairs.csv', dtype={'id_a': str, 'id_b': str}, float_precision='round_trip')
+    return ids, columns, np.load(path + 'vectors.npy'), pairs, searched
+
+def write_state(ids, columns, x, pairs, searched, path=state_dir):
+    os.makedirs(path, exist_ok=True)
+    with open(path + 'radius.txt', 'w') as f:
+        f.write('%r\n' % searched)
+    for name, labels in [('ids.txt', ids), ('columns.txt', columns)]:
+        with open(path + name, 'w') as f:
+            for label in labels:
+                f.write(label + '\n')
+    np.save(path + 'vectors.npy', x)
+    pairs.to_csv(path + 'pairs.csv', index=False)
+
+# unordered pairs (id_a < id_b in the order of ids) within radius, searching only the changed dictionaries
+# against all others and keeping the previous pairs of unchanged dictionaries
+def update_pairs(ids, columns, x, state=None, radius=radius):
+    changed = np.ones(len(ids), dtype=bool)
+    pairs = []
+    # the previous pairs are used if they were found with the same Swadesh words and at least this radius
+    if state is not None and state[1] == columns and state[4] >= radius:
+        old_ids, _, old_x, old_pairs, _ = state
+        old_index = pd.Index(old_ids)
+        positions = old_index.get_indexer(ids)
+        known = positions >= 0
+        changed[known] = (old_x[positions[known]] != x[known]).any(axis=1)
+        unchanged = set(np.array(ids, dtype=object)[~changed])
+        keep = old_pairs['id_a'].isin(unchanged) & old_pairs['id_b'].isin(unchanged) & (old_pairs['distance'] <= radius)
+        pairs.append(old_pairs[keep])
+    queries = np.flatnonzero(changed)
+    qi, pj, distances = radius_pairs(x[queries], x, radius)
+    qi = queries[qi]
+    # each pair once: pairs of two changed dictionaries are found from both sides
+    keep = (qi != pj) & (~changed[pj] | (qi < pj))
+    a, b = np.minimum(qi[keep], pj[keep]), np.maximum(qi[keep], pj[keep])
+    ids_array = np.array(ids, dtype=object)
+    pairs.append(pd.DataFrame({'id_a': ids_array[a], 'id_b': ids_array[b], 'distance': distances[keep]}))
+    return pd.concat(pairs, ignore_index=True), int(changed.sum())
+
+# closest ordered pairs with the information on both dictionaries, in the order of standardize_bila.R
+def close_pairs(pairs, ids, dicts, n=max_pairs):
+    ordered = pd.concat([pairs, pairs.rename(columns={'id_a': 'id_b', 'id_b': 'id_a'})], ignore_index=True)
+    position = pd.Series(range(len(ids)), index=ids)
+    ordered['pos_a'] = position.loc[ordered['id_a']].to_numpy()
+    ordered['pos_b'] = position.loc[ordered['id_b']].to_numpy()
+    # ties were in the order of the columns and then the rows of the distance matrix
+    ordered = ordered.sort_values(['distance', 'pos_b', 'pos_a']).head(n)
+    info = dicts.set_index('id')[info_columns]
+    for side in ['a', 'b']:
+        side_info = info.reindex(ordered['id_' + side]).set_axis(ordered.index)
+        for column in info_columns:
+            ordered[column + '_' + side] = side_info[column]
+    return ordered[['distance', 'langname_a', 'langname_b', 'title_a', 'imprint_a', 'year_a', 'title_b', 'imprint_b', 'year_b',
+                    'id_a', 'id_b', 'glottocode_a', 'glottocode_b']]
+
+# duplicate clusters as formed by standardize_bila.R: number of pairs and of clusters with two or more dictionaries
+def duplicate_clusters(close):
+    dups = close[(close['distance'] <= cl_thresh) & (close['glottocode_a'] == close['glottocode_b'])]
+    codes, labels = pd.factorize(pd.concat([dups['id_a'], dups['id_b']]))
+    n = len(labels)
+    graph = coo_matrix((np.ones(len(dups)), (codes[:len(dups)], codes[len(dups):])), shape=(n, n))
+    nclusters, _ = connected_components(graph, directed=False)
+    return len(dups), nclusters
+
+def main():
+    parser = argparse.ArgumentParser(description="Find pairs of dictionaries with similar Swadesh counts.")
+    parser.add_argument("--counts", type=str, default=counts_file, help="BILA counts in long form")
+    parser.add_argument("--dictionaries", type=str, default=dict_file, help="dictionary metadata")
+    parser.add_argument("--output", type=str, default=output_file, help="output file")
+    parser.add_argument("--radius", type=float, default=radius, help="keep pairs within this distance")
+    parser.add_argument("--max-pairs", type=int, default=max_pairs, help="number of ordered pairs written")
+    parser.add_argument("--full", action='store_true', help="search all dictionaries instead of the changed ones")
+    args = parser.parse_args()
+
+    start = time.time()
+    ids, columns, x = swadesh_vectors(args.counts)
+    state = None if args.full else read_state()
+    search_radius = args.radius
+    pairs, nchanged = update_pairs(ids, columns, x, state, search_radius)
+    # each unordered pair gives two ordered pairs
+    while 2 * len(pairs) < min(args.max_pairs, len(ids) * (len(ids) - 1)):
+        search_radius *= radius_growth
+        print("%d ordered pairs within %g, searching again within %g" % (2 * len(pairs), search_radius / radius_growth, search_radius))
+        pairs, nchanged = update_pairs(ids, columns, x, None, search_radius)
+    write_state(ids, columns, x, pairs, search_radius)
+    if 2 * len(pairs) < args.max_pairs:
+        print("Warning: only %d ordered pairs (of %d) between %d dictionaries" % (2 * len(pairs), args.max_pairs, len(ids)))
+
+    dicts = pd.read_csv(args.dictionaries, dtype=str, keep_default_na=False, na_values=[''])
+    close = close_pairs(pairs, ids, dicts, args.max_pairs)
+    close.to_csv(args.output, index=False, na_rep='NA')
+    npairs, nclusters = duplicate_clusters(close)
+    print("%d dictionaries (%d searched), %d pairs within %g, %d duplicate pairs in %d clusters (%.1fs)" %
+          (len(ids), nchanged, len(pairs), search_radius, npairs, nclusters, time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import os
+import sqlite3
+import time
+import numpy as np
+import pandas as pd
+
+# On-disk index of the English cognates in CogNet, used by wiktionary_extract.py.
+# `python cognet_index.py build` reads CogNet-v2.0.tsv once and writes an SQLite database with one row for each
+# pair of an English word and a cognate form in another language:
+#   cognates (english TEXT, lang TEXT, form TEXT), keyed by (english, lang, form) and indexed by (english, form)
+# Lookups are made in batches (a temporary table of queries joined with the index), so checking the
+# forms of many Wiktionary entries needs neither the whole of CogNet in memory nor one query per form.
+# The database can also be queried from R, e.g.
+#   con <- DBI::dbConnect(RSQLite::SQLite(), here("data", "forpreprocessing", "cognet.sqlite"))
+#   DBI::dbGetQuery(con, "SELECT lang, form FROM cognates WHERE english = ?", params = list("dance"))
+
+# Examples (run from the preprocessing folder):
+# `python cognet_index.py build`
+# `python cognet_index.py info`
+# `python cognet_index.py words dance perfume`
+
+cognet_file = '../rawdata/downloaded/CogNet-v2.0.tsv'
+indexfile = '../data/forpreprocessing/cognet.sqlite'
+
+# rows inserted at a time when building
+batchsize = 100000
+
+# (english, lang, form) for each line of CogNet with an English word on either side
+def read_cognet(path):
+    with open(path, 'r', encoding='utf-8') as f_in:
+        for line in f_in:
+            elements = line.strip().split('\t')
+            if len(elements) < 5:
+                continue
+            if elements[1] == 'eng':
+                yield (elements[2], elements[3], elements[4])
+            if elements[3] == 'eng':
+                yield (elements[4], elements[1], elements[2])
+
+def build(cognet_path=cognet_file, path=indexfile):
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('CREATE TABLE rows (english TEXT, lang TEXT, form TEXT)')
+    rows = read_cognet(cognet_path)
+    while True:
+        batch = [row for _, row in zip(range(batchsize), rows)]
+        if not batch:
+            break
+        conn.executemany('INSERT INTO rows VALUES (?, ?, ?)', batch)
+    conn.execute('''CREATE TABLE cognates (english TEXT, lang TEXT, form TEXT,
+                        PRIMARY KEY (english, lang, form)) WITHOUT ROWID''')
+    conn.execute('INSERT OR IGNORE INTO cognates SELECT * FROM rows ORDER BY english, lang, form')
+    conn.execute('DROP TABLE rows')
+    conn.execute('CREATE INDEX cognates_form ON cognates (english, form)')
+    stat = os.stat(cognet_path)
+    conn.execute('CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)')
+    conn.executemany('INSERT INTO info VALUES (?, ?)',
+                     [('source', os.path.basename(cognet_path)), ('size', str(stat.st_size)),
+                      ('mtime', str(stat.st_mtime)), ('built', time.strftime('%Y-%m-%d %H:%M:%S'))])
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    os.replace(tmp_path, path)
+
+class CognateIndex:
+
+    def __init__(self, path=indexfile):
+        if not os.path.exists(path):
+            raise FileNotFoundError("no cognate index at %s: run `python cognet_index.py build`" % path)
+        self.conn = sqlite3.connect('file:%s?mode=ro' % os.path.abspath(path), uri=True)
+
+    def info(self):
+        info = dict(self.conn.execute('SELECT key, value FROM info'))
+        info['rows'] = self.conn.execute('SELECT count(*) FROM cognates').fetchone()[0]
+        return info
+
+    # fill a temporary table with the queries, one row per query
+    def _queries(self, columns):
+        self.conn.execute('DROP TABLE IF EXISTS temp.queries')
+        names = ['q%d' % i for i in range(len(columns))]
+        self.conn.execute('CREATE TEMP TABLE queries (i INTEGER PRIMARY KEY, %s)' % ', '.join(names))
+        self.conn.executemany('INSERT INTO temp.queries VALUES (?%s)' % (', ?' * len(names)),
+                              zip(range(len(columns[0])), *columns))
+
+    def _found(self, n, sql):
+        found = np.zeros(n, dtype=bool)
+        found[[i for (i,) in self.conn.execute(sql)]] = True
+        self.conn.execute('DROP TABLE temp.queries')
+        return found
+
+    # all cognates of the English words: data frame with columns english, lang and form
+    def cognates(self, words):
+        self._queries([list(words)])
+        rows = self.conn.execute('''SELECT c.english, c.lang, c.form FROM temp.queries q
+                                    JOIN cognates c ON c.english = q.q0''').fetchall()
+        self.conn.execute('DROP TABLE temp.queries')
+        return pd.DataFrame(rows, columns=['english', 'lang', 'form'])
+
+    # for each (word, lang, form), whether form in lang is a cognate of the English word
+    def contains(self, words, langs, forms):
+        self._queries([list(words), list(langs), list(forms)])
+        return self._found(len(words), '''SELECT i FROM temp.queries q WHERE EXISTS
+                                           (SELECT 1 FROM cognates c WHERE c.english = q.q0 AND c.lang = q.q1 AND c.form = q.q2)''')
+
+    # for each (word, form), whether form is a cognate of the English word in any language
+    def contains_form(self, words, forms):
+        self._queries([list(words), list(forms)])
+        return self._found(len(words), '''SELECT i FROM temp.queries q WHERE EXISTS
+                                           (SELECT 1 FROM cognates c WHERE c.english = q.q0 AND c.form = q.q1)''')
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the index of English cognates in CogNet.")
+    parser.add_argument("command", choices=['build', 'info', 'words'], help="build the index, describe it, or list the cognates of words")
+    parser.add_argument("words", nargs='*', help="English words (words)")
+    parser.add_argument("--cognet", type=str, default=cognet_file, help="CogNet file (build)")
+    parser.add_argument("--index", type=str, default=indexfile, help="cognate index")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        build(args.cognet, args.index)
+        print("indexed %d cognates in %.1fs" % (CognateIndex(args.index).info()['rows'], time.time() - start))
+    elif args.command == 'info':
+        for key, value in CognateIndex(args.index).info().items():
+            print("%s\t%s" % (key, value))
+    else:
+        print(CognateIndex(args.index).cognates(args.words).to_csv(sep='\t', index=False), end='')
+
+if __name__ == "__main__":
+    main()
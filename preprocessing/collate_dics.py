@@ -1,38 +1,118 @@
 import glob
+import numpy as np
 import pandas as pd
 import os
 import re
 import argparse
+import scipy.sparse
+import metrics
 
 # Combine counts for all dictionaries into one file
 
+# Counts are streamed: each dictionary is read and appended to the output in turn, so memory use
+# is bounded by chunksize rows rather than by the size of the combined file.
+# With --matrix, the dictionary x word counts are also written as a sparse CSR matrix
+# (dictionary_matrix_<pos>.npz) with its row (dictionary) and column (word) labels in
+# dictionary_matrix_<pos>_rows.txt and dictionary_matrix_<pos>_cols.txt. Rows and columns are sorted.
+# With `--metrics`, the time spent reading, writing and building the matrix is recorded (see metrics.py).
+
+# number of rows to buffer before writing
+chunksize = 1000000
+
+# columns of the combined file (previously sorted by pd.concat)
+columns = ['count', 'id_sanitized', 'word']
+
+def counts_file(pos):
+    return '../data/forpreprocessing/dictionary_counts_' + pos + '.csv'
+
+def matrix_files(pos):
+    pref = '../data/forpreprocessing/dictionary_matrix_' + pos
+    return pref + '.npz', pref + '_rows.txt', pref + '_cols.txt'
+
+def write_labels(path, labels):
+    with open(path, 'w') as f:
+        for label in labels:
+            f.write(label + '\n')
+
+# sparse dictionary x word matrix built from (dictionary, word code, count) triples
+def write_matrix(pos, dnames, words, rows, cols, vals):
+    # sort rows and columns and renumber the codes accordingly
+    roworder = np.argsort(np.array(dnames, dtype=object), kind='stable')
+    colorder = np.argsort(np.array(words, dtype=object), kind='stable')
+    rowrank = np.empty(len(dnames), dtype=np.int64)
+    rowrank[roworder] = np.arange(len(dnames))
+    colrank = np.empty(len(words), dtype=np.int64)
+    colrank[colorder] = np.arange(len(words))
+
+    matrix = scipy.sparse.coo_matrix((np.concatenate(vals), (rowrank[np.concatenate(rows)], colrank[np.concatenate(cols)])),
+                                     shape=(len(dnames), len(words))).tocsr()
+    matrixfile, rowfile, colfile = matrix_files(pos)
+    scipy.sparse.save_npz(matrixfile, matrix)
+    write_labels(rowfile, [dnames[i] for i in roworder])
+    write_labels(colfile, [words[i] for i in colorder])
+
 def read_files(args):
     poscntdir = '../data/forpreprocessing/' + args.pos + '_counts_phase2/'
     poscntdir_nonht = '../data/forpreprocessing/' + args.pos + '_counts_phase2_nonhathi/'
-    d_cntfiles = glob.glob(poscntdir + '*.csv') + glob.glob(poscntdir_nonht + '*.csv') 
-    alldcounts_list = []
+    d_cntfiles = glob.glob(poscntdir + '*.csv') + glob.glob(poscntdir_nonht + '*.csv')
+
+    # codes for words and dictionaries seen so far (used for the sparse matrix)
+    wordcodes = {}
+    dcodes = {}
+    rows, cols, vals = [], [], []
 
-    for d_cntfile in d_cntfiles:
+    alldcountsfile = counts_file(args.pos)
+    buffer = []
+    nbuffered = 0
+    nrows = 0
+    with open(alldcountsfile, 'w') as f:
+        f.write(','.join(columns) + '\n')
+        for i, d_cntfile in enumerate(d_cntfiles):
             dname = os.path.basename(d_cntfile)
             dname = re.sub("_top_.*freqs_phase2.csv", "", dname)
             # dname = re.sub(',', '.', dname)
-            thisdcounts = pd.read_csv(d_cntfile, na_filter=False)
+            with metrics.stage('read'):
+                thisdcounts = pd.read_csv(d_cntfile, na_filter=False, dtype={'lowercase': str})
             thisdcounts.rename(columns={'lowercase': 'word'}, inplace=True)
             thisdcounts['id_sanitized'] = dname
-            alldcounts_list.append(thisdcounts)
-            print(dname)
+            buffer.append(thisdcounts[columns])
+            nbuffered += thisdcounts.shape[0]
 
-    alldcounts = pd.concat(alldcounts_list, axis = 0, sort = True)
-    alldcountsfile = '../data/forpreprocessing/dictionary_counts_' + args.pos + '.csv'
-    with open(alldcountsfile, 'w') as f:
-            alldcounts.to_csv(f, index=False)
+            if args.matrix:
+                with metrics.stage('matrix'):
+                    codes = np.array([wordcodes.setdefault(word, len(wordcodes)) for word in thisdcounts['word']], dtype=np.int32)
+                    rows.append(np.full(len(codes), dcodes.setdefault(dname, len(dcodes)), dtype=np.int32))
+                    cols.append(codes)
+                    vals.append(thisdcounts['count'].to_numpy(dtype=np.int64))
+
+            if nbuffered >= chunksize or i == len(d_cntfiles) - 1:
+                with metrics.stage('write'):
+                    pd.concat(buffer, axis = 0).to_csv(f, index=False, header=False)
+                nrows += nbuffered
+                buffer = []
+                nbuffered = 0
+
+    print("%d dictionaries, %d rows written to %s" % (len(d_cntfiles), nrows, alldcountsfile))
+    metrics.count('rows', nrows)
+
+    if args.matrix and rows:
+        # counts for a dictionary that occurs more than once are summed when the matrix is built
+        dnames = list(dcodes)
+        words = list(wordcodes)
+        with metrics.stage('matrix'):
+            write_matrix(args.pos, dnames, words, rows, cols, vals)
+        print("%d x %d matrix written to %s" % (len(dnames), len(words), matrix_files(args.pos)[0]))
 
 
 def main():
     parser = argparse.ArgumentParser(description="Compile dictionary counts.")
     parser.add_argument("--pos", type=str, choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj")
+    parser.add_argument("--matrix", action='store_true', help="also write the dictionary x word counts as a sparse matrix")
+    metrics.add_arguments(parser)
     args = parser.parse_args()
-    read_files(args)
+    metrics.setup_args(args, 'collate_dics')
+    with metrics.item(args.pos):
+        read_files(args)
 
 if __name__ == "__main__":
     main()
@@ -1,37 +1,239 @@
-
 import argparse
-from rdflib import Graph
+import collections
+import re
+import sys
+
+# Language names and alternative names (rdfs:label and skos:altLabel) from the Glottolog RDF dump.
+# The file is read line by line and its statements are tokenized as it goes, keeping only the objects of
+# these two predicates, instead of parsing the whole file into an rdflib Graph. The output is the same list of
+# names (in the order of the file rather than that of the graph).
+# The rdflib version is kept: --rdflib reads the file with rdflib as before, and --compare reads it both ways and
+# lists the names that differ (run it on a new Glottolog dump before relying on the streamed names).
+# With --index, the names are also written with the glottocode of each languoid (glottocode, name_type, label),
+# which read_hathi_list.py (--gcodes) and filtered_to_gcode.R read directly.
+
+# `python read_glottolog_language_names.py > ../../data/forpreprocessing/glottolog_variant_names.tsv`
+# `python read_glottolog_language_names.py --index ../../data/forpreprocessing/glottolog_names.tsv > ../../data/forpreprocessing/glottolog_variant_names.tsv`
+# `python read_glottolog_language_names.py --compare`
+
+glottolog_file = "../../rawdata/downloaded/glottolog_language.n3"
+
+rdf_type = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+name_types = {'http://www.w3.org/2000/01/rdf-schema#label': 'name',
+              'http://www.w3.org/2004/02/skos/core#altLabel': 'altname'}
+
+glottocode_re = re.compile(r'[a-z0-9]{4}[0-9]{4}$')
+
+_token = re.compile(r'''
+    (?P<space>\s+|\#[^\n]*)
+  | (?P<long>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\')
+  | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+  | (?P<iri><[^<>\s]*>)
+  | (?P<at>@[A-Za-z]+(?:-[A-Za-z0-9]+)*)
+  | (?P<datatype>\^\^)
+  | (?P<punct>[.;,\[\]()])
+  | (?P<name>[^\s.;,\[\]()<>"'^]+(?:\.+[^\s.;,\[\]()<>"'^]+)*)
+''', re.VERBOSE | re.DOTALL)
+
+_escape = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))', re.DOTALL)
+_escapes = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f'}
+
+def unescape(text):
+    def replace(match):
+        code = match.group(1) or match.group(2)
+        if code:
+            return chr(int(code, 16))
+        return _escapes.get(match.group(3), match.group(3))
+    return _escape.sub(replace, text)
+
+class Literal(str):
+    pass
+
+# (subject, predicate, object) for each statement of a Turtle/N3 file whose predicate is in predicates
+# (other objects are skipped without being decoded). Objects are Literal for strings and str for IRIs.
+class TripleReader:
+
+    def __init__(self, predicates):
+        self.predicates = set(predicates)
+        self.prefixes = {}
+        self.base = ''
+        # one frame per blank node being read: [subject, predicate, expected]
+        self.frames = [[None, None, 'subject']]
+        self.directive = None
+        self.depth = 0
+        self.skip = False
+        self.blank_nodes = 0
+
+    def resolve(self, token):
+        if token == 'a':
+            return rdf_type
+        if token.startswith('<'):
+            iri = unescape(token[1:-1])
+            return iri if ':' in iri or not self.base else self.base + iri
+        if ':' in token:
+            prefix, local = token.split(':', 1)
+            return self.prefixes.get(prefix, prefix + ':') + re.sub(r'\\(.)', r'\1', local)
+        return token
+
+    def term(self, kind, token):
+        if kind == 'long':
+            return Literal(unescape(token[3:-3]))
+        if kind == 'string':
+            return Literal(unescape(token[1:-1]))
+        return self.resolve(token)
 
-def load_file(file_path):
+    # a subject, predicate or object has been read
+    def add(self, value):
+        frame = self.frames[-1]
+        if frame[2] == 'subject':
+            frame[0], frame[2] = value, 'predicate'
+        elif frame[2] == 'predicate':
+            frame[1], frame[2] = value, 'object'
+        elif frame[2] == 'object':
+            frame[2] = 'after'
+            if frame[1] in self.predicates:
+                return (frame[0], frame[1], value)
+        return None
+
+    def feed(self, text):
+        triples = []
+        for match in _token.finditer(text):
+            kind, token = match.lastgroup, match.group()
+            if kind == 'space':
+                continue
+            if self.directive is not None:
+                # @prefix p: <iri> . and PREFIX p: <iri> (@base and BASE likewise)
+                if kind == 'iri':
+                    if self.directive[0] in ('@prefix', 'prefix'):
+                        self.prefixes[self.directive[1].rstrip(':')] = token[1:-1]
+                    else:
+                        self.base = token[1:-1]
+                    if not self.directive[0].startswith('@'):
+                        self.directive = None
+                elif token == '.':
+                    self.directive = None
+                else:
+                    self.directive.append(token)
+                continue
+            if self.skip:
+                # the datatype of a literal
+                self.skip = False
+                continue
+            if self.depth:
+                # the items of a collection are skipped
+                self.depth += token == '('
+                self.depth -= token == ')'
+                if not self.depth:
+                    self.add(None)
+                continue
+            frame = self.frames[-1]
+            if frame[2] == 'subject' and len(self.frames) == 1 and token.lower() in ('@prefix', '@base', 'prefix', 'base'):
+                self.directive = [token.lower()]
+            elif kind == 'at' or kind == 'datatype':
+                # language tag or datatype of the last literal
+                self.skip = kind == 'datatype'
+            elif token == '[':
+                self.blank_nodes += 1
+                self.frames.append(['_:b%d' % self.blank_nodes, None, 'predicate'])
+            elif token == ']':
+                if len(self.frames) > 1:
+                    triple = self.add(self.frames.pop()[0])
+                    if triple:
+                        triples.append(triple)
+            elif token == '(':
+                self.depth = 1
+            elif token == ',':
+                frame[2] = 'object'
+            elif token == ';':
+                frame[2] = 'predicate'
+            elif token == '.':
+                self.frames = [[None, None, 'subject']]
+            else:
+                triple = self.add(self.term(kind, token))
+                if triple:
+                    triples.append(triple)
+        return triples
+
+# statements with the given predicates in a file, read line by line (long strings may span several lines)
+def read_triples(file_path, predicates):
+    reader = TripleReader(predicates)
+    buffer = ''
+    with open(file_path, encoding='utf-8') as f:
+        for line in f:
+            buffer += line
+            if buffer.count('"""') % 2 or buffer.count("'''") % 2:
+                continue
+            yield from reader.feed(buffer)
+            buffer = ''
+    if buffer:
+        yield from reader.feed(buffer)
+
+# glottocode of a languoid IRI, or None
+def glottocode(iri):
+    code = iri.rstrip('/').rsplit('/', 1)[-1]
+    return code if glottocode_re.match(code) else None
+
+# the same clean up of quotes as before
+def clean_label(label):
+    # handle entries with unmatched quotations
+    return label.replace('"', '').replace('“', '').replace('”', '')
+
+# (glottocode, name_type, label) for the names of the file
+def read_names(file_path):
+    for subject, predicate, label in read_triples(file_path, name_types):
+        if not isinstance(label, Literal):
+            continue
+        label = clean_label(label)
+        if label != '':
+            yield glottocode(subject), name_types[predicate], label
+
+# the same names read with rdflib (the whole file is parsed into a Graph)
+def read_names_rdflib(file_path):
+    from rdflib import Graph, URIRef
     graph = Graph()
-    print("name_type\tlabel")
-    try:
-        graph.parse(file_path, format='n3')
-        for s, p, o in graph:
-            #if str(p) == 'http://www.w3.org/2004/02/skos/core#altLabel' or \
-            #    str(p) == 'http://www.w3.org/2000/01/rdf-schema#label':
-
-            # handle entries with unmatched quotations
-            o = o.replace('"', '')
-            o = o.replace('“', '')
-            o = o.replace('”', '')
-
-            if str(o) != '':
-                if str(p) == 'http://www.w3.org/2000/01/rdf-schema#label':
-                    print("name\t" + str(o))
-                elif str(p) == 'http://www.w3.org/2004/02/skos/core#altLabel':
-                    print("altname\t" + str(o))   
-    except FileNotFoundError:
-        print(f"Error: File not found - {file_path}")
+    graph.parse(file_path, format='n3')
+    for s, p, o in graph:
+        if str(p) in name_types:
+            label = clean_label(str(o))
+            if label != '':
+                yield (glottocode(str(s)) if isinstance(s, URIRef) else None), name_types[str(p)], label
+
+# names found by only one of the two readers (with the number of times they are found by each)
+def compare(file_path):
+    streamed = collections.Counter(read_names(file_path))
+    parsed = collections.Counter(read_names_rdflib(file_path))
+    differences = sorted((streamed - parsed) + (parsed - streamed), key=lambda name: (name[0] or '',) + name[1:])
+    print("%d names streamed, %d names from rdflib, %d differ" % (sum(streamed.values()), sum(parsed.values()), len(differences)))
+    for name in differences:
+        print("%s\t%s\t%s\tstreamed %d, rdflib %d" % (name[0], name[1], name[2], streamed[name], parsed[name]))
+    return not differences
 
 def main():
-    #parser = argparse.ArgumentParser(description="Read language names from .n3 file.")
-    #parser.add_argument("file_path", type=str, help="Path to the .n3 file")
-    #args = parser.parse_args()
-    #load_file(args.file_path)
-    #load_file("/Users/ckemp/u/mygithub/lexical_elaboration/data/forpreprocessing/downloaded/glottolog_language.n3")
-    #load_file("/Users/ckemp/u/mygithub/lexical_elaboration/rawdata/downloaded/glottolog_language.n3")
-    load_file("../../rawdata/downloaded/glottolog_language.n3")
+    parser = argparse.ArgumentParser(description="Read language names from the Glottolog .n3 file.")
+    parser.add_argument("file_path", nargs='?', default=glottolog_file, help="path to the .n3 file")
+    parser.add_argument("--index", type=str, help="also write glottocode, name_type and label to this file")
+    parser.add_argument("--rdflib", action='store_true', help="read the file with rdflib instead of streaming it")
+    parser.add_argument("--compare", action='store_true', help="read the file both ways and list the names that differ")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(0 if compare(args.file_path) else 1)
+
+    out = sys.stdout
+    out.write("name_type\tlabel\n")
+    index = open(args.index, 'w', encoding='utf-8') if args.index else None
+    try:
+        if index:
+            index.write("glottocode\tname_type\tlabel\n")
+        for code, name_type, label in (read_names_rdflib if args.rdflib else read_names)(args.file_path):
+            out.write(name_type + "\t" + label + "\n")
+            if index and code is not None:
+                index.write(code + "\t" + name_type + "\t" + label + "\n")
+    except FileNotFoundError:
+        print(f"Error: File not found - {args.file_path}")
+    finally:
+        if index:
+            index.close()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,23 @@
+import argparse
+import functools
+import multiprocessing
+import os
 import sys
 import regex
 from collections import defaultdict
-from operator import itemgetter
 from tqdm import tqdm
 import unicodedata
 
+# Language names are matched with a single table of all names rather than one pattern per name:
+# the case-folded names are grouped by length, and every substring of the case-folded title with one of
+# these lengths is looked up in the table. Each candidate found is then checked with the original pattern
+# for that name ((?w)\bNAME\b, ignoring case), so a title matches exactly when one of these patterns does.
+# The hathifile is split into chunks that are scanned by a pool of worker processes.
+
+# `python read_hathi_list.py > ../../preprocessing/hathi_trust/01_initial_volumes.csv`
+# `python read_hathi_list.py hathi_full_20240101.txt --matches 01_language_matches.tsv > 01_initial_volumes.csv`
+# `python read_hathi_list.py --matches 01_language_matches.tsv --gcodes ../../data/forpreprocessing/glottolog_names.tsv > 01_initial_volumes.csv`
+
 def read_file(file_path):
     with open(file_path, 'r', encoding='utf-8') as file:
         # skip header
@@ -14,56 +27,120 @@ lang_names_path = "../../data/forpreprocessing/language_names.csv"
 lang_names = read_file(lang_names_path)
 
 lang_names= [unicodedata.normalize('NFC', lang.strip()) for lang in lang_names]  # strip language names and normalize
-lang_counts = {lang: 0 for lang in lang_names}  # Initialize language counters
-lang_patterns = [regex.compile(r'(?w)\b{}\b'.format(regex.escape(lang)), regex.IGNORECASE) for lang in lang_names]
-
-#f = open("/Users/ckemp/Downloads/hathitrust/hathi_full_20231101.txt", 'r', encoding = 'utf-8')
-f = open("hathi_full_20231101.txt", 'r', encoding = 'utf-8')
-
-titledict = defaultdict()
-imprintdict = defaultdict()
-datedict = defaultdict()
-oclcdict = defaultdict()
-lccndict = defaultdict()
-enumerationdict = defaultdict()
-accessdict = defaultdict()
-rightsdict= defaultdict()
-
-for line in tqdm(f):
-    fields = [x.strip() for x in line.split('\t')]
-    (volume, access, rights, title, imprint, pubdate, oclc, lccn, enumeration) = (fields[0], fields[1], fields[2], fields[11], fields[12], fields[16], fields[7], fields[10], fields[4])
-    (volume, title, imprint, pubdate, oclc, lccn, enumeration) = (fields[0], fields[11], fields[12], fields[16], fields[7], fields[10], fields[4])
-    title = unicodedata.normalize('NFC', title)
-    if regex.search("ictionar", title): 
-        if ( regex.search("uinea|ustrali|frica|acific|ceani|inguist|anguage|exico|ocabular|ialect", title) or 
-             regex.search("uinea|ustrali|frica|acific|ceani|inguist|anguage|exico|ocabular|ialect|Mouton|Gruyter|of Hawa|Lincom|Köppe|Madras|California|ission", imprint) or
-             any(pattern.search(title) for pattern in lang_patterns) ):
-#        for pattern, lang in zip(lang_patterns, lang_names):
-#            if pattern.search(title):
-                titledict[volume] = title
-                imprintdict[volume] = imprint 
-                accessdict[volume] = access
-                rightsdict[volume] = rights
-                datedict[volume] = pubdate
-                oclcdict[volume] =oclc 
-                lccndict[volume] =lccn
-                enumerationdict[volume] =enumeration
-               # lang_counts[lang] += 1
-f.close()
-
-#print("Language Counts:")
-#for lang, count in  sorted( lang_counts.items(), key=itemgetter(1), reverse=True):
-#    print(f"{lang}: {count}")
-
-fout = sys.stdout
-fout.write("id\ttitle\tenumeration\timprint\tyear\toclc\tlcc\taccess\trights\n")
-for k, v in sorted( datedict.items(), key=itemgetter(1), reverse=True):
-    v = datedict[k]
-    t = titledict[k]
-    i = imprintdict[k]
-    o = oclcdict[k]
-    l = lccndict[k]
-    e = enumerationdict[k]
-    r = rightsdict[k]
-    a = accessdict[k]
-    fout.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (k, t, e, i, v, o, l, a, r))
+
+# case-folded names, each mapped to the original names with that folded form
+folded_names = defaultdict(list)
+for lang in lang_names:
+    folded_names[lang.casefold()].append(lang)
+folded_lengths = sorted(set(len(folded) for folded in folded_names))
+
+@functools.lru_cache(maxsize=None)
+def lang_pattern(lang):
+    return regex.compile(r'(?w)\b{}\b'.format(regex.escape(lang)), regex.IGNORECASE)
+
+# language names that match the title
+def match_languages(title):
+    folded = title.casefold()
+    candidates = set()
+    for start in range(len(folded)):
+        for length in folded_lengths:
+            if start + length > len(folded):
+                break
+            candidates.update(folded_names.get(folded[start:start + length], ()))
+    return sorted(lang for lang in candidates if lang_pattern(lang).search(title))
+
+# glottocodes of each form of a name used in language_names.csv (see make_language_re.R): the name without
+# parentheses, the same with alphanumeric characters only, and the same without accents
+def read_gcodes(index_path):
+    gcodes = defaultdict(set)
+    with open(index_path, 'r', encoding='utf-8') as f:
+        next(f)
+        for line in f:
+            gcode, _, label = line.rstrip('\n').split('\t')
+            no_parens = regex.sub(r' \(.*\)', '', unicodedata.normalize('NFC', label))
+            alnum = regex.sub(r'[^\p{Alnum}]', '', no_parens)
+            without_accents = ''.join(c for c in unicodedata.normalize('NFKD', no_parens) if not unicodedata.combining(c))
+            for form in (no_parens, alnum, without_accents):
+                gcodes[form].add(gcode)
+    return gcodes
+
+hathi_file = "hathi_full_20231101.txt"
+
+# size of the chunks of the hathifile read by each worker
+chunksize = 64 << 20
+
+# byte ranges of the file that start at the beginning of a line
+def chunk_ranges(file_path, size=chunksize):
+    end = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while start < end:
+            f.seek(min(start + size, end))
+            f.readline()
+            stop = min(f.tell(), end)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+# selected volumes in a byte range of the file, in order: (volume, record, matched language names)
+def read_chunk(file_path, start, stop):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    rows = []
+    # splitlines(True) on the decoded chunk would split on more characters than reading the file in text mode
+    for line in data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if not line:
+            continue
+        fields = [x.strip() for x in line.split('\t')]
+        (volume, access, rights, title, imprint, pubdate, oclc, lccn, enumeration) = (fields[0], fields[1], fields[2], fields[11], fields[12], fields[16], fields[7], fields[10], fields[4])
+        title = unicodedata.normalize('NFC', title)
+        if regex.search("ictionar", title):
+            langs = match_languages(title)
+            if ( regex.search("uinea|ustrali|frica|acific|ceani|inguist|anguage|exico|ocabular|ialect", title) or
+                 regex.search("uinea|ustrali|frica|acific|ceani|inguist|anguage|exico|ocabular|ialect|Mouton|Gruyter|of Hawa|Lincom|Köppe|Madras|California|ission", imprint) or
+                 langs ):
+                rows.append((volume, (title, enumeration, imprint, pubdate, oclc, lccn, access, rights), langs))
+    return rows
+
+def read_chunk_range(args):
+    return read_chunk(*args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract candidate dictionaries from a hathifile.")
+    parser.add_argument("hathifile", nargs='?', default=hathi_file, help="tab-separated hathifile (hathi_full_*.txt)")
+    parser.add_argument("--jobs", type=int, default=max(1, int(0.9 * os.cpu_count())), help="number of worker processes")
+    parser.add_argument("--matches", type=str, help="also write the language names matched in each title to this file")
+    parser.add_argument("--gcodes", type=str, help="glottocode index written by read_glottolog_language_names.py --index, "
+                        "used to add the glottocodes of the matched names to --matches")
+    args = parser.parse_args()
+
+    # volumes are kept in the order in which they first appear, with the fields of their last appearance
+    records = {}
+    matches = {}
+    ranges = [(args.hathifile, start, stop) for start, stop in chunk_ranges(args.hathifile)]
+    context = multiprocessing.get_context('fork')
+    with context.Pool(args.jobs) as pool:
+        for rows in tqdm(pool.imap(read_chunk_range, ranges), total=len(ranges)):
+            for volume, record, langs in rows:
+                records[volume] = record
+                matches[volume] = langs
+
+    fout = sys.stdout
+    fout.write("id\ttitle\tenumeration\timprint\tyear\toclc\tlcc\taccess\trights\n")
+    for k, record in sorted(records.items(), key=lambda item: item[1][3], reverse=True):
+        fout.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % ((k,) + record))
+
+    if args.matches:
+        gcodes = read_gcodes(args.gcodes) if args.gcodes else None
+        with open(args.matches, 'w', encoding='utf-8') as f:
+            f.write("id\tlanguages" + ("\tglottocodes" if gcodes is not None else "") + "\n")
+            for k in records:
+                row = "%s\t%s" % (k, '|'.join(matches[k]))
+                if gcodes is not None:
+                    row += "\t" + '|'.join(sorted(set().union(*(gcodes.get(lang, ()) for lang in matches[k]))))
+                f.write(row + "\n")
+
+if __name__ == "__main__":
+    main()
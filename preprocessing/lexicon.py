@@ -0,0 +1,246 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+
+# Lookup table used to filter tokens in read_ht_file.py and read_nonht_file.py.
+# Each form is mapped to a bitmask of COCA POS classes, its COCA count, a flag for membership
+# in the nltk list of English words, and one flag for each Phase 1 vocabulary. Filtering
+# a column of tokens is then a single hash join against this table instead of a Python call per token.
+
+# The table is stored as a versioned artifact in ../data/forpreprocessing/lexicon/: the forms as a sorted
+# array of fixed-width byte strings (forms.npy) and one array per column (posmask.npy, coca.npy,
+# english.npy, vocab_<pos>.npy), all loaded memory-mapped so that worker processes share the same pages.
+# lexicon.json records a checksum for each column and a version for the whole lexicon. The checksum of a
+# column depends only on the forms for which it is nonzero, so adding a vocabulary does not change the
+# checksums of the other columns. readcoca.py writes the COCA columns and make_vocab.py adds each vocabulary.
+
+# To build the artifact from existing pickles (wordpos.p, wordposcounts.p and <pos>_vocab.p):
+# `python lexicon.py build --vocab noun --vocab nounverbadj`
+# To show the version and checksums (and check them against the arrays):
+# `python lexicon.py info --verify`
+
+lexicon_dir = '../data/forpreprocessing/lexicon/'
+
+# version of the layout of the artifact
+format_version = 1
+
+# columns that do not depend on the Phase 1 vocabularies
+base_columns = ['posmask', 'coca', 'english']
+
+# bit for each class of COCA POS tag (first letter of the tag)
+posbits = {'n': 1, 'v': 2, 'j': 4, 'r': 8}
+
+# set for every form that has a COCA POS tag
+tagged = 16
+
+# POS classes allowed in each set of forms
+# these correspond to the regular expressions '^n', '^n|^v|^j' etc previously used on POS tags
+posmasks = {'noun': 1, 'verb': 2, 'adj': 4, 'adv': 8, 'nounverb': 3, 'nounverbadj': 7, 'all': tagged}
+
+def posmask(tag):
+    if tag == 0:
+        return 0
+    return tagged | posbits.get(tag[:1], 0)
+
+# pos and counts are the dictionaries produced by readcoca.py, engwords is a set of English words
+# and vocabs maps the name of each POS set to its Phase 1 vocabulary
+def build_lexicon(pos, counts, engwords, vocabs={}):
+    forms = set(pos) | set(counts) | set(engwords)
+    for vocab in vocabs.values():
+        forms.update(vocab)
+    lexicon = pd.DataFrame(index=pd.Index(sorted(forms), name='lowercase'))
+    lexicon['posmask'] = np.array([posmask(pos.get(form, 0)) for form in lexicon.index], dtype=np.uint8)
+    lexicon['coca'] = np.array([counts.get(form, 0) for form in lexicon.index], dtype=np.int64)
+    lexicon['english'] = lexicon.index.isin(engwords)
+    for name, vocab in vocabs.items():
+        lexicon['vocab_' + name] = lexicon.index.isin(list(vocab))
+    return lexicon
+
+# rows of the lexicon (a data frame from build_lexicon or a stored Lexicon) for each of a series of words
+# (forms not in the lexicon get zeros)
+def lookup(lexicon, words):
+    if isinstance(lexicon, pd.DataFrame):
+        rows = lexicon.index.get_indexer(words)
+        columns = {column: lexicon[column].to_numpy() for column in lexicon.columns}
+    else:
+        rows = lexicon.get_indexer(words)
+        columns = lexicon.columns
+    found = rows >= 0
+    result = {}
+    for column, values in columns.items():
+        result[column] = np.where(found, values[rows], np.zeros(1, dtype=values.dtype))
+    return pd.DataFrame(result, index=words.index)
+
+# strip punctuation from tokens (but keep internal hyphens)
+# equivalent to joining the matches of '[a-zA-Z-]+' with spaces and then stripping hyphens at either end
+def strip_punctuation(words):
+    no_punct = words.str.replace('[^a-zA-Z-]+', ' ', regex=True).str.strip(' ')
+    return no_punct.str.lstrip('-').str.rstrip('-')
+
+def check_token(words):
+    return (words.str.len() > 2).to_numpy()
+
+def check_english(entries, words):
+    return entries['english'].to_numpy() & check_token(words)
+
+# check that the words have the right part of speech and are above the frequency threshold
+def checkpos(entries, words, pos, mincounts):
+    return ((entries['posmask'].to_numpy() & posmasks[pos]) != 0) & check_token(words) & (entries['coca'].to_numpy() > mincounts)
+
+# check that the words are in our first phase vocabulary
+def checkvocab(entries, pos):
+    return entries['vocab_' + pos].to_numpy()
+
+def read_pickles(vocabnames=[]):
+    import nltk
+    pos = pickle.load(open("../data/forpreprocessing/wordpos.p", "rb"))
+    counts = pickle.load(open("../data/forpreprocessing/wordposcounts.p", "rb"))
+    engwords = set(nltk.corpus.words.words())
+    vocabs = {name: pickle.load(open("../data/forpreprocessing/" + name + "_vocab.p", "rb")) for name in vocabnames}
+    return pos, counts, engwords, vocabs
+
+# checksum of a column, computed over the forms with nonzero values and those values
+def column_checksum(forms, values):
+    present = np.flatnonzero(values)
+    h = hashlib.sha1(b'\n'.join(forms[present].tolist()))
+    h.update(np.ascontiguousarray(values[present]).astype(np.int64).tobytes())
+    return h.hexdigest()
+
+def combined_checksum(checksums):
+    key = json.dumps({'format': format_version, 'columns': checksums}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class Lexicon:
+
+    # forms is a sorted array of UTF-8 encoded forms and columns maps each column name to a parallel array
+    def __init__(self, forms, columns, info):
+        self.forms = forms
+        self.columns = columns
+        self.info = info
+
+    @property
+    def version(self):
+        return self.info['version']
+
+    # checksum of the COCA and English columns
+    @property
+    def base_version(self):
+        return combined_checksum({column: self.info['checksums'][column] for column in base_columns})
+
+    def checksum(self, column):
+        return self.info['checksums'][column]
+
+    # position of each of a series of words in the lexicon (-1 if absent), by binary search
+    def get_indexer(self, words):
+        if len(self.forms) == 0:
+            return np.full(len(words), -1)
+        encoded = words.str.encode('utf-8')
+        keys = np.array(encoded.tolist(), dtype=self.forms.dtype)
+        positions = np.minimum(np.searchsorted(self.forms, keys), len(self.forms) - 1)
+        # words longer than the longest form are truncated in keys and never match
+        found = (self.forms[positions] == keys) & (encoded.str.len().to_numpy() <= self.forms.dtype.itemsize)
+        return np.where(found, positions, -1)
+
+    def vocab(self, name):
+        values = self.columns['vocab_' + name]
+        return set(form.decode('utf-8') for form in self.forms[np.flatnonzero(values)].tolist())
+
+    def to_frame(self):
+        index = pd.Index([form.decode('utf-8') for form in self.forms.tolist()], name='lowercase')
+        return pd.DataFrame({column: np.asarray(values) for column, values in self.columns.items()}, index=index)
+
+def save_lexicon(lex, path=lexicon_dir, sources={}):
+    os.makedirs(path, exist_ok=True)
+    encoded = np.array([form.encode('utf-8') for form in lex.index], dtype=bytes)
+    # byte order, which is the order used by the binary search
+    order = np.argsort(encoded, kind='stable')
+    forms = encoded[order]
+    arrays = {'forms': forms}
+    checksums = {}
+    for column in lex.columns:
+        arrays[column] = lex[column].to_numpy()[order]
+        checksums[column] = column_checksum(forms, arrays[column])
+    # each file is replaced in one step, so processes that have the old arrays mapped keep reading them
+    for name, values in arrays.items():
+        np.save(path + name + '.tmp.npy', values)
+        os.replace(path + name + '.tmp.npy', path + name + '.npy')
+    info = {'format': format_version, 'version': combined_checksum(checksums), 'forms': len(forms),
+            'checksums': checksums, 'sources': sources, 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    with open(path + 'lexicon.tmp.json', 'w') as f:
+        json.dump(info, f, indent=1, sort_keys=True)
+    os.replace(path + 'lexicon.tmp.json', path + 'lexicon.json')
+    return info
+
+def load_lexicon(path=lexicon_dir):
+    with open(path + 'lexicon.json') as f:
+        info = json.load(f)
+    if info['format'] != format_version:
+        raise ValueError("lexicon in %s has format %d, expected %d" % (path, info['format'], format_version))
+    forms = np.load(path + 'forms.npy', mmap_mode='r')
+    columns = {column: np.load(path + column + '.npy', mmap_mode='r') for column in info['checksums']}
+    return Lexicon(forms, columns, info)
+
+def check_vocabs(lex, names):
+    missing = [name for name in names if 'vocab_' + name not in lex.columns]
+    if missing:
+        raise ValueError("no Phase 1 vocabulary in the lexicon for " + ', '.join(missing) + " (run make_vocab.py)")
+
+# recompute the checksums of a stored lexicon; returns the columns that do not match
+def verify(lex):
+    return [column for column, values in lex.columns.items() if column_checksum(lex.forms, values) != lex.checksum(column)]
+
+# add (or replace) the Phase 1 vocabulary for a POS set in the stored lexicon
+def add_vocab(name, vocab, path=lexicon_dir, source=None):
+    # missing entries (NaN from a CSV) are not forms
+    vocab = set(form for form in vocab if isinstance(form, str))
+    old = load_lexicon(path)
+    frame = old.to_frame()
+    forms = frame.index.union(pd.Index(sorted(vocab), name='lowercase'))
+    frame = frame.reindex(forms)
+    for column in frame.columns:
+        frame[column] = frame[column].fillna(0).astype(old.columns[column].dtype)
+    frame['vocab_' + name] = frame.index.isin(list(vocab))
+    sources = dict(old.info['sources'])
+    if source is not None:
+        sources['vocab_' + name] = source
+    return save_lexicon(frame, path, sources)
+
+# lexicon with the COCA columns from pos and counts, keeping the vocabularies of any lexicon already stored
+def replace_base(pos, counts, engwords, path=lexicon_dir, source=None):
+    vocabs = {}
+    sources = {}
+    if os.path.exists(path + 'lexicon.json'):
+        old = load_lexicon(path)
+        vocabs = {column[len('vocab_'):]: old.vocab(column[len('vocab_'):]) for column in old.columns if column.startswith('vocab_')}
+        sources = dict(old.info['sources'])
+    if source is not None:
+        sources['coca'] = source
+    return save_lexicon(build_lexicon(pos, counts, engwords, vocabs), path, sources)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the lexicon used to filter tokens.")
+    parser.add_argument("command", choices=['build', 'info'], help="build from the COCA and vocabulary pickles, or show the version")
+    parser.add_argument("--vocab", type=str, action='append', default=[], choices=['noun', 'verb', 'adj', 'nounverbadj'], help="Phase 1 vocabulary to include (repeat for several)")
+    parser.add_argument("--path", type=str, default=lexicon_dir, help="folder for the lexicon")
+    parser.add_argument("--verify", action='store_true', help="check the stored checksums (info)")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        pos, counts, engwords, vocabs = read_pickles(args.vocab)
+        save_lexicon(build_lexicon(pos, counts, engwords, vocabs), args.path, {'coca': 'wordpos.p, wordposcounts.p'})
+    start = time.time()
+    lex = load_lexicon(args.path)
+    print("lexicon %s: %d forms, loaded in %.1f ms" % (lex.version, len(lex.forms), (time.time() - start) * 1000))
+    for column in sorted(lex.columns):
+        print("%-20s %s" % (column, lex.checksum(column)))
+    if args.verify:
+        bad = verify(lex)
+        print("checksums do not match for: " + ', '.join(bad) if bad else "all checksums match")
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,116 @@
 import argparse
+import numpy as np
 import pandas as pd
-from collections import defaultdict
 import pickle
+import lexicon
+import metrics
 
 # Make dictionary with Phase one vocabulary and words on whitelist
 
-def make_dict(args):
-    outfile= '../data/forpreprocessing/' + args.pos + '_vocab.p'
+# The Phase 1 files are streamed once, keeping the number of dictionaries in which each form occurs and
+# its summed count in arrays indexed by form. UK variants and whitelist words are then added with joins.
+# These statistics are written to ../data/forpreprocessing/<pos>_vocab_stats.csv, and the vocabulary can be
+# rebuilt from them with thresholds on either statistic without reading the Phase 1 files again:
+# `python make_vocab.py --pos nounverbadj ../data/forpreprocessing/nounverbadj_counts_phase1/*.csv`
+# `python make_vocab.py --pos nounverbadj --from-stats --min-dicts 2`
+# With `--metrics`, the time spent reading the Phase 1 files, computing the statistics and writing the
+# vocabulary is recorded (see metrics.py).
+
+uk_us_file = '../rawdata/downloaded/uk_us_spelling.csv'
+whitelistfile = '../data/forpreprocessing/whitelist_pos.csv'
+
+def vocab_file(pos):
+    return '../data/forpreprocessing/' + pos + '_vocab.p'
+
+def stats_file(pos):
+    return '../data/forpreprocessing/' + pos + '_vocab_stats.csv'
 
-    uk_us_file= '../rawdata/downloaded/uk_us_spelling.csv'
-    uk_us= pd.read_csv(uk_us_file)
-    whitelistfile= '../data/forpreprocessing/whitelist_pos.csv'
-    whitelist = pd.read_csv(whitelistfile)  
-    if args.pos == 'noun':
+# number of dictionaries and summed count for each form in the Phase 1 files
+def phase1_stats(files):
+    codes = {}
+    ndicts = np.zeros(1 << 16, dtype=np.int32)
+    counts = np.zeros(1 << 16, dtype=np.int64)
+    for file_path in files:
+        with metrics.stage('read'):
+            d = pd.read_csv(file_path, na_filter=False, dtype={'lowercase': str})
+        metrics.count('rows_in', d.shape[0])
+        with metrics.stage('stats'):
+            d_codes = np.array([codes.setdefault(word, len(codes)) for word in d['lowercase']], dtype=np.int64)
+            if len(codes) > len(ndicts):
+                size = max(len(codes), 2 * len(ndicts))
+                ndicts = np.concatenate([ndicts, np.zeros(size - len(ndicts), dtype=ndicts.dtype)])
+                counts = np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+            np.add.at(ndicts, np.unique(d_codes), 1)
+            np.add.at(counts, d_codes, d['count'].to_numpy(dtype=np.int64))
+    return pd.DataFrame({'ndicts': ndicts[:len(codes)], 'count': counts[:len(codes)]},
+                        index=pd.Index(list(codes), name='lowercase'))
+
+def read_whitelist(pos):
+    whitelist = pd.read_csv(whitelistfile)
+    if pos == 'noun':
         whitelist = whitelist[whitelist['pos'] != 'nounverbadj']  # include cases with "missing" pos
-    vocab = set()
+    return whitelist['lowercase'].dropna()
+
+# vocabulary statistics: Phase 1 statistics for all forms, whether each form is on the whitelist,
+# and whether it is only included as the UK variant of another form
+def vocab_stats(stats, pos):
+    uk_us = pd.read_csv(uk_us_file).dropna(subset=['UK', 'US'])
+    whitelist = read_whitelist(pos)
+    forms = stats.index.union(pd.Index(whitelist.unique(), name='lowercase'), sort=False)
+    # UK variants of the Phase 1 forms and the whitelist
+    ukforms = pd.Index(uk_us.loc[uk_us['US'].isin(forms), 'UK'].unique(), name='lowercase')
+    stats = stats.reindex(forms.union(ukforms, sort=False), fill_value=0)
+    stats['whitelist'] = stats.index.isin(whitelist)
+    stats['uk_variant'] = stats.index.isin(ukforms)
+    return stats
 
-    for file_path in args.files:
-        d = pd.read_csv(file_path, na_filter=False)
-        d_words = d['lowercase']
-        vocab.update(d_words)
+# vocabulary from the statistics: forms above the thresholds, the whitelist, and UK variants of both
+# (with thresholds of zero this is every Phase 1 form, the whitelist and their UK variants)
+def select_vocab(stats, min_dicts=0, min_count=0):
+    uk_us = pd.read_csv(uk_us_file).dropna(subset=['UK', 'US'])
+    keep = stats['whitelist'] | ((stats['ndicts'] > 0) & (stats['ndicts'] >= min_dicts) & (stats['count'] >= min_count))
+    vocab = set(stats.index[keep])
+    vocab.update(uk_us.loc[uk_us['US'].isin(vocab), 'UK'])
+    return vocab
 
-    vocab.update(whitelist['lowercase'])
+def make_dict(args):
+    if args.from_stats:
+        stats = pd.read_csv(stats_file(args.pos), na_filter=False, dtype={'lowercase': str}).set_index('lowercase')
+    else:
+        stats = phase1_stats(args.files)
+        with metrics.stage('stats'):
+            stats = vocab_stats(stats, args.pos)
+        with metrics.stage('write'):
+            stats.to_csv(stats_file(args.pos))
+        print("%d Phase 1 files, %d forms" % (len(args.files), (stats['ndicts'] > 0).sum()))
 
-    ukvocab = set()
-    for word in vocab:
-        sub_uk_us = uk_us[uk_us['US'] == word]
-        ukvocab.update(sub_uk_us['UK'])
+    with metrics.stage('stats'):
+        vocab = select_vocab(stats, args.min_dicts, args.min_count)
+    vocab_dict = {word:1 for word in vocab}
+    metrics.count('rows', len(vocab))
 
-    vocab.update(ukvocab)
-    vocab_dict = {word:1 for word in vocab}    
+    with metrics.stage('write'):
+        pickle.dump( vocab_dict, open(vocab_file(args.pos), "wb") )
 
-    pickle.dump( vocab_dict, open(outfile, "wb") )
+        # add the vocabulary to the lexicon used in Phase 2
+        source = 'min_dicts %d, min_count %d' % (args.min_dicts, args.min_count)
+        info = lexicon.add_vocab(args.pos, vocab, source=source)
+    print("%d forms in vocabulary, lexicon version %s (vocab_%s %s)" % (len(vocab), info['version'], args.pos, info['checksums']['vocab_' + args.pos]))
 
 def main():
-    parser = argparse.ArgumentParser(description="Read Hathi Trust file.")
+    parser = argparse.ArgumentParser(description="Make the Phase 1 vocabulary.")
     parser.add_argument("--pos", type=str, choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj")
-    parser.add_argument("files", nargs='+', help="Input feature files")
+    parser.add_argument("--from-stats", action='store_true', help="use the statistics written by a previous run instead of the Phase 1 files")
+    parser.add_argument("--min-dicts", type=int, default=0, help="keep Phase 1 forms found in at least this many dictionaries")
+    parser.add_argument("--min-count", type=int, default=0, help="keep Phase 1 forms with at least this summed count")
+    metrics.add_arguments(parser)
+    parser.add_argument("files", nargs='*', help="Input feature files")
     args = parser.parse_args()
-    make_dict(args)
+    if not args.from_stats and not args.files:
+        parser.error("give the Phase 1 files or --from-stats")
+    metrics.setup_args(args, 'make_vocab')
+    with metrics.item(args.pos, inputs=len(args.files)):
+        make_dict(args)
 
 if __name__ == "__main__":
     main()
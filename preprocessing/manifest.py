@@ -0,0 +1,102 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Manifest of processed inputs for read_ht_file.py, read_nonht_file.py and run_counts.py.
+# Each (input file, POS set, phase) is recorded with a signature computed from the size and
+# modification time of the input (or its content hash) and the settings used (nperd, mincounts and
+# the checksums of the lexicon and the Phase 1 vocabulary, see lexicon.py). An input is processed again only if its signature has changed,
+# its output file is missing, or the previous attempt failed.
+
+# To list the state of the manifest and the tracebacks of failed inputs:
+# `python manifest.py`
+
+manifestfile = '../data/forpreprocessing/manifest.sqlite'
+
+# statuses that mean that the input does not need to be processed again
+finished = ('done', 'small', 'nopos')
+
+def open_manifest(path=manifestfile):
+    conn = sqlite3.connect(path, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS inputs (
+                        input TEXT, pos TEXT, phase INTEGER, signature TEXT, size INTEGER, mtime REAL,
+                        settings TEXT, status TEXT, error TEXT, updated REAL,
+                        PRIMARY KEY (input, pos, phase))''')
+    return conn
+
+def file_hash(path, blocksize=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def file_stats(file_path):
+    if not os.path.exists(file_path):
+        return 0, 0.0
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+def signature(file_path, settings, use_hash=False):
+    size, mtime = file_stats(file_path)
+    if use_hash and os.path.exists(file_path):
+        content = file_hash(file_path)
+    else:
+        content = [size, mtime]
+    key = json.dumps({'input': content, 'settings': settings}, sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def is_current(conn, file_path, posname, phase, sig, outfile):
+    row = conn.execute('SELECT signature, status FROM inputs WHERE input = ? AND pos = ? AND phase = ?',
+                       (os.path.abspath(file_path), posname, phase)).fetchone()
+    if row is None or row[0] != sig or row[1] not in finished:
+        return False
+    return row[1] != 'done' or os.path.exists(outfile)
+
+# signatures for the POS sets for which file_path needs to be (re)processed
+# outfiles and settings map each POS set to its output file and its settings
+def pending(conn, file_path, phase, outfiles, settings, force=False, use_hash=False):
+    sigs = {}
+    for posname, outfile in outfiles.items():
+        sig = signature(file_path, settings[posname], use_hash)
+        if force or not is_current(conn, file_path, posname, phase, sig, outfile):
+            sigs[posname] = sig
+    return sigs
+
+# statuses maps each POS set to the result of processing (done, small, nopos, missing or error)
+def record(conn, file_path, phase, sigs, settings, statuses, error=None):
+    size, mtime = file_stats(file_path)
+    now = time.time()
+    with conn:
+        for posname, sig in sigs.items():
+            conn.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (os.path.abspath(file_path), posname, phase, sig, size, mtime,
+                          json.dumps(settings[posname], sort_keys=True), statuses[posname], error, now))
+
+def failures(conn):
+    return conn.execute("SELECT input, pos, phase, error FROM inputs WHERE status = 'error' ORDER BY input").fetchall()
+
+def print_summary(conn, show_errors=True):
+    for posname, phase, status, n in conn.execute('SELECT pos, phase, status, COUNT(*) FROM inputs GROUP BY pos, phase, status ORDER BY pos, phase, status'):
+        print("%s\tphase %d\t%s\t%d" % (posname, phase, status, n))
+    failed = failures(conn)
+    if failed:
+        print("Failed inputs:")
+    for file_path, posname, phase, error in failed:
+        print("---- %s (%s, phase %d)" % (file_path, posname, phase))
+        if show_errors and error:
+            print(error)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the manifest of processed dictionaries.")
+    parser.add_argument("--manifest", type=str, default=manifestfile, help="path to the manifest")
+    parser.add_argument("--brief", action='store_true', help="list failed inputs without tracebacks")
+    args = parser.parse_args()
+    print_summary(open_manifest(args.manifest), show_errors=not args.brief)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import argparse
+import cProfile
+import functools
+import glob
+import json
+import os
+import resource
+import signal
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+# Timings and counts for each input processed by the preprocessing scripts.
+# With `--metrics`, read_ht_file.py, read_nonht_file.py, run_counts.py, make_vocab.py and collate_dics.py
+# write one JSON line per input to ../data/forpreprocessing/metrics/<run>-<pid>.jsonl (one file per process,
+# so the workers of run_counts.py do not share a file), with the time spent in each stage, e.g.
+#   decompress  reading and decompressing an Extracted Features volume
+#   tokenlist   building its token list
+#   merge       stripping punctuation and merging forms
+#   filter      lexicon lookups (English words, POS and vocabulary)
+#   write       writing the output CSV files
+# the numbers of tokens in and rows out, the status and the peak memory of the process so far.
+# With `--profile cprofile`, the stages (or those given with `--profile-stage`) are profiled with cProfile and
+# the statistics are written to <run>-<pid>.prof (read with pstats or snakeviz). With `--profile sample`,
+# the stack is sampled every few milliseconds of CPU time during the stages and the counts of the stacks
+# are written to <run>-<pid>.folded, in the collapsed format of py-spy's `--format raw` (one line per stack,
+# prefixed with the stage), which flamegraph.pl and speedscope read.
+
+# Examples (run from the preprocessing folder):
+# `python run_counts.py --source hathi --phase 1 --pos nounverbadj --metrics ../rawdata/downloaded/hathi_raw/`
+# `python metrics.py report`
+# `python metrics.py report --run 20240101-120000 --top 50 --jobs 64`
+
+metricsdir = '../data/forpreprocessing/metrics/'
+
+# seconds of CPU time between samples
+sample_interval = 0.005
+
+enabled = False
+config = {}
+
+# the input being processed and the state of this process (reset in forked workers)
+_record = None
+_process = {'pid': None}
+
+def add_arguments(parser):
+    parser.add_argument("--metrics", action='store_true', help="write timings and counts for each input to " + metricsdir)
+    parser.add_argument("--profile", choices=['cprofile', 'sample'], help="profile the stages with cProfile or by sampling stacks (implies --metrics)")
+    parser.add_argument("--profile-stage", action='append', help="profile only this stage (repeat for several)")
+
+def setup_args(args, script):
+    if args.metrics or args.profile:
+        setup(script, profile=args.profile, profile_stages=args.profile_stage)
+
+def setup(script, path=metricsdir, profile=None, profile_stages=None, run=None):
+    global enabled, config
+    os.makedirs(path, exist_ok=True)
+    config = {'script': script, 'path': path, 'run': run or time.strftime('%Y%m%d-%H%M%S'),
+              'profile': profile, 'profile_stages': set(profile_stages or [])}
+    enabled = True
+
+def _prefix():
+    return config['path'] + config['run'] + '-%d' % os.getpid()
+
+def _sample(signum, frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        # f_lineno can be None while a frame is being set up
+        stack.append('%s (%s:%s)' % (code.co_name, code.co_filename, frame.f_lineno))
+        frame = frame.f_back
+    _process['samples'][';'.join([_process['stage']] + stack[::-1])] += 1
+
+# output file and profiler of this process
+def _state():
+    if _process['pid'] != os.getpid():
+        _process.clear()
+        _process['pid'] = os.getpid()
+        _process['out'] = open(_prefix() + '.jsonl', 'a', encoding='utf-8')
+        _process['stage'] = None
+        if config['profile'] == 'cprofile':
+            _process['profiler'] = cProfile.Profile()
+        elif config['profile'] == 'sample':
+            _process['samples'] = Counter()
+            signal.signal(signal.SIGPROF, _sample)
+    return _process
+
+def _profiled(name):
+    return config['profile'] is not None and (not config['profile_stages'] or name in config['profile_stages'])
+
+def begin(input, **fields):
+    global _record
+    _state()
+    _record = {'run': config['run'], 'script': config['script'], 'input': input, 'pid': os.getpid(),
+               'start': round(time.time(), 3), 'bytes': os.path.getsize(input) if os.path.isfile(input) else None,
+               'stages': {}, 'counts': {}}
+    _record.update(fields)
+    _record['_t0'] = time.perf_counter()
+
+# add fields (e.g. the status) to the record of the current input
+def note(**fields):
+    if _record is not None:
+        _record.update(fields)
+
+def count(name, n):
+    if _record is not None:
+        _record['counts'][name] = _record['counts'].get(name, 0) + int(n)
+
+def end(**fields):
+    global _record
+    if _record is None:
+        return
+    record = _record
+    _record = None
+    record.update(fields)
+    record['seconds'] = round(time.perf_counter() - record.pop('_t0'), 4)
+    record['stages'] = {name: round(seconds, 4) for name, seconds in record['stages'].items()}
+    # kB on Linux
+    record['maxrss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    state = _state()
+    state['out'].write(json.dumps(record) + '\n')
+    state['out'].flush()
+    # workers of a pool may exit without running atexit handlers, so the profiles are written after each input
+    if config['profile'] == 'cprofile':
+        state['profiler'].dump_stats(_prefix() + '.prof')
+    elif config['profile'] == 'sample':
+        with open(_prefix() + '.folded', 'w', encoding='utf-8') as f:
+            for stack, n in state['samples'].most_common():
+                f.write('%s %d\n' % (stack, n))
+
+# time spent in a stage of the current input (the times of several calls are added)
+@contextmanager
+def stage(name):
+    if _record is None:
+        yield
+        return
+    state = _state()
+    profiled = _profiled(name) and state['stage'] is None
+    if profiled:
+        state['stage'] = name
+        if config['profile'] == 'cprofile':
+            state['profiler'].enable()
+        else:
+            signal.setitimer(signal.ITIMER_PROF, sample_interval, sample_interval)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiled:
+            if config['profile'] == 'cprofile':
+                state['profiler'].disable()
+            else:
+                signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            state['stage'] = None
+        _record['stages'][name] = _record['stages'].get(name, 0.0) + elapsed
+
+# the items of an iterable, with the time taken to produce them counted in a stage
+def timed(iterable, name):
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# one record for a block of work
+@contextmanager
+def item(input, **fields):
+    if not enabled:
+        yield
+        return
+    begin(input, **fields)
+    try:
+        yield
+        note(status=_record.get('status', 'done'))
+    except BaseException:
+        note(status='error')
+        raise
+    finally:
+        end()
+
+# one record for each call of func(file_path, ...), whose result (the status for each POS set) is recorded
+def per_input(func):
+    @functools.wraps(func)
+    def wrapper(file_path, *args, **kwargs):
+        with item(file_path):
+            statuses = func(file_path, *args, **kwargs)
+            note(status=statuses)
+        return statuses
+    return wrapper
+
+def read_metrics(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+def status_name(status):
+    if isinstance(status, dict):
+        return ','.join(sorted(set(status.values())))
+    return str(status)
+
+# summary of the records of one script: throughput, distribution of times, stages and slowest inputs
+def report(records, top=20, jobs=None):
+    by_script = defaultdict(list)
+    for record in records:
+        by_script[record['script']].append(record)
+    for script, rows in sorted(by_script.items()):
+        seconds = np.array([row['seconds'] for row in rows])
+        total = seconds.sum()
+        tokens = sum(row['counts'].get('tokens', 0) for row in rows)
+        nbytes = sum(row['bytes'] or 0 for row in rows)
+        statuses = Counter(status_name(row.get('status')) for row in rows)
+        print("== %s: %d inputs in %.1f s of processing (%d processes, %d runs)" %
+              (script, len(rows), total, len(set((row['run'], row['pid']) for row in rows)), len(set(row['run'] for row in rows))))
+        print("per process: %.2f inputs/s, %.1f MB/s, %.0f tokens/s; peak memory %.0f MB" %
+              (len(rows) / total if total else 0, nbytes / 1e6 / total if total else 0, tokens / total if total else 0,
+               max(row.get('maxrss_mb', 0) for row in rows)))
+        print("seconds per input: median %.2f, 90%% %.2f, 99%% %.2f, max %.2f" % tuple(np.percentile(seconds, [50, 90, 99, 100])))
+        print("statuses: " + ', '.join('%s %d' % item for item in sorted(statuses.items())))
+        if jobs:
+            # the longest input bounds the time however many workers there are
+            print("estimated wall time with %d workers: %.1f min" % (jobs, max(total / jobs, seconds.max()) / 60))
+
+        stage_totals = Counter()
+        for row in rows:
+            stage_totals.update(row['stages'])
+        stage_totals['(other)'] = max(total - sum(stage_totals.values()), 0)
+        print("%-12s %10s %7s %12s" % ('stage', 'seconds', 'share', 'ms/input'))
+        for name, value in stage_totals.most_common():
+            print("%-12s %10.1f %6.1f%% %12.1f" % (name, value, 100 * value / total if total else 0, 1000 * value / len(rows)))
+
+        print("slowest inputs:")
+        print("%10s %12s %10s  %-14s %s" % ('seconds', 'tokens', 'MB', 'slowest stage', 'input'))
+        for row in sorted(rows, key=lambda row: row['seconds'], reverse=True)[:top]:
+            slowest = max(row['stages'].items(), key=lambda item: item[1], default=('', 0))
+            print("%10.2f %12d %10.1f  %-14s %s" % (row['seconds'], row['counts'].get('tokens', 0), (row['bytes'] or 0) / 1e6,
+                                                  '%s %.0f%%' % (slowest[0], 100 * slowest[1] / row['seconds']) if row['seconds'] else '',
+                                                  os.path.basename(row['input'].rstrip('/'))))
+        print()
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the metrics written with --metrics.")
+    parser.add_argument("command", choices=['report'], help="summarize the metrics")
+    parser.add_argument("files", nargs='*', help="metrics files (default: all files in " + metricsdir + ")")
+    parser.add_argument("--run", type=str, action='append', help="only this run (repeat for several)")
+    parser.add_argument("--script", type=str, help="only this script")
+    parser.add_argument("--top", type=int, default=20, help="number of slowest inputs listed")
+    parser.add_argument("--jobs", type=int, help="estimate the wall time with this many workers")
+    args = parser.parse_args()
+
+    records = read_metrics(args.files or sorted(glob.glob(metricsdir + '*.jsonl')))
+    if args.run:
+        records = [record for record in records if record['run'] in args.run]
+    if args.script:
+        records = [record for record in records if record['script'] == args.script]
+    if not records:
+        print("no metrics found")
+        return
+    report(records, args.top, args.jobs)
+
+if __name__ == "__main__":
+    main()
@@ -1,165 +1,240 @@
 import argparse
 import os
-import re
 from htrc_features import *
-import pickle
+import traceback
+import numpy as np
 import pandas as pd
-import nltk
+import lexicon
+import manifest
+import metrics
 
 
 # Read raw dictionary data files
 # Requires the htrc-feature-reader library: see https://github.com/htrc/htrc-feature-reader
 
-# To run this on the full set of dictionaries, use parallel as follows:
+# To run this on the full set of dictionaries, use run_counts.py (which loads the lexicons once and
+# shares them across worker processes), or parallel as follows:
 # `find ../data/rawdata/*.json.bz2| parallel --eta --jobs 90% -n 50 python read_ht_file.py --phase 1 --pos "noun"`
 
+# Several POS sets can be processed in a single pass over the volumes, e.g. `--pos noun --pos nounverbadj`.
+# With `--cache`, the merged token counts for each volume are stored in ../data/forpreprocessing/token_cache/
+# and reused by later runs (including phase 2), which then do not need to decompress the raw volumes.
+# Each cache file records the size and modification time of the raw volume and the version of the lexicon
+# (its English words give all_english_count_data), and is rebuilt when either has changed.
+# Processed volumes are recorded in a manifest (see manifest.py) and are skipped on later runs unless
+# the volume, the settings or the Phase 1 vocabulary have changed (use `--force` to process them anyway).
+# With `--metrics`, the time spent in each stage and the numbers of tokens and rows are recorded for
+# each volume (see metrics.py).
+
 # number of forms to keep for each dictionary
 nperd = 1500
 
 # drop all forms with COCA frequencies smaller than this value
 mincounts = 400
 
-# load part of speech tags and frequencies based on COCA (Corpus of Contemporary English)
-
-pos = pickle.load(open("../data/forpreprocessing/wordpos.p", "rb"))
-counts = pickle.load(open("../data/forpreprocessing/wordposcounts.p", "rb"))
-
-engwordlist = set(nltk.corpus.words.words())
-engworddict = dict.fromkeys(engwordlist, 1)
-
-pattern = re.compile('[a-zA-Z-]+')
-
-# strip punctuation from tokens (but keep internal hyphens)
-def strip_punctuation(string):
-    no_punct = ' '.join(pattern.findall(string))
-    return(no_punct.lstrip('-').rstrip('-'))
-
-# check that the word in string has the right part of speech and is above the frequency threshold
-def checkpos(string):
-    return pos[string] != 0 and len(string) > 2 and bool(re.match(restring, pos[string])) and counts[string] > mincounts
-
-def check_english(string):
-    return(string in engworddict) and len(string) > 2 
-        
-def check_token(string):
-    return len(string) > 2
+# per-volume merged token counts are cached here so that later passes need not decompress the raw volumes
+cachedir = '../data/forpreprocessing/token_cache/'
+
+def volume_name(file_path):
+    fname = os.path.basename(file_path.rstrip('/'))
+    return os.path.splitext(fname.rsplit('.', 1)[0])[0]
+
+def cache_path(file_path):
+    return cachedir + volume_name(file_path) + '.npz'
+
+# store forms as one newline-separated byte string alongside a parallel array of counts
+def save_cache(cachefile, file_path, df_m, ntypes, token_count, english_count):
+    words = '\n'.join(df_m['lowercase']).encode('utf-8')
+    size, mtime = manifest.file_stats(file_path)
+    np.savez_compressed(cachefile, words=np.frombuffer(words, dtype=np.uint8),
+                        counts=df_m['count'].to_numpy(dtype=np.int64),
+                        totals=np.array([ntypes, token_count, english_count], dtype=np.int64),
+                        size=np.int64(size), mtime=np.float64(mtime), lexicon=np.array(lex.base_version))
+
+# a cache file can be used if it was made with the current lexicon from the raw volume as it is now
+# (if the raw volume is no longer there, only the lexicon is checked)
+def is_current_cache(cachefile, file_path):
+    if not os.path.exists(cachefile):
+        return False
+    with np.load(cachefile) as cache:
+        if 'lexicon' not in cache or str(cache['lexicon']) != lex.base_version:
+            return False
+        if not os.path.exists(file_path):
+            return True
+        return (int(cache['size']), float(cache['mtime'])) == manifest.file_stats(file_path)
+
+def load_cache(cachefile):
+    with np.load(cachefile) as cache:
+        counts = cache['counts']
+        words = cache['words'].tobytes().decode('utf-8').split('\n') if len(counts) else []
+        ntypes, token_count, english_count = (int(x) for x in cache['totals'])
+    df_m = pd.DataFrame({'lowercase': words, 'count': counts})
+    return df_m, ntypes, token_count, english_count
+
+# parse a volume and return its forms (punctuation stripped and merged) along with token counts
+def parse_volume(file_path):
+    with metrics.stage('decompress'):
+        vol = Volume(file_path)
+    # print("%s - %s" % (vol.id, vol.title))
+    # pages = False: combine all pages into one tokenlist
+    # case = False: ignore lower/upper case
+    # pos = False: don't include part of speech tags
+    # section = "body": only include body of each page, not header/footer
+
+    # df = vol.tokenlist(section="all", pages=True, case=False, pos=False)
+    # df.to_csv("test.csv")
+
+    with metrics.stage('tokenlist'):
+        df = vol.tokenlist(section="body", pages=False, case=False, pos=False)
+        # drop the 'body' in multiindex
+        df = df.xs('body', level='section').reset_index()
+
+        df = df.sort_values('count', ascending=False)
+    metrics.count('tokens', df['count'].sum())
+    metrics.count('types', df.shape[0])
+
+    with metrics.stage('filter'):
+        entries = lexicon.lookup(lex, df['lowercase'])
+        english_df = df.loc[lexicon.check_english(entries, df['lowercase'])] 
+        token_df = df.loc[lexicon.check_token(df['lowercase'])] 
+
+    # strip punctuation and merge forms that become identical
+    with metrics.stage('merge'):
+        df['lowercase_nopunct'] = lexicon.strip_punctuation(df['lowercase'])
+        df_m = df.groupby('lowercase_nopunct')['count'].agg('sum').reset_index()
+        df_m = df_m.sort_values('count', ascending=False)
+        df_m = df_m.rename(columns={'lowercase_nopunct': 'lowercase'})
+
+    return df_m, df.shape[0], sum(token_df['count']), sum(english_df['count'])
+
+# read merged counts for a volume from the cache if possible, otherwise from the raw file
+def read_counts(file_path, use_cache):
+    cachefile = cache_path(file_path)
+    if use_cache and is_current_cache(cachefile, file_path):
+        with metrics.stage('cache'):
+            return load_cache(cachefile)
+    counts = parse_volume(file_path)
+    if use_cache:
+        with metrics.stage('cache'):
+            save_cache(cachefile, file_path, *counts)
+    return counts
+
+def write_counts(df_m, token_count, english_count, posname, phase, outfile):
+    with metrics.stage('filter'):
+        entries = lexicon.lookup(lex, df_m['lowercase'])
+        if phase == 1:
+            pos_df = df_m.loc[lexicon.checkpos(entries, df_m['lowercase'], posname, mincounts)] 
+        else:
+            pos_df = df_m.loc[lexicon.checkvocab(entries, posname)] 
+
+    if pos_df.shape[0] == 0:
+        all_count = 0
+    else:
+        all_count = sum(pos_df['count'])
 
-# check that the word is in our first phase vocabulary
-def checkvocab(string):
-    return (string in phase1_vocab) 
+    if all_count == 0:
+        return False
 
-def read_files(args):
-    global restring
-    global phase1_vocab
-    # if the restrings here change then add_pos_to_whitelist.py may also need to change
-    if args.pos == 'noun':
-        restring = '^n'
-    elif args.pos == 'verb':
-        restring = '^v'
-    elif args.pos == 'adj':
-        restring = '^j'
-    elif args.pos == 'adv':
-        restring = '^r'
-    elif args.pos == 'nounverb':
-        restring = '^n|^v'
-    elif args.pos == 'nounverbadj':
-        restring = '^n|^v|^j'
-    elif args.pos == 'all':
-        restring = '^'
+    nrow = pos_df.shape[0]
+    # number of rows to keep
+    if phase == 1:
+        ntop = min(nperd, nrow)
     else:
-        print('unknown type')
-
-    if args.phase == 1: # keep top NPERD terms 
-        phase1 = True
-        outpref = '../data/forpreprocessing/' + args.pos + '_counts_phase1/'
-        outsuff = '_top_' + str(nperd) + '_' + args.pos + '_freqs_phase1.csv'
-    elif args.phase == 2: # keep all terms compiled in the first phase  
-        phase1 = False
-        outpref = '../data/forpreprocessing/' + args.pos + '_counts_phase2/'
-        outsuff = '_top_' + str(nperd) + '_' + args.pos + '_freqs_phase2.csv'
-        phase1_vocab  = pickle.load(open("../data/forpreprocessing/" + args.pos + "_vocab.p", "rb"))
-    else:
-        print("Invalid value for 'phase' argument. Use 1 to assemble vocab or 2 to create final files.")
-        return
-
-    if not os.path.exists(outpref):
-        os.makedirs(outpref)
+        ntop = nrow
+    top_df = pos_df.iloc[0:ntop]
+    top_df = top_df.copy()
+
+    newindex = top_df.index.max() + 1
+    top_df.loc[newindex] = {'lowercase':'all_token_count_data', 'count':token_count}
+    top_df.loc[newindex + 1] = {'lowercase':'all_english_count_data', 'count':english_count}
+    top_df.loc[newindex + 2] = {'lowercase':'all_pos_count_data', 'count':all_count}
+
+    with metrics.stage('write'):
+        top_df.to_csv(outfile, index = False)
+    metrics.count('rows', top_df.shape[0])
+    return True
+
+def output_dir(posname, phase):
+    return '../data/forpreprocessing/' + posname + '_counts_phase' + str(phase) + '/'
+
+def output_file(file_path, posname, phase):
+    outsuff = '_top_' + str(nperd) + '_' + posname + '_freqs_phase' + str(phase) + '.csv'
+    return output_dir(posname, phase) + volume_name(file_path) + outsuff
+
+# load the lexicon used for filtering: POS tags and frequencies based on COCA (Corpus of Contemporary English),
+# the nltk list of English words and (phase 2 only) the Phase 1 vocabularies (see lexicon.py)
+# run this once per process before calling process_file
+def setup(posnames, phase, use_cache):
+    global lex, settings
+    lex = lexicon.load_lexicon()
+    settings = {}
+
+    for posname in posnames:
+        # the checksums record which version of the lexicon produced the counts
+        settings[posname] = {'nperd': nperd, 'mincounts': mincounts, 'lexicon': lex.base_version, 'vocab': ''}
+        if phase == 2: # keep all terms compiled in the first phase  
+            lexicon.check_vocabs(lex, [posname])
+            settings[posname]['vocab'] = lex.checksum('vocab_' + posname)
+
+    for posname in posnames:
+        outpref = output_dir(posname, phase)
+        if not os.path.exists(outpref):
+            os.makedirs(outpref)
+    if use_cache and not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+def output_files(file_path, posnames, phase):
+    return {posname: output_file(file_path, posname, phase) for posname in posnames}
+
+# each volume is parsed once and the output for every POS set is written from the same counts
+# returns the status for each POS set
+@metrics.per_input
+def process_file(file_path, posnames, phase, use_cache):
+    outfiles = output_files(file_path, posnames, phase)
+    if not(os.path.exists(file_path)) and not(use_cache and is_current_cache(cache_path(file_path), file_path)):
+        print("**MISSING FILE: " + file_path)
+        return {posname: 'missing' for posname in posnames}
+
+    df_m, ntypes, token_count, english_count = read_counts(file_path, use_cache)
+
+    if ntypes < 1000:
+        return {posname: 'small' for posname in posnames} # dictionary too small
+
+    statuses = {}
+    for posname, outfile in outfiles.items():
+        if write_counts(df_m, token_count, english_count, posname, phase, outfile):
+            statuses[posname] = 'done'
+        else:
+            print("**  no tokens with correct POS (" + posname + ") for " + file_path)
+            statuses[posname] = 'nopos'
+    return statuses
+
+# volumes already processed with the same input and settings are skipped unless force is set
+def read_files(args):
+    setup(args.pos, args.phase, args.cache)
+    metrics.setup_args(args, 'read_ht_file')
+    conn = manifest.open_manifest()
 
     for file_path in args.files:
-        fname = os.path.basename(file_path.rstrip('/'))
-        fname = os.path.splitext(fname.rsplit('.', 1)[0])[0]
-
-        outfile = outpref + fname + outsuff
-        #if os.path.exists(outfile):
-        #    continue # skip files that have already been processed
-        if not(os.path.exists(file_path)):
-            print("**MISSING FILE: " + file_path)
-            continue 
+        sigs = manifest.pending(conn, file_path, args.phase, output_files(file_path, args.pos, args.phase), settings, args.force)
+        if not sigs:
+            continue # skip files that have already been processed
+        error = None
         try:
-            vol = Volume(file_path)
-            # print("%s - %s" % (vol.id, vol.title))
-            # pages = False: combine all pages into one tokenlist
-            # case = False: ignore lower/upper case
-            # pos = False: don't include part of speech tags
-            # section = "body": only include body of each page, not header/footer
-
-            # df = vol.tokenlist(section="all", pages=True, case=False, pos=False)
-            # df.to_csv("test.csv")
-
-            df = vol.tokenlist(section="body", pages=False, case=False, pos=False)
-            # drop the 'body' in multiindex
-            df = df.xs('body', level='section').reset_index()
-
-            if df.shape[0] < 1000:
-                continue # dictionary too small
-
-            df = df.sort_values('count', ascending=False)
-
-            english_df = df.loc[df['lowercase'].apply(check_english)] 
-            token_df = df.loc[df['lowercase'].apply(check_token)] 
-
-            # strip punctuation and merge forms that become identical
-            df['lowercase_nopunct'] = df['lowercase'].apply(strip_punctuation)
-            df_m = df.groupby('lowercase_nopunct')['count'].agg('sum').reset_index()
-            df_m = df_m.sort_values('count', ascending=False)
-            df_m = df_m.rename(columns={'lowercase_nopunct': 'lowercase'})
-
-            if phase1:
-                pos_df = df_m.loc[df_m['lowercase'].apply(checkpos)] 
-            else:
-                pos_df = df_m.loc[df_m['lowercase'].apply(checkvocab)] 
-
-            if pos_df.shape[0] == 0:
-                all_count = 0
-            else:
-                all_count = sum(pos_df['count'])
-
-            if all_count == 0:
-                print("**  no tokens with correct POS for " + file_path)
-                continue 
-
-            nrow = pos_df.shape[0]
-            # number of rows to keep
-            if phase1:
-                ntop = min(nperd, nrow)
-            else:
-                ntop = nrow
-            top_df = pos_df.iloc[0:ntop]
-            top_df = top_df.copy()
-
-            newindex = top_df.index.max() + 1
-            top_df.loc[newindex] = {'lowercase':'all_token_count_data', 'count':sum(token_df['count'])}
-            top_df.loc[newindex + 1] = {'lowercase':'all_english_count_data', 'count':sum(english_df['count'])}
-            top_df.loc[newindex + 2] = {'lowercase':'all_pos_count_data', 'count':all_count}
-
-            top_df.to_csv(outfile, index = False)
-        except:
-            print("---- error processing " + file_path )
+            statuses = process_file(file_path, list(sigs), args.phase, args.cache)
+        except Exception as e:
+            print("---- error processing " + file_path + ": " + repr(e))
+            error = traceback.format_exc()
+            statuses = {posname: 'error' for posname in sigs}
+        manifest.record(conn, file_path, args.phase, sigs, settings, statuses, error)
 
 def main():
     parser = argparse.ArgumentParser(description="Read Hathi Trust file.")
     parser.add_argument("--phase", type=int, choices=[1, 2], required=True, help="1 to assemble vocab, 2 to make final counts")
-    parser.add_argument("--pos", type=str, choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj")
+    parser.add_argument("--pos", type=str, action='append', choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj (repeat to process several in one pass)")
+    parser.add_argument("--cache", action='store_true', help="read and write cached token counts for each volume")
+    parser.add_argument("--force", action='store_true', help="process volumes even if the manifest shows they are up to date")
+    metrics.add_arguments(parser)
     parser.add_argument("files", nargs='+', help="Input feature files")
     args = parser.parse_args()
     read_files(args)
@@ -1,127 +1,238 @@
 import os
-from collections import Counter
-from pdfminer.high_level import extract_text
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+import numpy as np
 import pandas as pd
-import pickle    
-import re
 import argparse
-import nltk
-from nltk.tokenize import word_tokenize
+import traceback
 from docx import Document
+import lexicon
+import manifest
+import metrics
+from tokenizer import TokenCounter
+
+# The text of a PDF is extracted one page at a time (by `--jobs` worker processes for ranges of pages), and
+# the pages are tokenized as they arrive with tokenizer.TokenCounter, whose counts are those of nltk's
+# word_tokenize for the whole text. DOCX paragraphs and the Description column of Dictionaria CSV files
+# are each tokenized on their own, as before.
+# With `--cache`, the text of the pages of each PDF (or the paragraphs of each DOCX) is stored in
+# ../data/forpreprocessing/text_cache/ under the hash of the file, so later runs (e.g. for another POS set)
+# do not parse the file again.
+# With `--metrics`, the time spent in each stage and the numbers of tokens and rows are recorded for
+# each file (see metrics.py).
+
+# Examples (run from the preprocessing folder):
+# `python read_nonht_file.py --pos nounverbadj --cache ../rawdata/downloaded/nonhathi_raw/*.pdf`
+# `python read_nonht_file.py --pos noun --cache --jobs 8 ../rawdata/downloaded/nonhathi_raw/large.pdf`
 
 # drop all forms with COCA frequencies smaller than this value
 mincounts = 400
 
-# load part of speech tags and frequencies based on COCA (Corpus of Contemporary English)
-pos = pickle.load(open("../data/forpreprocessing/wordpos.p", "rb"))
-
-counts = pickle.load(open("../data/forpreprocessing/wordposcounts.p", "rb"))
-
-engwordlist = set(nltk.corpus.words.words())
-engworddict = dict.fromkeys(engwordlist, 1)
+def output_dir(posname):
+    return '../data/forpreprocessing/' + posname + '_counts_phase2_nonhathi/'
+
+def output_file(file_path, posname):
+    fname = os.path.basename(file_path.rstrip('/'))
+    fname = fname.rsplit('.', 1)[0]
+    outsuff = '_top_1500_' + posname + '_freqs_phase2.csv'
+    return output_dir(posname) + fname + outsuff
+
+# load the lexicon used for filtering: POS tags and frequencies based on COCA (Corpus of Contemporary English)
+# and the Phase 1 vocabularies (see lexicon.py)
+# run this once per process before calling process_file
+def setup(posnames, use_cache=False):
+    global lex, settings
+    lex = lexicon.load_lexicon()
+    lexicon.check_vocabs(lex, posnames)
+    settings = {}
+    for posname in posnames:
+        settings[posname] = {'mincounts': mincounts, 'lexicon': lex.base_version, 'vocab': lex.checksum('vocab_' + posname)}
+
+    for posname in posnames:
+        outpref = output_dir(posname)
+        if not os.path.exists(outpref):
+            os.makedirs(outpref)
+    if use_cache and not os.path.exists(textcachedir):
+        os.makedirs(textcachedir)
+
+# extracted text of each PDF or DOCX, keyed by the hash of the file
+textcachedir = '../data/forpreprocessing/text_cache/'
+
+# pages extracted at a time by each worker
+pagechunk = 20
+
+def text_cache_path(file_path):
+    return textcachedir + manifest.file_hash(file_path) + '.npz'
+
+# store the parts (pages or paragraphs) as one byte string with the offset at which each part ends
+def save_text_cache(cachefile, parts):
+    encoded = [part.encode('utf-8') for part in parts]
+    tmpfile = cachefile[:-len('.npz')] + '.tmp.npz'
+    np.savez_compressed(tmpfile, text=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                        ends=np.cumsum([len(part) for part in encoded], dtype=np.int64))
+    os.replace(tmpfile, cachefile)
+
+def load_text_cache(cachefile):
+    with np.load(cachefile) as cache:
+        text = cache['text'].tobytes()
+        ends = cache['ends']
+    starts = np.concatenate([[0], ends[:-1]])
+    return [text[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+
+def count_pages(file_path):
+    with open(file_path, 'rb') as fp:
+        return sum(1 for _ in PDFPage.get_pages(fp))
+
+# text of the pages start to stop - 1 as pdfminer's extract_text gives it, each page ending with a form feed
+def extract_pages(args):
+    file_path, start, stop = args
+    pages = []
+    with open(file_path, 'rb') as fp, StringIO() as output:
+        rsrcmgr = PDFResourceManager(caching=True)
+        device = TextConverter(rsrcmgr, output, codec='utf-8', laparams=LAParams())
+        interpreter = PDFPageInterpreter(rsrcmgr, device)
+        for page in PDFPage.get_pages(fp, range(start, stop), caching=True):
+            interpreter.process_page(page)
+            pages.append(output.getvalue())
+            output.seek(0)
+            output.truncate()
+    return pages
+
+# text of the pages of a PDF in order, extracted by jobs worker processes
+def pdf_pages(file_path, jobs=1):
+    if jobs <= 1:
+        yield from extract_pages((file_path, 0, count_pages(file_path)))
+        return
+    npages = count_pages(file_path)
+    ranges = [(file_path, start, min(start + pagechunk, npages)) for start in range(0, npages, pagechunk)]
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        for pages in executor.map(extract_pages, ranges):
+            yield from pages
+
+def docx_paragraphs(file_path):
+    return [para.text for para in Document(file_path).paragraphs]
+
+# token counts of a file, as for word_tokenize applied to the whole text of a PDF, to each DOCX paragraph
+# and to each Description of a Dictionaria CSV file
+def count_tokens(file_path, use_cache=False, jobs=1):
+    counter = TokenCounter()
+    if file_path.endswith(".csv"):
+        with metrics.stage('extract'):
+            origdf = pd.read_csv(file_path)
+        with metrics.stage('tokenize'):
+            for description in origdf['Description']:
+                counter.add_text(description)
+            return counter.counts()
+
+    cachefile = text_cache_path(file_path) if use_cache else None
+    if cachefile is not None and os.path.exists(cachefile):
+        with metrics.stage('cache'):
+            parts = load_text_cache(cachefile)
+    elif file_path.endswith(".pdf"):
+        parts = pdf_pages(file_path, jobs)
+    elif file_path.endswith(".docx"):
+        parts = docx_paragraphs(file_path)
+    else:
+        raise ValueError("unknown file type: " + file_path)
 
-# check that the word is in our first phase vocabulary
-def checkvocab(string):
-    return (string in phase1_vocab) 
+    texts = []
+    for part in metrics.timed(parts, 'extract'):
+        texts.append(part)
+        # the pages of a PDF are one text, sentences can continue on the next page
+        with metrics.stage('tokenize'):
+            if file_path.endswith(".pdf"):
+                counter.add_part(part)
+            else:
+                counter.add_text(part)
+    if cachefile is not None and not os.path.exists(cachefile):
+        with metrics.stage('cache'):
+            save_text_cache(cachefile, texts)
+    with metrics.stage('tokenize'):
+        return counter.counts()
+
+def output_files(file_path, posnames):
+    return {posname: output_file(file_path, posname) for posname in posnames}
+
+# the file is tokenized once and the output for every POS set is written from the same counts
+# returns the status for each POS set
+@metrics.per_input
+def process_file(file_path, posnames, use_cache=False, jobs=1):
+    outfiles = output_files(file_path, posnames)
+
+    # count each distinct token once and then filter the distinct tokens
+    token_freq = count_tokens(file_path, use_cache, jobs)
+    tokens = pd.Series(list(token_freq.keys()), dtype=object)
+    freqs = np.fromiter(token_freq.values(), dtype=np.int64, count=len(token_freq))
+    metrics.count('tokens', freqs.sum())
+    metrics.count('types', len(freqs))
+
+    with metrics.stage('merge'):
+        unigrams = lexicon.strip_punctuation(tokens.str.lower())
+    with metrics.stage('filter'):
+        entries = lexicon.lookup(lex, unigrams)
+        all_tkns = freqs[lexicon.check_token(tokens)].sum()
+        english_tkns = freqs[lexicon.check_english(entries, unigrams)].sum()
+
+    # Calculate unigram frequencies
+    with metrics.stage('merge'):
+        unigram_freq = pd.DataFrame({'lowercase': unigrams, 'count': freqs})
+        unigram_freq = unigram_freq.groupby('lowercase', sort=False)['count'].agg('sum').to_frame()
+    with metrics.stage('filter'):
+        unigram_entries = lexicon.lookup(lex, unigram_freq.index.to_series())
+
+    for posname, outfile in outfiles.items():
+        with metrics.stage('filter'):
+            all_pos = freqs[lexicon.checkpos(entries, unigrams, posname, mincounts)].sum()
 
-def check_english(string):
-    return(string in engworddict) and len(string) > 2 
-        
-def check_token(string):
-    return len(string) > 2
+            # Filter out unigrams that are not in the phase 1 vocabulary
+            df = unigram_freq[lexicon.checkvocab(unigram_entries, posname)]
 
-# check that the word in string has the right part of speech and is above the frequency threshold
-def checkpos(string):
-    return pos[string] != 0 and len(string) > 2 and bool(re.match(restring, pos[string])) and counts[string] > mincounts
+        df = df.sort_values('count', ascending=False).reset_index()
 
-pattern = re.compile('[a-zA-Z-]+')
+        newindex = df.index.max() + 1
+        df.loc[newindex] = {'lowercase':'all_token_count_data', 'count':all_tkns}
+        df.loc[newindex + 1] = {'lowercase':'all_english_count_data', 'count':english_tkns}
+        df.loc[newindex + 2] = {'lowercase':'all_pos_count_data', 'count':all_pos}
 
-# strip punctuation from tokens (but keep internal hyphens)
-def strip_punctuation(string):
-    no_punct = ' '.join(pattern.findall(string))
-    return(no_punct.lstrip('-').rstrip('-'))
+        # Create a CSV file for the unigram frequencies
+        with metrics.stage('write'):
+            df.to_csv(outfile, index = False)
+        metrics.count('rows', df.shape[0])
+    return {posname: 'done' for posname in outfiles}
 
+# files already processed with the same input and settings are skipped unless force is set
 def read_files(args):
-    global phase1_vocab
-    phase1_vocab  = pickle.load(open("../data/forpreprocessing/" + args.pos + "_vocab.p", "rb"))
-
-    global restring
-    if args.pos == 'noun':
-        restring = '^n'
-    elif args.pos == 'verb':
-        restring = '^v'
-    elif args.pos == 'adj':
-        restring = '^j'
-    elif args.pos == 'adv':
-        restring = '^r'
-    elif args.pos == 'nounverb':
-        restring = '^n|^v'
-    elif args.pos == 'nounverbadj':
-        restring = '^n|^v|^j'
-    elif args.pos == 'all':
-        restring = '^'
-    else:
-        print('unknown type')
-
-    outpref = '../data/forpreprocessing/' + args.pos + '_counts_phase2_nonhathi/'
-
-    if not os.path.exists(outpref):
-        os.makedirs(outpref)
+    setup(args.pos, args.cache)
+    metrics.setup_args(args, 'read_nonht_file')
+    conn = manifest.open_manifest()
 
     for file_path in args.files:
-        fname = os.path.basename(file_path.rstrip('/'))
-        fname = fname.rsplit('.', 1)[0]
-        outsuff = '_top_1500_' + args.pos + '_freqs_phase2.csv'
-
-        outfile = outpref + fname + outsuff
-        if os.path.exists(outfile):
-            return # skip files that have already been processed
+        sigs = manifest.pending(conn, file_path, 2, output_files(file_path, args.pos), settings, args.force)
+        if not sigs:
+            continue # skip files that have already been processed
+        error = None
         try:
-            if file_path.endswith(".pdf"):
-                # Extract text from the PDF
-                pdf_text = extract_text(file_path)
-                tokens = word_tokenize(pdf_text)
-            elif file_path.endswith(".csv"):
-                origdf = pd.read_csv(file_path)
-                defns = origdf['Description'].apply(word_tokenize)
-                tokens = [token for sublist in defns for token in sublist]
-            elif file_path.endswith(".docx"):
-                doc = Document(file_path)
-                tokens = []
-                for para in doc.paragraphs:
-                    para_tokens = word_tokenize(para.text)
-                    tokens.extend(para_tokens)
-
-            all_tkns =  [token for token in tokens if check_token(token)]
-            unigrams = [strip_punctuation(token.lower()) for token in tokens]
-            english_tkns =  [token for token in unigrams if check_english(token)]
-            all_pos =  [token for token in unigrams if checkpos(token)]
-            
-            # Calculate unigram frequencies
-            unigram_freq = Counter(unigrams)
-
-            df = pd.DataFrame.from_dict(unigram_freq, orient='index', columns=['count'])
-            df.index.name = 'lowercase' 
-
-            # Filter out unigrams that are not in the phase 1 vocabulary
-            df = df[list(map(checkvocab, df.index))]
-
-            df = df.sort_values('count', ascending=False).reset_index()
-
-            newindex = df.index.max() + 1
-            df.loc[newindex] = {'lowercase':'all_token_count_data', 'count':len(all_tkns)}
-            df.loc[newindex + 1] = {'lowercase':'all_english_count_data', 'count':len(english_tkns)}
-            df.loc[newindex + 2] = {'lowercase':'all_pos_count_data', 'count':len(all_pos)}
-
-            # Create a CSV file for the unigram frequencies
-            df.to_csv(outfile, index = False)
-        except:
-            print("---- error processing " + file_path)
+            statuses = process_file(file_path, list(sigs), args.cache, args.jobs)
+        except Exception as e:
+            print("---- error processing " + file_path + ": " + repr(e))
+            error = traceback.format_exc()
+            statuses = {posname: 'error' for posname in sigs}
+        manifest.record(conn, file_path, 2, sigs, settings, statuses, error)
 
 
 def main():
     parser = argparse.ArgumentParser(description="Read Non Hathi Trust file.")
-    parser.add_argument("--pos", type=str, choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj")
+    parser.add_argument("--pos", type=str, action='append', choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj (repeat to process several in one pass)")
+    parser.add_argument("--force", action='store_true', help="process files even if the manifest shows they are up to date")
+    parser.add_argument("--cache", action='store_true', help="read and write the cached text of each pdf and docx file")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes extracting the pages of a pdf")
+    metrics.add_arguments(parser)
     parser.add_argument("files", nargs='+', help="Input pdfs")
     args = parser.parse_args()
     read_files(args)
@@ -1,5 +1,7 @@
 from collections import defaultdict 
 import pickle
+import nltk
+import lexicon
 
 # w1cs_c.txt contains  
 # "Single words occurring three times or more in the
@@ -30,5 +32,9 @@ for line in cocaf:
 pickle.dump( pos, open("../data/forpreprocessing/wordpos.p", "wb") )
 pickle.dump( counts, open("../data/forpreprocessing/wordposcounts.p", "wb") )
 
+# also store the COCA columns of the lexicon used by read_ht_file.py and read_nonht_file.py
+# (any Phase 1 vocabularies already in the lexicon are kept)
+lexicon.replace_base(pos, counts, set(nltk.corpus.words.words()), source='w1cs_c.txt')
+
 
 
@@ -0,0 +1,153 @@
+import argparse
+import gc
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import manifest
+import metrics
+
+# Compile counts for many dictionaries using a pool of worker processes.
+# The COCA lexicon, the nltk word list and the Phase 1 vocabularies are loaded once in the parent
+# process and shared copy-on-write with the workers (this relies on the "fork" start method).
+# Volumes are scheduled largest first so that a few very large dictionaries do not finish last.
+# Inputs recorded as up to date in the manifest (see manifest.py) are skipped unless `--force` is given.
+# With `--metrics`, each worker records the time spent in each stage of each input (see metrics.py).
+
+# Examples (run from the preprocessing folder):
+# `python run_counts.py --source hathi --phase 1 --pos nounverbadj --pos noun --cache ../rawdata/downloaded/hathi_raw/`
+# `python run_counts.py --source hathi --phase 2 --pos nounverbadj --pos noun --cache ../rawdata/downloaded/hathi_raw/`
+# `python run_counts.py --source nonhathi --pos nounverbadj --pos noun --cache ../rawdata/downloaded/nonhathi_raw/`
+
+suffixes = {'hathi': ('.json.bz2',), 'nonhathi': ('.pdf', '.csv', '.docx')}
+
+# seconds between progress reports
+report_interval = 30
+
+# expand directories and glob patterns into a list of input files
+def find_files(paths, source):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in os.listdir(path) if f.endswith(suffixes[source]))
+        elif glob.has_magic(path):
+            files.extend(glob.glob(path))
+        else:
+            files.append(path)
+    return files
+
+def file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+# module is read_ht_file or read_nonht_file, and has already been set up in the parent process
+def run_one(file_path, posnames):
+    try:
+        statuses = module.process_file(file_path, posnames, *module_args)
+        return file_path, statuses, None
+    except Exception:
+        return file_path, {posname: 'error' for posname in posnames}, traceback.format_exc()
+
+def format_time(seconds):
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+def report(ndone, nfiles, bytes_done, bytes_total, nfailed, start):
+    elapsed = max(time.time() - start, 1e-9)
+    byte_rate = bytes_done / elapsed
+    eta = (bytes_total - bytes_done) / byte_rate if byte_rate > 0 else 0
+    print('%d/%d volumes  %.2f vol/s  %.1f MB/s  elapsed %s  ETA %s  failures %d' %
+          (ndone, nfiles, ndone / elapsed, byte_rate / 1e6, format_time(elapsed), format_time(eta), nfailed), flush=True)
+
+def run(args):
+    global module, module_args
+    if args.source == 'hathi':
+        import read_ht_file as module
+        module.setup(args.pos, args.phase, args.cache)
+        module_args = (args.phase, args.cache)
+        phase = args.phase
+        output_files = lambda file_path: module.output_files(file_path, args.pos, args.phase)
+    else:
+        import read_nonht_file as module
+        module.setup(args.pos, args.cache)
+        module_args = (args.cache, args.page_jobs)
+        phase = 2
+        output_files = lambda file_path: module.output_files(file_path, args.pos)
+
+    metrics.setup_args(args, 'read_ht_file' if args.source == 'hathi' else 'read_nonht_file')
+
+    # only inputs that are new or have changed since the last run are processed
+    conn = manifest.open_manifest()
+    files = find_files(args.files, args.source)
+    sigs = {}
+    for file_path in files:
+        sigs[file_path] = manifest.pending(conn, file_path, phase, output_files(file_path), module.settings, args.force, args.hash)
+    nskipped = sum(1 for file_path in files if not sigs[file_path])
+    files = [file_path for file_path in files if sigs[file_path]]
+    if nskipped:
+        print('%d volumes already processed' % nskipped)
+
+    sizes = {file_path: file_size(file_path) for file_path in files}
+    files.sort(key=lambda file_path: sizes[file_path], reverse=True)
+    bytes_total = sum(sizes.values())
+    print('%d volumes (%.1f MB) with %d workers' % (len(files), bytes_total / 1e6, args.jobs), flush=True)
+
+    # keep the shared lexicons out of the garbage collector so that workers do not touch (and copy) their pages
+    gc.freeze()
+
+    statuses = {}
+    failures = []
+    bytes_done = 0
+    start = last_report = time.time()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=args.jobs, mp_context=context) as executor:
+        futures = [executor.submit(run_one, file_path, list(sigs[file_path])) for file_path in files]
+        for ndone, future in enumerate(as_completed(futures), 1):
+            file_path, file_statuses, error = future.result()
+            manifest.record(conn, file_path, phase, sigs[file_path], module.settings, file_statuses, error)
+            for status in file_statuses.values():
+                statuses[status] = statuses.get(status, 0) + 1
+            bytes_done += sizes[file_path]
+            if error is not None:
+                failures.append((file_path, error))
+                print("---- error processing " + file_path, flush=True)
+            if time.time() - last_report > report_interval or ndone == len(files):
+                report(ndone, len(files), bytes_done, bytes_total, len(failures), start)
+                last_report = time.time()
+
+    print(', '.join('%s: %d' % item for item in sorted(statuses.items())))
+    if failures:
+        print('Failed volumes:')
+        for file_path, error in failures:
+            print(file_path)
+            print(error)
+        print('Run `python manifest.py` to list all failures recorded so far')
+    return len(failures) == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile dictionary counts in parallel.")
+    parser.add_argument("--source", type=str, choices=['hathi', 'nonhathi'], required=True, help="hathi for Extracted Features volumes, nonhathi for pdf, csv and docx files")
+    parser.add_argument("--phase", type=int, choices=[1, 2], help="1 to assemble vocab, 2 to make final counts (required for hathi)")
+    parser.add_argument("--pos", type=str, action='append', choices=['noun', 'verb', 'adj', 'nounverbadj'], required=True, help="POS tag: noun, verb, adj, or nounverbadj (repeat to process several in one pass)")
+    parser.add_argument("--cache", action='store_true', help="read and write cached token counts for each volume (hathi) or cached text for each pdf and docx file (nonhathi)")
+    parser.add_argument("--force", action='store_true', help="process inputs even if the manifest shows they are up to date")
+    parser.add_argument("--hash", action='store_true', help="detect changed inputs by content hash rather than size and modification time")
+    parser.add_argument("--jobs", type=int, default=max(1, int(0.9 * os.cpu_count())), help="number of worker processes")
+    parser.add_argument("--page-jobs", type=int, default=1, help="worker processes extracting the pages of each pdf (nonhathi)")
+    metrics.add_arguments(parser)
+    parser.add_argument("files", nargs='+', help="Input files, directories or glob patterns")
+    args = parser.parse_args()
+    if args.source == 'hathi' and args.phase is None:
+        parser.error("--phase is required for Hathi volumes")
+    if args.source == 'nonhathi' and args.phase == 1:
+        parser.error("non-Hathi dictionaries are only processed in phase 2")
+    if not run(args):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import random
+from collections import Counter
+from nltk.tokenize import NLTKWordTokenizer
+from nltk.tokenize.punkt import PunktSentenceTokenizer
+from tokenizer import TokenCounter
+
+# Counts of tokenizer.py against those of word_tokenize (the Treebank tokenizer applied to each sentence found by
+# Punkt) on dictionary-like text. An untrained Punkt tokenizer is used on both sides so that the nltk data is not
+# needed.
+
+# `python -m pytest test_tokenizer.py` (run from the preprocessing folder)
+
+punkt = PunktSentenceTokenizer()
+treebank = NLTKWordTokenizer()
+
+pieces = ['water', 'house', 'adj.', 'v.', 'n.', 'cf.', 'Fr.', 'word.', 'home.', 'Then', 'left.', 'e.g.', 'etc.', 'U.S.',
+          'a', '.', ',', ':', ';', '...', '-', '--', '—', '[', ']', '(', ')', '{', '}', '<', '>', '"', "'", '``', "''",
+          '»', '”', '’', '),', '.)', '".', "'s", "can't", 'cannot', '1.5', '$', '&', '?', '!', '*']
+separators = [' ', ' ', ' ', '  ', '\n', '\t', ' \n ']
+
+def word_tokenize_counts(text):
+    return Counter(token for sentence in punkt.tokenize(text) for token in treebank.tokenize(sentence))
+
+def token_counts(text, parts=1):
+    counter = TokenCounter.__new__(TokenCounter)
+    counter.punkt, counter.chunks, counter.rest = punkt, Counter(), ''
+    if parts == 1:
+        counter.add_text(text)
+    else:
+        size = len(text) // parts + 1
+        for start in range(0, len(text), size):
+            counter.add_part(text[start:start + size])
+    return counter.counts()
+
+def dictionary_lines(n, seed=0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        text = ''.join(rng.choice(pieces) + rng.choice(separators) for _ in range(rng.randint(1, 14)))
+        yield text.rstrip() if rng.random() < 0.5 else text
+
+def test_closing_brackets_and_quotes():
+    for text in ['water house adj. ] v.', 'word. ) next', 'He went home. ) Then left.', "cf. ' Fr. '"]:
+        assert token_counts(text) == word_tokenize_counts(text), text
+
+def test_dictionary_lines():
+    for text in dictionary_lines(20000):
+        assert token_counts(text) == word_tokenize_counts(text), text
+
+def test_random_strings():
+    rng = random.Random(1)
+    for _ in range(5000):
+        text = ''.join(rng.choice('ab.]) "\'’,:-\n') for _ in range(rng.randint(1, 20)))
+        assert token_counts(text) == word_tokenize_counts(text), text
+
+def test_parts():
+    text = '\n'.join(dictionary_lines(2000, seed=2))
+    assert token_counts(text, parts=7) == word_tokenize_counts(text)
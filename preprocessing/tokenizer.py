@@ -0,0 +1,107 @@
+import functools
+import re
+from collections import Counter
+import nltk
+from nltk.tokenize import NLTKWordTokenizer
+
+# Token counts equal to the counts of the tokens returned by nltk's word_tokenize, without building the token list.
+# word_tokenize splits a text into sentences (Punkt) and then applies the Treebank rules to each sentence.
+# The Treebank rules never join text across whitespace, and they only look at the whitespace character just
+# before and just after a whitespace-separated chunk (or at the start and end of the sentence), except that a
+# final period is split from its word when only closing brackets and quotes follow it in the sentence. So the
+# chunks of a sentence are counted together with this context (the chunks from the last one that is not made
+# of closing brackets and quotes to the end of the sentence as a single chunk), and the rules are applied once
+# to each distinct chunk and context instead of to every sentence. test_tokenizer.py compares the counts with
+# those of the Treebank tokenizer on dictionary-like text. Dictionaries repeat the same chunks many times, so this is much
+# faster than word_tokenize.
+# Long texts such as the pages of a PDF can be added one part at a time: the sentence that is incomplete at
+# the end of a part is held back and tokenized with the next part, so the counts are those for the whole text.
+
+# distinct chunks whose tokens are kept in memory
+cachesize = 1 << 20
+
+_treebank = NLTKWordTokenizer()
+
+# chunks that the Treebank rules leave as they are: word characters and single hyphens, except for the
+# words that are split as contractions (e.g. cannot, gonna), which are searched for in the chunk followed
+# by a space as the Treebank tokenizer pads the text
+_plain = re.compile(r'(?:\w|-(?!-))+')
+_contraction = re.compile('|'.join(regexp.pattern.replace('(?i)', '') for regexp in
+                                   NLTKWordTokenizer.CONTRACTIONS2 + NLTKWordTokenizer.CONTRACTIONS3), re.IGNORECASE)
+
+# the Punkt tokenizer used by word_tokenize
+@functools.lru_cache(maxsize=None)
+def sentence_tokenizer(language='english'):
+    try:
+        from nltk.tokenize import _get_punkt_tokenizer
+    except ImportError:
+        # nltk < 3.9
+        return nltk.data.load('tokenizers/punkt/%s.pickle' % language)
+    return _get_punkt_tokenizer(language)
+
+# chunks of a sentence with their context: (whitespace before, chunk, trailing whitespace, whitespace after)
+# where the whitespace before is '' at the start of the sentence, and the whitespace after is '' at the end of
+# the sentence, where the trailing whitespace is any whitespace up to the end
+_chunk = re.compile(r'(\s?)(\S+)(?=(\s*$)|(\s))')
+
+# chunks made only of closing brackets and quotes: a period is split from the word before it when only such
+# chunks follow it in the sentence, so these chunks are tokenized together with the chunk before them
+_closing = re.compile(r'[\]\)}>"\'»”’]+')
+
+# tokens of a chunk as word_tokenize returns them within a sentence: the chunk is tokenized with its
+# context and a neighbouring word on each side on which the sentence continues
+@functools.lru_cache(maxsize=cachesize)
+def chunk_tokens(before, chunk, trailing, after):
+    if _plain.fullmatch(chunk) and not _contraction.search(chunk + ' '):
+        return (chunk,)
+    text = ('a' + before if before else '') + chunk + (after + 'a' if after else trailing)
+    tokens = _treebank.tokenize(text)
+    return tuple(tokens[(1 if before else 0):(len(tokens) - 1 if after else len(tokens))])
+
+class TokenCounter:
+
+    def __init__(self, language='english'):
+        self.punkt = sentence_tokenizer(language)
+        # chunks with their context (see chunk_tokens), in order of first occurrence
+        self.chunks = Counter()
+        self.rest = ''
+
+    def add_sentence(self, sentence):
+        chunks = list(_chunk.finditer(sentence))
+        last = len(chunks) - 1
+        while last >= 0 and _closing.fullmatch(chunks[last].group(2)):
+            last -= 1
+        if last == len(chunks) - 1:
+            self.chunks.update(match.groups() for match in chunks)
+            return
+        # the end of the sentence from the last chunk that is not a closing bracket or quote
+        first = max(last, 0)
+        self.chunks.update(match.groups() for match in chunks[:first])
+        end = chunks[-1]
+        self.chunks[(chunks[first].group(1), sentence[chunks[first].start(2):end.end(2)], end.group(3), '')] += 1
+
+    # a text tokenized on its own, as by word_tokenize(text)
+    def add_text(self, text):
+        for start, stop in self.punkt.span_tokenize(text):
+            self.add_sentence(text[start:stop])
+
+    # the next part of a long text: the last sentence is completed by the following parts or by finish()
+    def add_part(self, text):
+        text = self.rest + text
+        spans = list(self.punkt.span_tokenize(text))
+        for start, stop in spans[:-1]:
+            self.add_sentence(text[start:stop])
+        self.rest = text[spans[-1][0]:] if spans else ''
+
+    def finish(self):
+        rest, self.rest = self.rest, ''
+        self.add_text(rest)
+
+    # token counts, in order of first occurrence of the tokens
+    def counts(self):
+        self.finish()
+        counts = Counter()
+        for chunk, n in self.chunks.items():
+            for token in chunk_tokens(*chunk):
+                counts[token] += n
+        return counts
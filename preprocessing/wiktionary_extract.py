@@ -0,0 +1,282 @@
+import argparse
+import bz2
+import html
+import multiprocessing
+import os
+import re
+import pandas as pd
+from tqdm import tqdm
+import cognet_index
+
+# Identify forms in other languages that coincide with English words in the BILA data (e.g. Afrikaans *die*)
+# and whether they share the meaning of the English word, using a Wiktionary dump and CogNet (through the
+# index written by `python cognet_index.py build`).
+# The result is ../data/forpreprocessing/wiktionary_forms.tsv, which is used by wiktionary_filter.R.
+
+# The multistream dump is a series of independently compressed bz2 streams of about 100 pages each, and
+# the index that comes with it gives the offset of the stream holding each page title. Only the streams with
+# a page for a focus word (or for a suffix "-word") are decompressed, by a pool of worker processes, and the
+# lines of each stream are parsed as the original notebook parsed the whole file. The results of the
+# streams are combined in file order and written once at the end. An uncompressed dump (.xml) can also be
+# given, in which case it is split into chunks of whole pages and every chunk is parsed.
+
+# Examples (run from the preprocessing folder):
+# `python wiktionary_extract.py ../rawdata/downloaded/enwiktionary-20240320-pages-articles-multistream.xml.bz2`
+# `python wiktionary_extract.py ../rawdata/downloaded/enwiktionary-20240320-pages-articles-multistream.xml --jobs 8`
+
+focus_file = '../data/biladataset/bila_long_nounverbadj_unfiltered_full.csv'
+langs_file = '../rawdata/downloaded/wiktionary_langs.tsv'
+output_file = '../data/forpreprocessing/wiktionary_forms.tsv'
+
+# size of the chunks of an uncompressed dump parsed by each worker
+chunksize = 64 << 20
+
+heads = ['plural of|', 'inflection of|', 'infl of|', 'pl of|', 'verb form of|']
+
+# set by setup() in the parent process and shared with the workers (this relies on the "fork" start method)
+focus_list = set()
+lan_maps = {}
+cognates_with_lan = set()
+cognates = set()
+
+def setup(focus_path=focus_file, langs_path=langs_file, cognates_path=cognet_index.indexfile):
+    global focus_list, lan_maps, cognates_with_lan, cognates
+    # words of interest
+    focus_list = set(pd.read_csv(focus_path, usecols=['word'], dtype=str, keep_default_na=False)['word'])
+    # Wiktionary language names and their ISO codes
+    lan_maps = {}
+    with open(langs_path, 'r', encoding='utf-8') as f_in:
+        for line in f_in:
+            elements = line.strip().split('\t')
+            lan_maps[elements[1]] = elements[0]
+    # cognates of the words of interest: (word, language, form) and (word, form)
+    rows = cognet_index.CognateIndex(cognates_path).cognates(focus_list)
+    cognates_with_lan = set(zip(rows['english'], rows['lang'], rows['form']))
+    cognates = set(zip(rows['english'], rows['form']))
+
+# helper functions
+def preprocessingLine(line):
+    line = line.strip()
+    return line
+
+def extractTitle(line):
+    return line[7:line.index('</title>')]
+
+def extract_meanings(description_line):
+    matches = re.findall(r'{{l\|en\|(.*?)}}', description_line, re.DOTALL)
+    if len(matches) == 0:
+        matches = re.findall(r'#English\|(.*?)\]\]', description_line)
+    if len(matches) == 0:
+        matches = re.findall(r'\[\[(.*?)\]\]', description_line)
+    return [match.split('|')[0] for match in matches]
+
+# e.g. "# {{gl-verb form of|danzar}}" -> ['danzar']
+def extract_forms1(description_line):
+    matches = re.findall(r'-verb form of\|(.*?)}}', description_line, re.DOTALL)
+    return [match.split('|')[0] for match in matches]
+
+# e.g. "# {{plural of|it|clientela}}" with head "plural of|" -> ['clientela']
+def extract_forms2(description_line, head):
+    matches = re.findall(r''+head+r'\|(.*?)}}', description_line, re.DOTALL)
+    return [match.split('|')[1] if '|' in match else match for match in matches]
+
+def identifyLine(line):
+    if '<title>' in line:
+        return 1
+    # Language name
+    if len(line) > 4 and line.startswith('==') and line[3]!='=' and line.endswith('==') and line[-3]!='=':
+        return 2
+    # gloss line for word
+    if line.startswith('# '):
+        return 3
+    # others
+    return 0
+
+# Parse the lines of a run of whole pages. Returns
+#   answers: (word, language, meaning, provenance) for each language section of a focus word
+#   suffixes: (word, language) for each non-English language section of the page for "-word"
+#   provenance: the last provenance set after the last answer
+# Provenance is None where it was not set since the previous answer: the notebook kept the provenance
+# of the previous section (or page) in that case, so it is filled in by combine_results.
+def parse_lines(lines):
+    answers = []
+    suffixes = []
+    enabled = False
+    suffix_enabled = False
+    word = ''
+    language = 'n.a'
+    meaning = False
+    provenance = None
+    for line in lines:
+        c_line = preprocessingLine(line)
+        cat = identifyLine(c_line)
+        if cat == 1:
+            if language != 'n.a':
+                answers.append((word, language, meaning, provenance))
+                provenance = None
+            word = extractTitle(c_line)
+            enabled = word in focus_list
+            suffix_enabled = word.startswith('-') and word[1:] in focus_list
+            language = 'n.a'
+        elif cat == 2 and suffix_enabled:
+            if c_line[2:len(c_line)-2] != 'English':
+                suffixes.append((word[1:], c_line[2:len(c_line)-2]))
+        if not enabled:
+            continue
+        if cat == 2: # new language line
+            if language != 'n.a':
+                answers.append((word, language, meaning, provenance))
+                provenance = None
+            # extracting language as ==French==
+            language = c_line[2:len(c_line)-2]
+            meaning = False
+            if language == 'English':
+                meaning = True
+                provenance = 'Wiktionary'
+            elif language in lan_maps:
+                search = (word, lan_maps[language], word)
+                if search in cognates_with_lan:
+                    meaning = True
+                    provenance = 'CogNet'
+        elif cat == 3: # new entry line
+            meanings = extract_meanings(c_line)
+            for m in meanings:
+                if word == m or word +' ' in m or ' '+word in m or word +'-' in m or '-'+word in m:
+                    meaning = True
+                    provenance = 'Wiktionary'
+            if len(meanings) == 0:
+                forms = []
+                if '-verb form of|' in c_line:
+                    forms = extract_forms1(c_line)
+                else:
+                    for head in heads:
+                        if head in c_line:
+                            forms = extract_forms2(c_line, head[:-1])
+                            break
+                for form in forms:
+                    search = (word, form.strip())
+                    if search in cognates:
+                        meaning = True
+                        provenance = 'CogNet'
+                        break
+    # the end of a run is the start of the next page
+    if language != 'n.a':
+        answers.append((word, language, meaning, provenance))
+        provenance = None
+    return answers, suffixes, provenance
+
+def split_lines(data):
+    # the notebook read the dump in text mode, which splits lines only at \n, \r and \r\n
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n').split('\n')
+
+def read_range(file_path, start, stop):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(stop - start)
+
+def parse_stream(args):
+    file_path, start, stop = args
+    return parse_lines(split_lines(bz2.decompress(read_range(file_path, start, stop))))
+
+def parse_chunk(args):
+    file_path, start, stop = args
+    return parse_lines(split_lines(read_range(file_path, start, stop)))
+
+def index_file(dump_path):
+    return dump_path[:-len('.xml.bz2')] + '-index.txt.bz2'
+
+# byte ranges of the streams of a multistream dump holding a page for a focus word or a suffix
+def stream_ranges(dump_path, index_path):
+    # titles are escaped in the dump but not in the index
+    wanted = set(html.unescape(word) for word in focus_list)
+    offsets = []
+    selected = set()
+    with bz2.open(index_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            offset, _, title = line.rstrip('\n').split(':', 2)
+            offset = int(offset)
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+            if title in wanted or (title.startswith('-') and title[1:] in wanted):
+                selected.add(offset)
+    offsets.append(os.path.getsize(dump_path))
+    return [(start, stop) for start, stop in zip(offsets[:-1], offsets[1:]) if start in selected]
+
+# byte ranges of an uncompressed dump that start at a <page> line
+def page_ranges(dump_path, size=chunksize):
+    end = os.path.getsize(dump_path)
+    ranges = []
+    with open(dump_path, 'rb') as f:
+        start = 0
+        while start < end:
+            f.seek(min(start + size, end))
+            f.readline()
+            while True:
+                stop = f.tell()
+                line = f.readline()
+                if not line or line.lstrip().startswith(b'<page>'):
+                    break
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+# the rows of wiktionary_forms.tsv from the results of the runs of pages, in file order
+def combine_results(results):
+    answers = []
+    word_lan_set = {}
+    provenance = 'n.a'
+    for _, suffixes, _ in results:
+        for pair in suffixes:
+            word_lan_set[pair] = 0
+    for run_answers, _, run_provenance in results:
+        for word, language, meaning, answer_provenance in run_answers:
+            if answer_provenance is not None:
+                provenance = answer_provenance
+            # forms also found as suffixes, and any repeated (word, language), are treated as different
+            if (word, language) in word_lan_set:
+                meaning = False
+                provenance = 'suffix'
+            word_lan_set[(word, language)] = 1
+            answers.append((word, language, meaning, provenance))
+        if run_provenance is not None:
+            provenance = run_provenance
+    for k, v in word_lan_set.items():
+        if v == 0:
+            answers.append((k[0], k[1], False, 'suffix'))
+    return sorted(answers)
+
+def write_results(answers, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("word\tlanguage_name\tsame_meaning\tprovenance\n")
+        for word, language, meaning, provenance in answers:
+            f.write(word+"\t"+language+"\t"+str(meaning)+"\t"+provenance+"\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract forms that coincide with English words from a Wiktionary dump.")
+    parser.add_argument("dump", help="pages-articles-multistream dump (.xml.bz2, with its index, or uncompressed .xml)")
+    parser.add_argument("--index", type=str, help="multistream index (default: the -index.txt.bz2 file next to the dump)")
+    parser.add_argument("--focus", type=str, default=focus_file, help="BILA counts in long form giving the words of interest")
+    parser.add_argument("--langs", type=str, default=langs_file, help="Wiktionary language names and ISO codes")
+    parser.add_argument("--cognates", type=str, default=cognet_index.indexfile, help="cognate index written by cognet_index.py")
+    parser.add_argument("--output", type=str, default=output_file, help="output file")
+    parser.add_argument("--jobs", type=int, default=max(1, int(0.9 * os.cpu_count())), help="number of worker processes")
+    args = parser.parse_args()
+
+    setup(args.focus, args.langs, args.cognates)
+    if args.dump.endswith('.bz2'):
+        ranges = stream_ranges(args.dump, args.index or index_file(args.dump))
+        worker = parse_stream
+    else:
+        ranges = page_ranges(args.dump)
+        worker = parse_chunk
+    ranges = [(args.dump, start, stop) for start, stop in ranges]
+
+    context = multiprocessing.get_context('fork')
+    with context.Pool(args.jobs) as pool:
+        results = list(tqdm(pool.imap(worker, ranges), total=len(ranges)))
+    answers = combine_results(results)
+    write_results(answers, args.output)
+    print("%d forms from %d runs of pages" % (len(answers), len(ranges)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import collections
+import functools
+import os
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+# Lemmatized BILA noun counts, as produced by wordnet_extract.ipynb and the last part of standardize_bila.R.
+# The nouns of the full version are lemmatized with WordNet (WordNetLemmatizer, pos='n'), and for each lemma the
+# number of senses, the number of synonyms (other lemma names in its noun synsets) and the number of compounds
+# (noun lemma names with more than one part that contain it as a part) are looked up in WordNet.
+# The word -> lemma map and the lemma features are cached in ../../data/forpreprocessing/lemma_cache/, and only
+# words and lemmas that are not in the cache are sent to WordNet, each distinct one once. When there is no cache
+# yet, the word -> lemma map starts from the existing lemma_features.tsv.
+# The counts are then combined as in standardize_bila.R (UK variant spellings take the lemma of the US spelling,
+# and each lemma gets the maximum number of senses of its words), but with a single product of the sparse
+# dictionary x word count matrix and a word x lemma indicator matrix instead of a join over the long table.
+
+# Examples (run from the preprocessing/wordnet folder):
+# `python lemmatize_bila.py` writes ../../data/forpreprocessing/lemma_features.tsv and ../../data/biladataset/bila_long_noun_lemmatized.csv
+# `python lemmatize_bila.py --counts ../../data/biladataset/bila_long_noun_full.csv --output bila_long_noun_full_lemmatized.csv`
+
+bila_dir = '../../data/biladataset/'
+vocabulary_file = bila_dir + 'bila_long_noun_full.csv'
+counts_file = bila_dir + 'bila_long_noun.csv'
+lemmatized_file = bila_dir + 'bila_long_noun_lemmatized.csv'
+features_file = '../../data/forpreprocessing/lemma_features.tsv'
+cache_dir = '../../data/forpreprocessing/lemma_cache/'
+spelling_file = '../../rawdata/downloaded/uk_us_spelling.csv'
+
+feature_columns = ['nsenses', 'nsynonyms', 'ncompounds']
+
+# words recording dictionary totals (all_token_count_data etc) are kept as they are
+def is_data_word(word):
+    return word.endswith('_data')
+
+def read_words(path):
+    return pd.read_csv(path, usecols=['word'], dtype=str, keep_default_na=False)['word'].unique()
+
+def read_table(path, columns):
+    if not os.path.exists(path):
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in columns})
+    return pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False)[columns]
+
+def write_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table.to_csv(path, sep='\t', index=False)
+
+@functools.lru_cache(maxsize=None)
+def wordnet():
+    from nltk.corpus import wordnet as wn
+    return wn
+
+@functools.lru_cache(maxsize=None)
+def synsets(lemma, pos=None):
+    return tuple(wordnet().synsets(lemma, pos=pos))
+
+# number of noun lemma names with more than one part (e.g. snow_fence) that contain each word as a part
+@functools.lru_cache(maxsize=None)
+def compound_counts():
+    counts = collections.Counter()
+    for name in wordnet().all_lemma_names(pos='n'):
+        parts = set(name.lower().replace('-', '_').split('_'))
+        if len(parts) > 1:
+            counts.update(parts)
+    return counts
+
+# lemmas of a list of words, each distinct word lemmatized once
+def lemmatize(words):
+    from nltk.stem import WordNetLemmatizer
+    lemmatizer = WordNetLemmatizer()
+    return [word if is_data_word(word) else lemmatizer.lemmatize(word, pos='n') for word in words]
+
+def lemma_features(lemma):
+    if is_data_word(lemma):
+        return 0, 0, 0
+    synonyms = {name.lower() for synset in synsets(lemma, 'n') for name in synset.lemma_names()}
+    return len(synsets(lemma)), len(synonyms - {lemma}), compound_counts()[lemma]
+
+# word -> lemma map for a list of words, from the cache where possible
+def lemma_map(words, path=cache_dir):
+    cache = path + 'lemma_map.tsv'
+    if os.path.exists(cache):
+        known = read_table(cache, ['word', 'lemma'])
+    else:
+        known = read_table(features_file, ['original_word', 'lemmatized_word']).set_axis(['word', 'lemma'], axis=1)
+    lemmas = dict(zip(known['word'], known['lemma']))
+    new = [word for word in pd.unique(np.asarray(words, dtype=object)) if word not in lemmas]
+    if new or not os.path.exists(cache):
+        lemmas.update(zip(new, lemmatize(new)))
+        write_table(pd.DataFrame({'word': list(lemmas), 'lemma': list(lemmas.values())}), cache)
+    return lemmas, len(new)
+
+# WordNet features (nsenses, nsynonyms, ncompounds) of a list of lemmas, from the cache where possible
+def feature_table(lemmas, path=cache_dir):
+    cache = path + 'lemma_features.tsv'
+    known = read_table(cache, ['lemma'] + feature_columns).set_index('lemma').astype(np.int64)
+    new = [lemma for lemma in pd.unique(np.asarray(lemmas, dtype=object)) if lemma not in known.index]
+    if new:
+        added = pd.DataFrame([lemma_features(lemma) for lemma in new], index=pd.Index(new, name='lemma'), columns=feature_columns)
+        known = pd.concat([known, added]) if len(known) else added
+        write_table(known.reset_index(), cache)
+    return known, len(new)
+
+# lemma of each word, with UK variant spellings given the lemma of the US spelling when the US spelling is
+# one of the counted words (as in standardize_bila.R)
+def combined_lemmas(words, lemmas, counted, spelling_path=spelling_file):
+    combined = {word: lemmas[word] for word in words}
+    spelling = pd.read_csv(spelling_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    spelling = spelling[spelling['US'].isin(set(counted))].drop_duplicates('UK')
+    for uk, us in zip(spelling['UK'], spelling['US']):
+        if uk in combined:
+            combined[uk] = lemmas[us]
+    return combined
+
+# lemma-level counts in the format of bila_long_noun_lemmatized.csv (id, word, nsenses, count)
+# (nsenses gives the number of senses of each lemma)
+def lemmatize_counts(counts, lemmas, nsenses):
+    rows, ids = pd.factorize(counts['id'], sort=True)
+    cols, words = pd.factorize(counts['word'], sort=True)
+    matrix = scipy.sparse.csr_matrix((counts['count'].to_numpy(dtype=np.int64), (rows, cols)), shape=(len(ids), len(words)))
+    word_lemmas = pd.Series([lemmas[word] for word in words])
+    positions, lemma_words = pd.factorize(word_lemmas, sort=True)
+    # word x lemma indicator matrix
+    indicator = scipy.sparse.csr_matrix((np.ones(len(words), dtype=np.int64), (np.arange(len(words)), positions)),
+                                        shape=(len(words), len(lemma_words)))
+    lemma_counts = (matrix @ indicator).tocoo()
+    senses = nsenses.reindex(lemma_words).to_numpy(dtype=float)
+    senses[[is_data_word(lemma) for lemma in lemma_words]] = np.nan
+    order = np.lexsort((lemma_counts.col, lemma_counts.row))
+    return pd.DataFrame({'id': np.asarray(ids)[lemma_counts.row[order]],
+                         'word': np.asarray(lemma_words)[lemma_counts.col[order]],
+                         'nsenses': pd.array(senses[lemma_counts.col[order]], dtype='Int64'),
+                         'count': lemma_counts.data[order]})
+
+def main():
+    parser = argparse.ArgumentParser(description="Lemmatize the BILA noun counts and extract lemma features from WordNet.")
+    parser.add_argument("--vocabulary", type=str, default=vocabulary_file, help="long-form counts whose words are lemmatized")
+    parser.add_argument("--counts", type=str, default=counts_file, help="long-form counts to combine by lemma")
+    parser.add_argument("--output", type=str, default=lemmatized_file, help="lemmatized counts (long form)")
+    parser.add_argument("--features", type=str, default=features_file, help="word, lemma and number of senses")
+    parser.add_argument("--cache", type=str, default=cache_dir, help="folder for the lemma map and lemma features")
+    args = parser.parse_args()
+
+    start = time.time()
+    words = read_words(args.vocabulary)
+    lemmas, nnew_words = lemma_map(words, args.cache)
+    features, nnew_lemmas = feature_table([lemmas[word] for word in words], args.cache)
+    table = pd.DataFrame({'original_word': words, 'lemmatized_word': [lemmas[word] for word in words]})
+    table['nsenses'] = features['nsenses'].reindex(table['lemmatized_word']).to_numpy()
+    table.to_csv(args.features, sep='\t', index=False)
+    print("%d words (%d new), %d lemmas (%d new) in %.1fs" % (len(words), nnew_words, table['lemmatized_word'].nunique(), nnew_lemmas, time.time() - start))
+
+    start = time.time()
+    counts = pd.read_csv(args.counts, usecols=['id', 'word', 'count'], dtype={'id': str, 'word': str}, keep_default_na=False)
+    missing = sorted(set(counts['word']) - set(words))
+    if missing:
+        raise ValueError("words of %s not in %s: %s" % (args.counts, args.vocabulary, ', '.join(missing[:10])))
+    combined = combined_lemmas(words, lemmas, counts['word'].unique())
+    # each lemma gets the maximum number of senses of its words
+    nsenses = pd.Series(table['nsenses'].to_numpy(), index=[combined[word] for word in words]).groupby(level=0).max()
+    lemmatized = lemmatize_counts(counts, combined, nsenses)
+    lemmatized.to_csv(args.output, index=False, na_rep='NA')
+    print("%d words -> %d lemmas, %d counts in %.1fs" % (counts['word'].nunique(), lemmatized['word'].nunique(), len(lemmatized), time.time() - start))
+
+if __name__ == "__main__":
+    main()